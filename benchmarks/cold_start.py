@@ -0,0 +1,76 @@
+"""Cold start time per subcommand, eager Commander loading vs the lazy manifest
+
+python benchmarks/cold_start.py [--runs 10]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+from tabulate import tabulate
+
+from oo_bin.manifest import COMMANDS
+
+EAGER = """
+import os, sys
+import oo_bin.main as m
+from oo_bin.commander import Commander
+Commander(os.path.dirname(m.__file__)).register(m.cli)
+m.cli([sys.argv[1], "--help"])
+"""
+
+LAZY = """
+import sys
+import oo_bin.main as m
+m.cli([sys.argv[1], "--help"])
+"""
+
+
+def measure(code, command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, "-c", code, command],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+
+        if process.returncode != 0:
+            return None
+
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    table = []
+    for command in sorted(set(COMMANDS)):
+        eager = measure(EAGER, command, args.runs)
+        lazy = measure(LAZY, command, args.runs)
+        table.append(
+            [
+                command,
+                f"{eager:.1f}" if eager else "error",
+                f"{lazy:.1f}" if lazy else "error",
+                f"{eager / lazy:.1f}x" if eager and lazy else "",
+            ]
+        )
+
+    print(
+        tabulate(
+            table,
+            ["Command", "Eager (ms)", "Lazy (ms)", "Speedup"],
+            tablefmt="grid",
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
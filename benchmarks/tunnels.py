@@ -0,0 +1,336 @@
+"""Tunnel lifecycle at scale: TunnelManager load, start, status, probe and stop with 1 to 500 tunnels
+
+Runs against stub autossh, ssh and firefox executables, and wrappers counting the calls to ps and kill, in a throwaway
+XDG environment. The stubs ask a broker in this process to listen on their forward port, after --start-delay seconds,
+until they exit. Nothing connects to a real host.
+
+python benchmarks/tunnels.py [--sizes 1 10 100 500] [--start-delay 0.1] [--failure-rate 0.05] [--output tunnels.json]
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import selectors
+import shutil
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from tabulate import tabulate
+
+STUB = """#!{python} -S
+import os, random, socket, sys, time
+
+with open(os.environ["OO_BENCH_CALLS"], "a") as f:
+    f.write("{name}\\n")
+
+args = sys.argv[1:]
+if "-O" in args:
+    # Control commands of a multiplexed connection
+    sys.exit(0)
+
+forwards = [(x[1:], args[i + 1]) for i, x in enumerate(args[:-1]) if x in ["-D", "-L"]]
+if not forwards:
+    os.execv("{sleep}", ["{sleep}", "86400"])
+
+kind, spec = forwards[0]
+delay = float(os.environ["OO_BENCH_START_DELAY"])
+if random.random() < float(os.environ["OO_BENCH_FAILURE_RATE"]):
+    time.sleep(delay)
+    sys.exit(255)
+
+with socket.socket(socket.AF_UNIX) as sock:
+    sock.connect(os.environ["OO_BENCH_BROKER"])
+    sock.sendall(f"{{os.getpid()}} {{kind}} {{spec.split(':')[0]}} {{delay}}\\n".encode())
+    sock.recv(1)
+
+# Keeps the pid, the broker closes the listener once it exits
+os.execv("{sleep}", ["{sleep}", "86400"])
+"""
+
+WRAPPER = """#!/bin/sh
+echo {name} >> "$OO_BENCH_CALLS"
+exec {path} "$@"
+"""
+
+# What the probes expect from a SOCKS5 forward, and from an RDP server behind a -L forward
+REPLIES = {
+    "D": b"\x05\x00",
+    "L": b"\x03\x00\x00\x0b\x06\xd0\x00\x00\x00\x00\x00",
+}
+
+
+class Broker:
+    """Listens on the forward ports of the stubs, in one thread, until the stub process exits"""
+
+    def __init__(self, path):
+        self.__server = socket.socket(socket.AF_UNIX)
+        self.__server.bind(path)
+        self.__server.listen(512)
+
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__server, selectors.EVENT_READ, ("server",))
+        self.__pending = []
+        self.__listeners = {}
+
+        threading.Thread(target=self.__run, daemon=True).start()
+
+    def __run(self):
+        from oo_bin.process import start_times
+
+        checked_at = 0
+        while True:
+            for key, _ in self.__selector.select(0.02):
+                try:
+                    getattr(self, f"_Broker__on_{key.data[0]}")(
+                        key.fileobj, *key.data[1:]
+                    )
+                except OSError:
+                    # A stub stopped halfway, e.g. by a timed out tunnel
+                    pass
+
+            now = time.monotonic()
+            for request in [x for x in self.__pending if x[0] <= now]:
+                self.__pending.remove(request)
+                self.__listen(*request[1:])
+
+            if now - checked_at > 0.05:
+                checked_at = now
+                alive = start_times(self.__listeners)
+                for pid in [x for x in self.__listeners if x not in alive]:
+                    listener = self.__listeners.pop(pid)
+                    self.__selector.unregister(listener)
+                    listener.close()
+
+    def __on_server(self, server):
+        conn, _ = server.accept()
+        with conn:
+            pid, kind, port, delay = conn.makefile().readline().split()
+            conn.sendall(b"\0")
+
+        self.__pending.append(
+            (time.monotonic() + float(delay), int(pid), kind, int(port))
+        )
+
+    def __listen(self, pid, kind, port):
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind(("127.0.0.1", port))
+        except OSError:
+            listener.close()
+            return
+
+        listener.listen(64)
+        listener.setblocking(False)
+        self.__selector.register(listener, selectors.EVENT_READ, ("listener", kind))
+        self.__listeners[pid] = listener
+
+    def __on_listener(self, listener, kind):
+        try:
+            conn, _ = listener.accept()
+        except BlockingIOError:
+            return
+
+        conn.setblocking(False)
+        self.__selector.register(conn, selectors.EVENT_READ, ("conn", kind))
+
+    def __on_conn(self, conn, kind):
+        try:
+            data = conn.recv(1024)
+        except OSError:
+            data = None
+
+        if data:
+            conn.send(REPLIES[kind])
+        else:
+            self.__selector.unregister(conn)
+            conn.close()
+
+
+def setup(root, args):
+    """A throwaway XDG environment, with the stubs first on the PATH. Must run before oo_bin is imported"""
+    bin = os.path.join(root, "bin")
+    os.makedirs(bin)
+
+    stubs = {
+        name: STUB.format(python=sys.executable, sleep=shutil.which("sleep"), name=name)
+        for name in ["autossh", "ssh"]
+    }
+    stubs["firefox"] = WRAPPER.format(name="firefox", path=f"{shutil.which('sleep')}")
+    for name in ["ps", "kill"]:
+        if shutil.which(name):
+            stubs[name] = WRAPPER.format(name=name, path=shutil.which(name))
+
+    for name, content in stubs.items():
+        path = os.path.join(bin, name)
+        with open(path, "w") as f:
+            f.write(content)
+        os.chmod(path, 0o755)
+
+    config = os.path.join(root, "config", "oo_bin")
+    os.makedirs(config)
+    with open(os.path.join(config, "config.toml"), "w") as f:
+        f.write(
+            f'[tunnels]\nmode = "{args.mode}"\nssh_config = "/dev/null"\nport_range = [30000, 30999]\nready_timeout = {args.ready_timeout}\n'
+        )
+    with open(os.path.join(config, "tunnels.toml"), "w") as f:
+        f.write('[bench]\njump_host = "bench.example.com"\n')
+
+    os.environ.update(
+        PATH=f"{bin}{os.pathsep}{os.environ['PATH']}",
+        XDG_CONFIG_HOME=os.path.join(root, "config"),
+        XDG_DATA_HOME=os.path.join(root, "data"),
+        XDG_CACHE_HOME=os.path.join(root, "cache"),
+        XDG_RUNTIME_DIR=os.path.join(root, "runtime"),
+        OO_BENCH_BROKER=os.path.join(root, "broker.sock"),
+        OO_BENCH_CALLS=os.path.join(root, "calls"),
+        OO_BENCH_START_DELAY=str(args.start_delay),
+        OO_BENCH_FAILURE_RATE=str(args.failure_rate),
+    )
+    open(os.environ["OO_BENCH_CALLS"], "w").close()
+
+
+def calls():
+    """How many times each stub ran so far"""
+    counts = {}
+    with open(os.environ["OO_BENCH_CALLS"]) as f:
+        for line in f:
+            counts[line.strip()] = counts.get(line.strip(), 0) + 1
+
+    return counts
+
+
+@contextlib.contextmanager
+def phase(results, name):
+    """Times the block, and counts the stubs it ran"""
+    before = calls()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        yield
+        results[name] = time.perf_counter() - start
+
+    after = calls()
+    for stub in after:
+        count = after[stub] - before.get(stub, 0)
+        if count:
+            results.setdefault("calls", {})[f"{name}.{stub}"] = count
+
+
+def run(size):
+    from oo_bin.errors import OOBinError
+    from oo_bin.tunnels import Rdp, TunnelManager
+
+    manager = TunnelManager()
+    results = {"tunnels": size}
+
+    tunnels = [Rdp("bench", f"10.0.{x // 250}.{x % 250 + 1}") for x in range(size)]
+    with phase(results, "start"):
+        started = manager.up(tunnels, launch=False)
+
+    ready = [x for _, x in started if not isinstance(x, OOBinError)]
+    results["failed"] = size - len(ready)
+    if ready:
+        results["ready_p50"] = statistics.median(ready)
+        results["ready_max"] = max(ready)
+
+    with phase(results, "load"):
+        TunnelManager.__wrapped__()
+
+    with phase(results, "status"):
+        manager.status()
+
+    with phase(results, "probe"):
+        health = manager.probe(manager.tunnels())
+    results["probe_failed"] = len([x for x in health.values() if x is None])
+
+    with phase(results, "stop"):
+        manager.stop(manager.tunnels())
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument(
+        "--start-delay",
+        type=float,
+        default=0.1,
+        help="Seconds before a forward listens",
+    )
+    parser.add_argument(
+        "--failure-rate", type=float, default=0, help="Share of stubs that exit instead"
+    )
+    parser.add_argument(
+        "--ready-timeout",
+        type=float,
+        default=60,
+        help="tunnels.ready_timeout, hundreds of stubs take a while to start on few cores",
+    )
+    parser.add_argument("--mode", choices=["autossh", "supervisor"], default="autossh")
+    parser.add_argument("--output", default="tunnels.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        setup(root, args)
+        Broker(os.environ["OO_BENCH_BROKER"])
+
+        from oo_bin import __version__
+
+        results = [run(x) for x in args.sizes]
+
+        from oo_bin.tunnels.supervisor import Supervisor
+
+        if Supervisor.pid():
+            os.kill(Supervisor.pid(), signal.SIGTERM)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "version": __version__,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.time(),
+                "options": vars(args),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    table = [
+        [
+            x["tunnels"],
+            x["failed"],
+            *[f"{x[key] * 1000:.1f}" for key in ["start", "load", "status", "probe"]],
+            f"{x['stop'] * 1000:.1f}",
+        ]
+        for x in results
+    ]
+    print(
+        tabulate(
+            table,
+            [
+                "Tunnels",
+                "Failed",
+                "Start (ms)",
+                "Load (ms)",
+                "Status (ms)",
+                "Probe (ms)",
+                "Stop (ms)",
+            ],
+            tablefmt="grid",
+        )
+    )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""The `oo` entry point
+
+The invocation is forwarded to a running `oo daemon` when there is one, which already has every module imported and
+the configuration parsed. Otherwise the command runs in-process. Keep the imports of this module to the standard
+library, it runs before anything else on every invocation.
+"""
+
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+
+from oo_bin import __version__
+from oo_bin.runtime import daemon_socket_path
+
+# Commands that need the controlling terminal, or manage the daemon, always run in-process
+LOCAL_COMMANDS = ["daemon", "ssh"]
+
+FORWARDED_SIGNALS = [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]
+
+# The terminal is passed to the daemon with socket.send_fds, new in Python 3.9. Older versions always run in-process
+FORWARDING = hasattr(socket, "send_fds")
+
+
+def send_message(sock, message, fds=None):
+    data = json.dumps(message).encode("utf-8")
+    payload = struct.pack("!I", len(data)) + data
+
+    if fds:
+        socket.send_fds(sock, [payload], fds)
+    else:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """Returns the next (message, fds) from the socket, message is None when the peer went away"""
+    if FORWARDING:
+        data, fds, _, _ = socket.recv_fds(sock, 65536, 3)
+    else:
+        data, fds = sock.recv(65536), []
+
+    while len(data) < 4 or len(data) < 4 + struct.unpack("!I", data[:4])[0]:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return None, fds
+        data += chunk
+
+    length = struct.unpack("!I", data[:4])[0]
+    return json.loads(data[4 : 4 + length].decode("utf-8")), fds
+
+
+def connect(path=None):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path if path else daemon_socket_path())
+    except OSError:
+        sock.close()
+        return None
+
+    return sock
+
+
+def forward(sock):
+    """Runs the command in the daemon, with our argv, environment and terminal. Returns the exit code"""
+    send_message(
+        sock,
+        {
+            "op": "run",
+            "version": __version__,
+            "argv": sys.argv,
+            "env": dict(os.environ),
+            "cwd": os.getcwd(),
+        },
+        [sys.stdin.fileno(), sys.stdout.fileno(), sys.stderr.fileno()],
+    )
+
+    message, _ = recv_message(sock)
+    if not message or "pid" not in message:
+        # The daemon is outdated, it shuts itself down
+        return None
+
+    pid = message["pid"]
+    for sig in FORWARDED_SIGNALS:
+        signal.signal(sig, lambda signum, frame: os.kill(pid, signum))
+
+    message, _ = recv_message(sock)
+    if not message:
+        print("Error: the oo daemon went away", file=sys.stderr)
+        return 1
+
+    return message["exit"]
+
+
+def main():
+    if FORWARDING and not (len(sys.argv) > 1 and sys.argv[1] in LOCAL_COMMANDS):
+        sock = connect()
+        if sock:
+            with sock:
+                exit_code = forward(sock)
+
+            if exit_code is not None:
+                sys.exit(exit_code)
+
+    from oo_bin.main import main as run
+
+    run()
@@ -1,15 +1,19 @@
 import importlib
 import importlib.util
+import os
 from pathlib import Path
 
+import click
+
 
 class Commander:
     """Not quite Cobra, but it snakes it's way through paths to find the common command format"""
 
-    def __init__(self, path):
+    def __init__(self, path=None):
         self.commands = {}
         self.aliases = {}
-        self.load_from_path(path)
+        if path:
+            self.load_from_path(path)
 
     def find_in_path(self, path):
         shim = "shims" in path
@@ -69,10 +73,82 @@ class Commander:
 
     def register(self, cli):
         for cmd in self.commands:
+            if isinstance(cli, LazyGroup):
+                # a shim replacing a canonical command module wins over the manifest
+                cli.forget_module(cmd)
+
             cli.add_command(self.commands[cmd])
-            cli.add_command(self.commands[cmd], name=self.aliases[cmd]) if cmd in self.aliases else None
+            if cmd in self.aliases:
+                cli.add_command(self.commands[cmd], name=self.aliases[cmd])
 
     def load_from_paths(self, *paths):
         # these paths are assumed to be shims as the canonical commands are registered above
         for path in paths:
             self.load_from_path(path)
+
+    def build_manifest(self, path):
+        """Maps every command name, alias and `replaces` entry to the (module, attribute) defining it"""
+        manifest = {}
+        cmds = self.find_in_path(path)
+        for module_name in cmds:
+            cmd_name, _ = cmds[module_name]
+            module = importlib.import_module(f".{module_name}", "oo_bin")
+
+            for replaced, attr in getattr(module, "replaces", {}).items():
+                manifest = {k: v for k, v in manifest.items() if v[0] != replaced}
+                manifest[getattr(module, attr).name] = (module_name, attr)
+
+            if hasattr(module, cmd_name):
+                manifest[getattr(module, cmd_name).name] = (module_name, cmd_name)
+                if hasattr(module, "ALIAS"):
+                    manifest[getattr(module, "ALIAS")] = (module_name, cmd_name)
+
+        return dict(sorted(manifest.items()))
+
+    def write_manifest(self, path, manifest_file):
+        manifest = self.build_manifest(path)
+        with open(manifest_file, "w") as f:
+            f.write(
+                "# Generated by `python -m oo_bin.commander`. Don't change manually.\n"
+            )
+            f.write("COMMANDS = {\n")
+            for name, (module_name, attr) in manifest.items():
+                f.write(f'    "{name}": ("{module_name}", "{attr}"),\n')
+            f.write("}\n")
+
+        return manifest
+
+
+class LazyGroup(click.Group):
+    """A click group that imports a command module only when the command is used
+
+    Commands are looked up in a precomputed manifest (see `oo_bin.manifest`), so `oo hexme` doesn't pay for importing
+    the tunnels, cert or dns modules.
+    """
+
+    def __init__(self, *args, manifest=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.manifest = dict(manifest) if manifest else {}
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(self.manifest))
+
+    def get_command(self, ctx, cmd_name):
+        command = super().get_command(ctx, cmd_name)
+
+        if command is None and cmd_name in self.manifest:
+            module_name, attr = self.manifest[cmd_name]
+            module = importlib.import_module(f".{module_name}", "oo_bin")
+            command = getattr(module, attr)
+            self.add_command(command, name=cmd_name)
+
+        return command
+
+    def forget_module(self, module_name):
+        self.manifest = {k: v for k, v in self.manifest.items() if v[0] != module_name}
+
+
+if __name__ == "__main__":
+    path = os.path.dirname(__file__)
+    manifest = Commander().write_manifest(path, os.path.join(path, "manifest.py"))
+    print(f"Wrote {len(manifest)} commands to {os.path.join(path, 'manifest.py')}")
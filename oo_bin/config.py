@@ -1,4 +1,6 @@
+import copy
 import os
+import pickle
 import sys
 from os.path import exists
 from shutil import copyfile
@@ -27,9 +29,25 @@ tunnels_config_path = os.path.join(
 ssh_config_path = os.path.join(
     BaseDirectory.save_config_path(__package_name), "ssh_config"
 )
+tunnels_snapshot_path = os.path.join(
+    BaseDirectory.save_cache_path(__package_name), "tunnels.snapshot"
+)
 
+# Parsed configuration, validated against the mtime and size of the files they were read from. Callers get copies, so
+# changing what they got, e.g. before save_main_config, never changes the cache
+__configs = {}
+__tunnels_snapshot = {}
 
-def __get_config(path):
+
+def __stat(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def __parse_config(path):
     try:
         with open(path, "rb") as f:
             data = tomllib.load(f)
@@ -42,6 +60,17 @@ def __get_config(path):
         sys.exit(1)
 
 
+def __get_config(path):
+    stat = __stat(path)
+    cached = __configs.get(path)
+
+    if not cached or cached[0] != stat:
+        cached = (stat, __parse_config(path))
+        __configs[path] = cached
+
+    return copy.deepcopy(cached[1])
+
+
 def main_config():
     return __get_config(main_config_path)
 
@@ -51,16 +80,81 @@ def save_main_config(config):
     with open(main_config_path, "wb") as f:
         tomli_w.dump(config, f)
 
+    __configs.pop(main_config_path, None)
+
+
+def __compile_tunnels_config(key):
+    config = __parse_config(tunnels_config_path)
+    config.update(__parse_config(tunnels_local_config_path))
+
+    # (profile, kind, host name) -> host entry, e.g. ("foo", "rdp", "first_rdp")
+    hosts = {}
+    for profile, section in config.items():
+        if not isinstance(section, dict):
+            continue
+
+        for kind, entries in section.items():
+            if isinstance(entries, dict) and isinstance(entries.get("hosts"), list):
+                for host in entries["hosts"]:
+                    if host.get("name", None) is not None:
+                        hosts.setdefault((profile, kind, host["name"]), host)
+
+    return {"key": key, "config": config, "hosts": hosts}
+
+
+def __load_tunnels_snapshot():
+    key = (
+        tunnels_config_path,
+        __stat(tunnels_config_path),
+        tunnels_local_config_path,
+        __stat(tunnels_local_config_path),
+    )
+
+    if __tunnels_snapshot.get("key") == key:
+        return __tunnels_snapshot
+
+    snapshot = None
+    try:
+        with open(tunnels_snapshot_path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+
+    if not isinstance(snapshot, dict) or snapshot.get("key") != key:
+        snapshot = __compile_tunnels_config(key)
+
+        try:
+            tmp_path = f"{tunnels_snapshot_path}.{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, tunnels_snapshot_path)
+        except OSError:
+            pass
+
+    __tunnels_snapshot.clear()
+    __tunnels_snapshot.update(snapshot)
+    return __tunnels_snapshot
+
 
 def tunnels_config(profile=None):
-    local_config = __get_config(tunnels_local_config_path)
-    config = __get_config(tunnels_config_path)
-    config.update(local_config)
+    config = __load_tunnels_snapshot()["config"]
 
     if profile:
-        return config.get(profile, {})
+        return copy.deepcopy(config.get(profile, {}))
+
+    return copy.deepcopy(config)
+
+
+def tunnels_profiles():
+    """The names of the profiles, without copying the whole configuration like tunnels_config() does"""
+    return list(__load_tunnels_snapshot()["config"].keys())
+
 
-    return config
+def tunnel_host(profile, kind, name):
+    """Looks up a named host of a profile, e.g. tunnel_host("foo", "rdp", "first_rdp")"""
+    return copy.deepcopy(
+        __load_tunnels_snapshot()["hosts"].get((profile, kind, name), None)
+    )
 
 
 def backup_tunnels_config():
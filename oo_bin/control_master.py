@@ -0,0 +1,121 @@
+import fcntl
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+from subprocess import DEVNULL, PIPE, Popen, TimeoutExpired, run
+
+from oo_bin.errors import (
+    PortUnavailableError,
+    ProcessFailedError,
+    TunnelTimeoutError,
+)
+from oo_bin.runtime import runtime_path
+
+
+class ControlMaster:
+    """One multiplexed ssh connection per (ssh config, jump host), tunnels add and cancel their forwards on it
+
+    Adding a forward to a live master takes a round trip over a unix socket, rather than a new ssh connection.
+    """
+
+    def __init__(self, ssh_config, jump_host, control_path=None, log_file=os.devnull):
+        self.ssh_config = ssh_config
+        self.jump_host = jump_host
+        self.log_file = log_file
+
+        if not control_path:
+            key = hashlib.sha1(f"{ssh_config}\0{jump_host}".encode("utf-8"))
+            control_path = os.path.join(runtime_path("masters"), key.hexdigest()[:16])
+
+        self.control_path = control_path
+
+    def __ssh(self, *args):
+        return [
+            "ssh",
+            "-F",
+            f"{self.ssh_config}",
+            "-S",
+            self.control_path,
+            *args,
+            f"{self.jump_host}",
+        ]
+
+    def __control(self, command, *args):
+        process = run(
+            self.__ssh("-O", command, *args),
+            stdin=DEVNULL,
+            stdout=PIPE,
+            stderr=PIPE,
+            timeout=10,
+        )
+        output = (process.stdout + process.stderr).decode("utf-8").strip()
+
+        return process.returncode == 0, output
+
+    @contextmanager
+    def __lock(self):
+        # Tunnels to the same jump host, started at the same time, must share one master
+        with open(f"{self.control_path}.lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    @property
+    def pid(self):
+        running, output = self.__control("check")
+        match = re.search(r"pid=(\d+)", output)
+
+        return int(match.group(1)) if running and match else None
+
+    def start(self, timeout):
+        """Connects the master, unless it is already running. Returns its pid"""
+        with self.__lock():
+            pid = self.pid
+            if pid:
+                return pid
+
+            cmd = self.__ssh(
+                "-f",
+                "-N",
+                "-M",
+                "-o",
+                "ControlPersist=yes",
+                "-o",
+                "ServerAliveInterval=3",
+                "-o",
+                "ServerAliveCountMax=30",
+            )
+
+            # ssh forks to the background once it is connected and authenticated
+            with open(self.log_file, "a") as f:
+                process = Popen(cmd, stdout=DEVNULL, stderr=f)
+
+            try:
+                returncode = process.wait(timeout)
+            except TimeoutExpired:
+                process.kill()
+                process.wait()
+                raise TunnelTimeoutError(
+                    f"Could not connect to {self.jump_host} within {timeout}s. You can view the logs at {self.log_file}"
+                )
+
+            if returncode != 0:
+                raise ProcessFailedError(
+                    f"ssh could not connect to {self.jump_host}. You can view the logs at {self.log_file}"
+                )
+
+            return self.pid
+
+    def forward(self, forward):
+        """Adds a forward, e.g. ["-D", "2080"] or ["-L", "60001:192.168.1.1:3389"]"""
+        added, output = self.__control("forward", *forward)
+        if not added:
+            raise PortUnavailableError(
+                f"Could not forward {' '.join(forward)} over {self.jump_host}: {output}"
+            )
+
+    def cancel(self, forward):
+        return self.__control("cancel", *forward)[0]
+
+    def exit(self):
+        return self.__control("exit")[0]
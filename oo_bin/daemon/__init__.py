@@ -0,0 +1,256 @@
+import importlib
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from oo_bin import __version__
+from oo_bin.client import connect, recv_message, send_message
+from oo_bin.config import main_config, tunnels_profiles
+from oo_bin.manifest import COMMANDS
+from oo_bin.runtime import daemon_socket_path
+
+# Seconds between runs of the idle tunnel reaper
+REAP_INTERVAL = 60
+# Seconds a client has to send its request, the daemon serves one connection at a time
+REQUEST_TIMEOUT = 2
+
+
+class Daemon:
+    """Serves `oo` invocations forwarded by `oo_bin.client` over a unix socket
+
+    Every module is imported and the configuration parsed once, up front. Each invocation runs in a forked child, so a
+    command can't leave state behind, with the client's argv, environment and terminal.
+    """
+
+    def __init__(self, path=None):
+        self.path = path if path else daemon_socket_path()
+        self.started_at = time.time()
+        self.requests = 0
+        self.__server = None
+        self.__running = False
+        self.__state_version = None
+        self.__reaped_at = time.monotonic()
+        self.__reaper_pid = None
+
+    @staticmethod
+    def ping(path=None):
+        sock = connect(path)
+        if not sock:
+            return None
+
+        with sock:
+            send_message(sock, {"op": "ping"})
+            message, _ = recv_message(sock)
+            return message
+
+    @staticmethod
+    def shutdown(path=None):
+        sock = connect(path)
+        if not sock:
+            return False
+
+        with sock:
+            send_message(sock, {"op": "stop"})
+            recv_message(sock)
+            return True
+
+    def warm(self):
+        for module_name in set(x[0] for x in COMMANDS.values()):
+            try:
+                importlib.import_module(f".{module_name}", "oo_bin")
+            except ImportError:
+                # The child fails, and reports it, the same way a regular invocation does
+                traceback.print_exc()
+
+        main_config()
+        tunnels_profiles()
+        self.refresh()
+
+    def refresh(self):
+        """Keeps the configuration and tunnel registry inherited by the next child current"""
+        main_config()
+        tunnels_profiles()
+
+        if "oo_bin.tunnels" not in sys.modules:
+            return
+
+        from oo_bin.tunnels import TunnelManager
+        from oo_bin.tunnels.state_store import StateStore
+
+        manager = TunnelManager()
+        state_version = StateStore().version()
+
+        if state_version != self.__state_version:
+            manager.reload()
+        else:
+            manager.prune()
+
+        self.__state_version = state_version
+
+    def serve(self):
+        self.warm()
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self.__server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # The socket runs commands as us, it's created private rather than made private once other users could connect
+        umask = os.umask(0o177)
+        try:
+            self.__server.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.__server.listen(32)
+        self.__server.settimeout(1)
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+
+        self.__running = True
+        try:
+            while self.__running:
+                self.__reap()
+                self.__reap_idle_tunnels()
+
+                try:
+                    conn, _ = self.__server.accept()
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+
+                conn.settimeout(REQUEST_TIMEOUT)
+                self.__handle(conn)
+        finally:
+            self.__server.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def stop(self):
+        self.__running = False
+
+    def __handle(self, conn):
+        fds = []
+        try:
+            message, fds = recv_message(conn)
+            conn.settimeout(None)
+            op = message.get("op") if message else None
+
+            if op == "ping":
+                send_message(
+                    conn,
+                    {
+                        "pid": os.getpid(),
+                        "version": __version__,
+                        "uptime": time.time() - self.started_at,
+                        "requests": self.requests,
+                    },
+                )
+            elif op == "stop":
+                send_message(conn, {"stopped": True})
+                self.stop()
+            elif op == "run" and message.get("version") != __version__:
+                # oo_bin was upgraded, the client runs the command itself and we make way for a new daemon
+                send_message(conn, {"outdated": True})
+                self.stop()
+            elif op == "run":
+                self.requests += 1
+                self.refresh()
+
+                pid = os.fork()
+                if pid == 0:
+                    self.__run(conn, message, fds)
+        except socket.timeout:
+            # A client that connected and sent nothing, or too little
+            pass
+        except Exception:
+            traceback.print_exc()
+        finally:
+            for fd in fds:
+                os.close(fd)
+            conn.close()
+
+    def __run(self, conn, message, fds):
+        exit_code = 1
+        try:
+            self.__server.close()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            fds.clear()
+
+            sys.stdin = open(0, "r", closefd=False)
+            sys.stdout = open(
+                1, "w", buffering=1 if os.isatty(1) else -1, closefd=False
+            )
+            sys.stderr = open(2, "w", buffering=1, closefd=False)
+
+            os.environ.clear()
+            os.environ.update(message["env"])
+            os.chdir(message["cwd"])
+            sys.argv = message["argv"]
+
+            send_message(conn, {"pid": os.getpid()})
+
+            from oo_bin.main import main
+
+            try:
+                main(prog_name=os.path.basename(sys.argv[0]))
+                exit_code = 0
+            except SystemExit as e:
+                if e.code is None:
+                    exit_code = 0
+                elif isinstance(e.code, int):
+                    exit_code = e.code
+                else:
+                    print(e.code, file=sys.stderr)
+            except KeyboardInterrupt:
+                exit_code = 130
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                send_message(conn, {"exit": exit_code})
+            finally:
+                os._exit(0)
+
+    def __reap_idle_tunnels(self):
+        """Stops idle tunnels in a forked child, stopping them waits on their ports and would hold up clients"""
+        if time.monotonic() - self.__reaped_at < REAP_INTERVAL or self.__reaper_pid:
+            return
+        self.__reaped_at = time.monotonic()
+
+        if "oo_bin.tunnels" not in sys.modules:
+            return
+
+        self.__reaper_pid = os.fork()
+        if self.__reaper_pid == 0:
+            try:
+                self.__server.close()
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+                from oo_bin.tunnels import TunnelManager
+                from oo_bin.tunnels.reaper import Reaper
+
+                Reaper(TunnelManager()).reap()
+                sys.stdout.flush()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                os._exit(0)
+
+    def __reap(self):
+        try:
+            while True:
+                pid = os.waitpid(-1, os.WNOHANG)[0]
+                if pid <= 0:
+                    break
+                if pid == self.__reaper_pid:
+                    self.__reaper_pid = None
+        except ChildProcessError:
+            pass
@@ -0,0 +1,3 @@
+from oo_bin.daemon import Daemon
+
+Daemon().serve()
@@ -0,0 +1,85 @@
+import os
+import sys
+import time
+from subprocess import DEVNULL, Popen
+
+import click
+from colorama import Fore, Style
+from xdg import BaseDirectory
+
+from oo_bin.client import FORWARDING
+from oo_bin.daemon import Daemon
+
+
+@click.group(
+    help="Keep oo warm in the background, for instant commands and completions"
+)
+def daemon():
+    pass
+
+
+@daemon.command(help="Start the daemon")
+@click.option("--foreground", is_flag=True, help="Don't detach from the terminal")
+def start(foreground):
+    if not FORWARDING:
+        print(
+            Fore.RED
+            + "The oo daemon needs Python 3.9 or later, commands run in-process without it",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    status = Daemon.ping()
+    if status:
+        print(
+            f"The oo daemon is already running, with PID: {Style.BRIGHT}{status['pid']}"
+        )
+        return
+
+    if foreground:
+        Daemon().serve()
+        return
+
+    log_file = os.path.join(BaseDirectory.save_cache_path("oo_bin"), "daemon.log")
+    with open(log_file, "a") as f:
+        Popen(
+            [sys.executable, "-m", "oo_bin.daemon"],
+            stdin=DEVNULL,
+            stdout=f,
+            stderr=f,
+            start_new_session=True,
+        )
+
+    for i in range(0, 50):
+        time.sleep(0.1)
+        status = Daemon.ping()
+        if status:
+            print(f"The oo daemon is running, with PID: {Style.BRIGHT}{status['pid']}")
+            return
+
+    print(
+        Fore.RED + f"The oo daemon did not start. You can view the logs at {log_file}",
+        file=sys.stderr,
+    )
+    sys.exit(1)
+
+
+@daemon.command(help="Stop the daemon")
+def stop():
+    if Daemon.shutdown():
+        print("The oo daemon was stopped")
+    else:
+        print(f"{Style.BRIGHT}The oo daemon is not running")
+
+
+@daemon.command(help="Daemon status")
+def status():
+    status = Daemon.ping()
+    if not status:
+        print(f"{Style.BRIGHT}The oo daemon is not running")
+        return
+
+    print(f"PID:      {status['pid']}")
+    print(f"Version:  {status['version']}")
+    print(f"Uptime:   {int(status['uptime'])}s")
+    print(f"Requests: {status['requests']}")
@@ -40,3 +40,7 @@ class HttpError(OOBinError):
 
 class PortUnavailableError(OOBinError):
     pass
+
+
+class TunnelTimeoutError(OOBinError):
+    pass
@@ -6,32 +6,25 @@ from time import time
 
 import click
 import colorama
-import sentry_sdk
 from xdg import BaseDirectory
 
 from oo_bin import __version__
-from oo_bin.commander import Commander
+from oo_bin.commander import Commander, LazyGroup
 from oo_bin.config import main_config
 from oo_bin.errors import OOBinError
-from oo_bin.utils import auto_update, update_package, update_tunnels_config
+from oo_bin.manifest import COMMANDS
+from oo_bin.utils import auto_update
 
-dsn = main_config().get("sentry", {}).get("dsn", None)
 
-sentry_sdk.init(
-    dsn=dsn,
-    traces_sample_rate=0.1,
-)
-
-colorama.init(autoreset=True)
-
-
-@click.group(invoke_without_command=True)
+@click.group(cls=LazyGroup, manifest=COMMANDS, invoke_without_command=True)
 @click.version_option(__version__)
 @click.option("-u", "--update", is_flag=True, help="Update")
 @click.option("-t", "--update-tag", help="Update to a specific release", default="")
 @click.pass_context
 def cli(ctx, update, update_tag):
     if update or update_tag != "":
+        from oo_bin.updater import update_package, update_tunnels_config
+
         update_tunnels_config()
         update_package(update_tag)
         return
@@ -41,35 +34,51 @@ def cli(ctx, update, update_tag):
         return None
 
 
-def main():
+def report_exception(e):
+    """Upload an unhandled error to sentry, or log it to a file when no dsn is configured
+
+    Sentry is only imported and initialised here, so commands that succeed never pay for it.
+    """
+    dsn = main_config().get("sentry", {}).get("dsn", None)
+
+    if dsn:
+        import sentry_sdk
+
+        sentry_sdk.init(
+            dsn=dsn,
+            traces_sample_rate=0.1,
+        )
+        sentry_sdk.capture_exception(e)
+        return None
+
+    error_path = Path(
+        os.path.join(BaseDirectory.save_data_path("oo_bin"), f"error_{int(time())}")
+    )
+    with open(error_path, "w") as f:
+        traceback.print_exception(type(e), e, e.__traceback__, file=f)
+
+    return f"""Report this error by sending a Slack message to the OO #dev channel.
+Attach the file: {error_path}"""
+
+
+def main(prog_name=None):
+    colorama.init(autoreset=True)
+
     try:
         auto_update()
-        cmds = Commander(os.path.dirname(__file__))
+        cmds = Commander()
         cmds.load_from_path(
             os.path.join(BaseDirectory.save_data_path("oo_bin"), "shims")
         )
         cmds.register(cli)
-        cli()
+        cli(prog_name=prog_name)
     except OOBinError as e:
         # Handled errors, these errors should not be uploaded to sentry
         print(colorama.Fore.RED + f"Error: {e}", file=sys.stderr)
         sys.exit(1)
     except Exception as e:
         # Unhandled errors, log to file, or upload to sentry
-        if dsn:
-            sentry_sdk.capture_exception(e)
-        else:
-            error_path = Path(
-                os.path.join(
-                    BaseDirectory.save_data_path("oo_bin"), f"error_{int(time())}"
-                )
-            )
-            with open(error_path, "w") as f:
-                e_type, e_val, e_tb = sys.exc_info()
-                traceback.print_exception(e_type, e_val, e_tb, file=f)
-
-            report_error = f"""Report this error by sending a Slack message to the OO #dev channel.
-Attach the file: {error_path}"""
+        report_error = report_exception(e)
 
         print(colorama.Fore.RED + f"Error: {e}", file=sys.stderr)
 
@@ -0,0 +1,16 @@
+# Generated by `python -m oo_bin.commander`. Don't change manually.
+COMMANDS = {
+    "cert": ("cert.command", "cert"),
+    "certme": ("cert.command", "cert"),
+    "daemon": ("daemon.command", "daemon"),
+    "dnsme": ("dnsme.command", "dnsme"),
+    "hexme": ("hexme.command", "hexme"),
+    "keyme": ("keyme.command", "keyme"),
+    "macme": ("macme.command", "macme"),
+    "passme": ("passme.command", "passme"),
+    "ping": ("ping.command", "ping"),
+    "rdp": ("tunnels.command.rdp", "rdp"),
+    "ssh": ("ssh.command", "ssh"),
+    "tunnels": ("tunnels.command.tunnels", "tunnels"),
+    "vnc": ("tunnels.command.vnc", "vnc"),
+}
@@ -2,15 +2,13 @@ import os
 
 from click.shell_completion import CompletionItem
 
-from oo_bin.config import tunnels_config
+from oo_bin.config import tunnels_config, tunnels_profiles
 from oo_bin.utils import is_linux, is_mac, is_wsl
 
 
 class Ping:
     def ping(self, profile):
-        config = tunnels_config()
-        section = config.get(profile, {})
-        jump_host = section.get("jump_host", None)
+        jump_host = tunnels_config(profile).get("jump_host", None)
 
         cmd = ["ping"]
         if is_linux() or is_wsl():
@@ -24,8 +22,7 @@ class Ping:
 
     @staticmethod
     def shell_complete(ctx, param, incomplete):
-        config = tunnels_config()
-        tunnels_list = list(config.keys())
+        tunnels_list = tunnels_profiles()
         completions = [
             CompletionItem(k, help="Ping")
             for k in tunnels_list
@@ -0,0 +1,273 @@
+import os
+import re
+import signal
+import time
+from collections import namedtuple
+from subprocess import PIPE, Popen
+
+
+def __exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, but owned by someone else
+        return True
+
+    return True
+
+
+def __proc_start_times(pids):
+    start_times = {}
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+
+        # The command name can contain spaces and parentheses, the fields after it can't
+        fields = stat[stat.rindex(b")") + 2 :].split()
+        if fields[0] in [b"Z", b"X"]:
+            # Exited, but not reaped by its parent yet
+            continue
+
+        start_times[pid] = fields[19].decode("utf-8")
+
+    return start_times
+
+
+def __ps_start_times(pids):
+    start_times = {}
+    cmd = ["ps", "-o", "pid=,stat=,lstart=", "-p", ",".join([str(x) for x in pids])]
+    output, _ = Popen(cmd, stdout=PIPE, stderr=PIPE).communicate(timeout=5)
+
+    for line in output.decode("utf-8").splitlines():
+        pid, stat, lstart = line.strip().split(None, 2)
+        if not stat.startswith("Z"):
+            start_times[int(pid)] = lstart.strip()
+
+    return start_times
+
+
+def start_times(pids):
+    """Maps each running pid to an opaque start time, which tells a process apart from a later one with the same pid
+
+    Checks any number of pids in one pass: a signal 0 and a /proc read per pid on Linux, one `ps` elsewhere.
+    """
+    pids = [x for x in set(int(x) for x in pids if x) if __exists(x)]
+    if not pids:
+        return {}
+
+    if os.path.isdir("/proc/self"):
+        return __proc_start_times(pids)
+
+    return __ps_start_times(pids)
+
+
+def start_time(pid):
+    return start_times([pid]).get(int(pid), None) if pid else None
+
+
+def running(processes):
+    """The pids of the (pid, start time) pairs that are still running
+
+    A pid whose start time changed was recycled by another process. Pass None as the start time to skip the check.
+    """
+    processes = [(int(pid), start) for pid, start in processes if pid]
+    current = start_times([pid for pid, _ in processes])
+
+    return set(
+        pid
+        for pid, start in processes
+        if pid in current and (start is None or current[pid] == start)
+    )
+
+
+def terminate(processes, timeout=2):
+    """Stops (pid, start time) pairs at once: SIGTERM, then SIGKILL for the ones still running after timeout seconds
+
+    Returns the pids that are still running.
+    """
+    processes = [(int(pid), start) for pid, start in processes if pid]
+    alive = running(processes)
+
+    for signum in [signal.SIGTERM, signal.SIGKILL]:
+        for pid in alive:
+            try:
+                os.kill(pid, signum)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+        deadline = time.monotonic() + timeout
+        while alive and time.monotonic() < deadline:
+            time.sleep(0.01)
+            alive = running([x for x in processes if x[0] in alive])
+
+        if not alive:
+            break
+
+    return alive
+
+
+# ssh options that take an argument, autossh adds -M for its monitoring port
+SSH_OPTIONS_WITH_ARGUMENT = "BbcDEeFIiJLlmOoPpQRSWw"
+
+
+class Forward(
+    namedtuple("Forward", ["kind", "bind_address", "port", "host", "remote_port"])
+):
+    def __str__(self):
+        if self.kind == "D":
+            return f"-D {self.port}"
+
+        return f"-{self.kind} {self.port}:{self.host}:{self.remote_port}"
+
+
+SshProcess = namedtuple(
+    "SshProcess", ["pid", "program", "destination", "forwards", "ssh_config"]
+)
+
+
+def __parse_forward(kind, spec):
+    # [bind_address:]port for -D, [bind_address:]port:host:hostport for -L, IPv6 addresses are in brackets
+    parts = [x.strip("[]") for x in re.split(r":(?![^\[]*\])", spec)]
+
+    if kind == "D" and len(parts) in [1, 2]:
+        bind_address, port, host, remote_port = ([None] + parts)[-2:] + [None, None]
+    elif kind == "L" and len(parts) in [3, 4]:
+        bind_address, port, host, remote_port = ([None] + parts)[-4:]
+    else:
+        return None
+
+    if not port.isdigit():
+        # Forwarding a unix socket
+        return None
+
+    return Forward(
+        kind,
+        bind_address or None,
+        int(port),
+        host,
+        int(remote_port) if remote_port and remote_port.isdigit() else remote_port,
+    )
+
+
+def ssh_process(pid, argv):
+    """Parses the argument vector of an autossh or ssh process, None for any other program"""
+    program = os.path.basename(argv[0]) if argv else None
+    if program not in ["autossh", "ssh"]:
+        return None
+
+    with_argument = SSH_OPTIONS_WITH_ARGUMENT + ("M" if program == "autossh" else "")
+    destination = None
+    forwards = []
+    ssh_config = None
+
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == "--":
+            destination = next(args, None)
+            break
+
+        if not arg.startswith("-") or arg == "-":
+            destination = arg
+            break
+
+        for i, flag in enumerate(arg[1:], 2):
+            if flag in with_argument:
+                value = arg[i:] or next(args, "")
+                if flag in ["D", "L"]:
+                    forward = __parse_forward(flag, value)
+                    if forward:
+                        forwards.append(forward)
+                elif flag == "F":
+                    ssh_config = value
+                break
+
+    return SshProcess(pid, program, destination, forwards, ssh_config)
+
+
+def __proc_cmdlines():
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as f:
+                cmdline = f.read()
+        except OSError:
+            continue
+
+        # Arguments are NUL terminated, kernel threads have no command line
+        argv = [x.decode("utf-8", "replace") for x in cmdline.split(b"\0")[:-1]]
+        if argv:
+            yield int(entry), argv
+
+
+def __ps_cmdlines():
+    cmd = ["ps", "-axww", "-o", "pid=,command="]
+    output, _ = Popen(cmd, stdout=PIPE, stderr=PIPE).communicate(timeout=5)
+
+    for line in output.decode("utf-8").splitlines():
+        pid, _, command = line.strip().partition(" ")
+        yield int(pid), command.split()
+
+
+def ssh_processes():
+    """Every running autossh and ssh process, with the ports it forwards
+
+    Walks /proc once on Linux, runs a single `ps` elsewhere.
+    """
+    cmdlines = __proc_cmdlines() if os.path.isdir("/proc/self") else __ps_cmdlines()
+    processes = [ssh_process(pid, argv) for pid, argv in cmdlines]
+
+    return [x for x in processes if x]
+
+
+def forwarding(port, processes=None):
+    """The autossh and ssh processes listening on a local port"""
+    processes = ssh_processes() if processes is None else processes
+
+    return [x for x in processes if int(port) in [f.port for f in x.forwards]]
+
+
+TCP_ESTABLISHED = "01"
+
+
+def established(ports):
+    """Counts the established connections to each local port, from one read of /proc/net/tcp and /proc/net/tcp6
+
+    Returns None where /proc/net isn't available, e.g. on macOS.
+    """
+    counts = dict.fromkeys([int(x) for x in ports], 0)
+    found = False
+
+    for path in ["/proc/net/tcp", "/proc/net/tcp6"]:
+        try:
+            with open(path) as f:
+                lines = f.readlines()[1:]
+        except OSError:
+            continue
+
+        found = True
+        for line in lines:
+            # sl local_address rem_address st ..., addresses are hex, e.g. 0100007F:0822
+            fields = line.split()
+            port = int(fields[1].rpartition(":")[2], 16)
+            if fields[3] == TCP_ESTABLISHED and port in counts:
+                counts[port] += 1
+
+    return counts if found else None
+
+
+def io_counters(pid):
+    """The bytes a process read and wrote so far, sockets included, None when they can't be read"""
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            fields = dict(x.split(": ") for x in f.read().splitlines())
+    except (OSError, ValueError):
+        return None
+
+    return int(fields["rchar"]), int(fields["wchar"])
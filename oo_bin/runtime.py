@@ -0,0 +1,15 @@
+import os
+
+from xdg import BaseDirectory
+
+
+def runtime_path(*dirs):
+    """Private directory for sockets and other per-session files, e.g. runtime_path("masters")"""
+    path = os.path.join(BaseDirectory.get_runtime_dir(strict=False), "oo_bin", *dirs)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+
+    return path
+
+
+def daemon_socket_path():
+    return os.path.join(runtime_path(), "daemon.sock")
@@ -1,27 +1,35 @@
+import hashlib
 import os
+import shlex
+from pathlib import Path
 
 from click.shell_completion import CompletionItem
 
 from oo_bin.config import (
     main_config,
     ssh_config_path,
+    tunnel_host,
     tunnels_config,
     tunnels_config_path,
+    tunnels_profiles,
 )
+from oo_bin.control_master import ControlMaster
 from oo_bin.errors import OOBinError
+from oo_bin.runtime import runtime_path
+
+# Masters of `oo ssh` sessions, next to the tunnel masters, see oo_bin.control_master
+MASTER_PREFIX = "ssh-"
 
 
 class Ssh:
     def connect(self, profile, host=""):
-        jump_host = tunnels_config().get(profile, {}).get("jump_host", None)
-        hosts_config = tunnels_config().get(profile, {}).get("ssh", {}).get("hosts", [])
-        hosts_config = [x for x in hosts_config if x.get("name", None) == host]
+        jump_host = tunnels_config(profile=profile).get("jump_host", None)
+        host_config = tunnel_host(profile, "ssh", host)
 
         ssh_host = ""
         ssh_port = "22"
 
-        if len(hosts_config) > 0:
-            host_config = hosts_config[0]
+        if host_config:
             ssh_host = host_config.get("host", "")
             ssh_port = host_config.get("port", "22")
         else:
@@ -38,19 +46,111 @@ class Ssh:
             )
 
         ssh_config = main_config().get("tunnels", {}).get("ssh_config", ssh_config_path)
+        multiplex = self.__multiplex_options(ssh_config, jump_host)
 
-        if host:
+        if host and multiplex:
+            # -J doesn't pass options on to the jump host connection, so it couldn't reuse a master
+            proxy_cmd = self.__shell_join(
+                ["ssh", "-F", ssh_config] + multiplex + ["-W", "%h:%p", jump_host]
+            )
+            cmd = (
+                ["ssh", "-F", ssh_config]
+                + self.__multiplex_options(
+                    ssh_config, jump_host, f"{ssh_host}:{ssh_port}"
+                )
+                + ["-o", f"ProxyCommand={proxy_cmd}", "-p", ssh_port, ssh_host]
+            )
+        elif host:
             cmd = ["ssh", "-F", ssh_config, "-J", jump_host, "-p", ssh_port, ssh_host]
         else:
-            cmd = ["ssh", "-F", ssh_config, jump_host]
+            cmd = ["ssh", "-F", ssh_config] + multiplex + [jump_host]
 
         os.spawnvpe(os.P_WAIT, "ssh", cmd, os.environ)
         return cmd
 
+    @staticmethod
+    def control_path(ssh_config, jump_host, destination=None):
+        """The control path of the master to destination, host:port behind the jump host, or the jump host itself
+
+        The same host can be a different machine behind another jump host, or through another ssh config. The path is a
+        hash, like the masters of tunnels, so long host names don't go past the length limit of unix sockets.
+        """
+        key = hashlib.sha1(
+            f"{ssh_config}\0{jump_host}\0{destination or jump_host}".encode("utf-8")
+        )
+
+        return os.path.join(
+            runtime_path("masters"), f"{MASTER_PREFIX}{key.hexdigest()[:16]}"
+        )
+
+    @staticmethod
+    def __shell_join(args):
+        """shlex.join, which is new in Python 3.8"""
+        return " ".join(shlex.quote(x) for x in args)
+
+    @staticmethod
+    def __multiplex_options(ssh_config, jump_host, destination=None):
+        """Keeps a master connection open after each session, so the next one to the same host skips the handshake"""
+        persist = main_config().get("ssh", {}).get("control_persist", "10m")
+        if not persist or persist == "no":
+            return []
+
+        control_path = Ssh.control_path(ssh_config, jump_host, destination)
+        # The name of the master, for masters(), the hashed path doesn't tell
+        name = f"{destination} via {jump_host}" if destination else jump_host
+        Path(f"{control_path}.name").write_text(name)
+
+        return [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={control_path}",
+            "-o",
+            f"ControlPersist={persist}",
+        ]
+
+    @staticmethod
+    def masters():
+        """The (name, pid) of each master kept open by `oo ssh`, the pid is None for stale sockets"""
+        ssh_config = main_config().get("tunnels", {}).get("ssh_config", ssh_config_path)
+
+        masters = []
+        for path in sorted(Path(runtime_path("masters")).glob(f"{MASTER_PREFIX}*")):
+            if path.is_socket():
+                master = ControlMaster(ssh_config, "oo", control_path=str(path))
+                masters.append((Ssh.__master_name(path), master.pid))
+
+        return masters
+
+    @staticmethod
+    def __master_name(path):
+        """The host of the master, saved next to its control path"""
+        try:
+            return Path(f"{path}.name").read_text()
+        except OSError:
+            return path.name
+
+    @staticmethod
+    def close_masters():
+        ssh_config = main_config().get("tunnels", {}).get("ssh_config", ssh_config_path)
+
+        closed = []
+        for path in sorted(Path(runtime_path("masters")).glob(f"{MASTER_PREFIX}*")):
+            if path.is_socket():
+                ControlMaster(ssh_config, "oo", control_path=str(path)).exit()
+                closed.append(Ssh.__master_name(path))
+
+                for file in [path, Path(f"{path}.name")]:
+                    try:
+                        file.unlink()
+                    except FileNotFoundError:
+                        pass
+
+        return closed
+
     @staticmethod
     def profile_complete(ctx, param, incomplete):
-        config = tunnels_config()
-        tunnels_list = list(config.keys())
+        tunnels_list = tunnels_profiles()
         completions = [
             CompletionItem(k, help="Ssh")
             for k in tunnels_list
@@ -62,10 +162,7 @@ class Ssh:
     @staticmethod
     def host_complete(ctx, param, incomplete):
         hosts_config = (
-            tunnels_config()
-            .get(ctx.params["profile"], {})
-            .get("ssh", {})
-            .get("hosts", [])
+            tunnels_config(ctx.params["profile"]).get("ssh", {}).get("hosts", [])
         )
 
         hosts_list = [x for x in hosts_config if x.get("name", False)]
@@ -1,11 +1,32 @@
 import click
+import tabulate as t
+from colorama import Style
 
 from oo_bin.ssh import Ssh
 
 
 @click.command(help="Ssh to the profile's jump host")
-@click.argument("profile", shell_complete=Ssh.profile_complete)
+@click.argument("profile", shell_complete=Ssh.profile_complete, required=False)
 @click.argument("host", shell_complete=Ssh.host_complete, required=False)
-def ssh(profile, host):
+@click.option("--masters", is_flag=True, help="List the open master connections")
+@click.option("--close-masters", is_flag=True, help="Close the open master connections")
+def ssh(profile, host, masters, close_masters):
+    if close_masters:
+        closed = Ssh.close_masters()
+        print(f"Closed {len(closed)} master connections")
+        return
+
+    if masters:
+        table = [[name, pid if pid else "Stale"] for name, pid in Ssh.masters()]
+        if table:
+            print(t.tabulate(table, ["Master", "PID"], tablefmt="grid"))
+        else:
+            print(f"{Style.BRIGHT}No master connections are open.")
+        return
+
+    if not profile:
+        click.echo(click.get_current_context().get_help())
+        return
+
     ssh = Ssh()
     ssh.connect(profile, host)
@@ -1,14 +1,20 @@
+import configparser
 import getpass
 import os
-from pathlib import Path
+from pathlib import Path, PureWindowsPath
 from shutil import ignore_patterns
 
 import mozfile
 import wslPath
 from mozprofile.profile import FirefoxProfile
 
+from oo_bin.tunnels.profile_clone import ProfileCloner
+from oo_bin.tunnels.routing import PAC_HEADER
 from oo_bin.utils import is_linux, is_mac, is_wsl, wsl_user
 
+# Caches, and the browsing history, aren't worth cloning
+IGNORE = ignore_patterns("cache2", "lock", "places.sqlite", "startupCache", "storage")
+
 
 class BrowserProfile:
     def __init__(self, browser_profile):
@@ -26,6 +32,30 @@ class BrowserProfile:
             f.write('user_pref("network.trr.blocklist_cleanup_done", true);\n')
             f.write('user_pref("network.trr.mode", 5);')
 
+        # Not used anymore, and a later launch would take it for split routing, see has_proxy_autoconfig
+        if self.has_proxy_autoconfig(self.path):
+            os.remove(os.path.join(self.path, "proxy.pac"))
+
+    def set_proxy_autoconfig(self, pac):
+        """Proxies through the proxy auto-config file pac, see routing.pac, instead of a single SOCKS proxy"""
+        pac_path = Path(self.path) / "proxy.pac"
+        pac_path.write_text(pac)
+
+        # Firefox on Windows reads it from the Windows path of the profile
+        url = (
+            (PureWindowsPath(self.normalized_path) / "proxy.pac").as_uri()
+            if is_wsl()
+            else pac_path.as_uri()
+        )
+
+        with open(os.path.join(self.path, "user.js"), "w") as f:
+            f.write(f'user_pref("network.proxy.autoconfig_url", "{url}");\n')
+            f.write('user_pref("network.proxy.socks_remote_dns", true);\n')
+            f.write('user_pref("network.proxy.socks5_remote_dns", true);\n')
+            f.write('user_pref("network.proxy.type", 2);\n')
+            f.write('user_pref("network.trr.blocklist_cleanup_done", true);\n')
+            f.write('user_pref("network.trr.mode", 5);')
+
     @property
     def path(self):
         return self.profile.profile
@@ -47,14 +77,56 @@ class BrowserProfile:
         #     else self.__find_primary_profile_path__()
         # )
 
-        return FirefoxProfile.clone(
-            primary_profile_path,
-            path_to=profile_path,
-            ignore=ignore_patterns(
-                "cache2", "lock", "places.sqlite", "startupCache", "storage"
-            ),
-            restore=False,
-        )
+        cloner = ProfileCloner(ignore=IGNORE)
+        cloner.clone(primary_profile_path, profile_path)
+
+        # Like FirefoxProfile.clone, which copied the whole profile
+        profile = FirefoxProfile(profile_path, restore=False)
+        profile.create_new = True
+        profile.clone_stats = cloner.stats
+
+        return profile
+
+    @staticmethod
+    def sync(profile_path):
+        """Brings a cloned profile up to date with the profile it was cloned from. Returns the stats of the sync"""
+        cloner = ProfileCloner(ignore=IGNORE)
+        cloner.sync(profile_path)
+
+        return cloner.stats
+
+    @staticmethod
+    def is_clone(profile_path):
+        return ProfileCloner.manifest(profile_path) is not None
+
+    @staticmethod
+    def has_proxy_autoconfig(profile_path):
+        """Whether the profile uses a proxy.pac written by set_proxy_autoconfig"""
+        try:
+            with open(os.path.join(profile_path, "proxy.pac")) as f:
+                return f.readline().rstrip("\n") == PAC_HEADER
+        except OSError:
+            return False
+
+    @staticmethod
+    def update_proxy_autoconfig(profile_path, pac):
+        """Rewrites the proxy.pac written by set_proxy_autoconfig, and nothing else of the profile"""
+        if BrowserProfile.has_proxy_autoconfig(profile_path):
+            Path(profile_path, "proxy.pac").write_text(pac)
+
+    @staticmethod
+    def firefox_profile_path(name):
+        """The path of a Firefox profile, by its name in profiles.ini"""
+        config = configparser.ConfigParser()
+        config.read(os.path.join(BrowserProfile.primary_profile_path(), "profiles.ini"))
+
+        for key in config:
+            if config[key].get("Name", None) == name:
+                return os.path.join(
+                    BrowserProfile.primary_profile_path(), config[key].get("Path")
+                )
+
+        return None
 
     @staticmethod
     def primary_profile_path():
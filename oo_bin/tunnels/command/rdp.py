@@ -53,6 +53,9 @@ def stopall():
 
 
 @rdp.command(help="Tunnels status")
-def status():
+@click.option(
+    "--probe", is_flag=True, help="Check that each tunnel passes traffic, and how fast"
+)
+def status(probe):
     manager = TunnelManager()
-    manager.status()
+    manager.status(probe=probe)
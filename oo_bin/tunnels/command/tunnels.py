@@ -1,4 +1,3 @@
-import configparser
 import os
 import shutil
 from datetime import datetime
@@ -10,9 +9,17 @@ import tabulate as t
 from colorama import Style
 from xdg import BaseDirectory
 
+from oo_bin.config import tunnels_config
+from oo_bin.errors import OOBinError, ProcessFailedError
 from oo_bin.tunnels import Completions, TunnelManager
 from oo_bin.tunnels.browser_profile import BrowserProfile
+from oo_bin.tunnels.profile_gc import ProfileCollector, human_size
+from oo_bin.tunnels.profile_pool import ProfilePool
+from oo_bin.tunnels.rdp import Rdp
+from oo_bin.tunnels.reaper import Reaper
 from oo_bin.tunnels.socks import Socks
+from oo_bin.tunnels.top import Top
+from oo_bin.tunnels.vnc import Vnc
 
 
 class SkipArg(click.Group):
@@ -58,10 +65,82 @@ def stopall():
     manager.stop_all()
 
 
+def host_names(profile, kind):
+    hosts = tunnels_config(profile).get(kind, {}).get("hosts", [])
+
+    return [x["name"] for x in hosts if x.get("name", None)]
+
+
+@tunnels.command(help="Start the tunnels of several profiles at once")
+@click.argument("profiles", nargs=-1, shell_complete=Completions.socks_complete)
+@click.option("--all-rdp", is_flag=True, help="Start a tunnel to every rdp host")
+@click.option("--all-vnc", is_flag=True, help="Start a tunnel to every vnc host")
+@click.option("--no-socks", is_flag=True, help="Don't start Socks tunnels")
+@click.option(
+    "--no-launch", is_flag=True, help="Don't open Firefox, or the RDP and VNC clients"
+)
+def up(profiles, all_rdp, all_vnc, no_socks, no_launch):
+    tunnels = []
+    for profile in profiles:
+        if not no_socks:
+            tunnels.append(Socks(profile))
+
+        if all_rdp:
+            tunnels += [Rdp(profile, x) for x in host_names(profile, "rdp")]
+
+        if all_vnc:
+            tunnels += [Vnc(profile, x) for x in host_names(profile, "vnc")]
+
+    if not tunnels:
+        click.echo(click.get_current_context().get_help())
+        return
+
+    results = TunnelManager().up(tunnels, launch=not no_launch)
+
+    failed = [x for x, result in results if isinstance(result, OOBinError)]
+    if failed:
+        raise ProcessFailedError(
+            f"{len(failed)} of {len(results)} tunnels failed to start"
+        )
+
+
 @tunnels.command(help="Tunnels status")
-def status():
+@click.option(
+    "--probe", is_flag=True, help="Check that each tunnel passes traffic, and how fast"
+)
+def status(probe):
     manager = TunnelManager()
-    manager.status()
+    manager.status(probe=probe)
+
+
+@tunnels.command(help="Live connections, traffic and latency of running tunnels")
+@click.option(
+    "--interval", default=2.0, show_default=True, help="Seconds between refreshes"
+)
+def top(interval):
+    try:
+        Top(TunnelManager(), interval=interval).run()
+    except KeyboardInterrupt:
+        pass
+
+
+@tunnels.command(help="Stop tunnels that were idle for longer than their idle_ttl")
+@click.option("--dry-run", is_flag=True, help="Only print the tunnels that would stop")
+@click.option(
+    "--watch",
+    type=float,
+    default=None,
+    help="Keep running, and check again every WATCH seconds",
+)
+def reap(dry_run, watch):
+    reaper = Reaper(TunnelManager())
+    if watch:
+        try:
+            reaper.watch(watch, dry_run)
+        except KeyboardInterrupt:
+            pass
+    elif not reaper.reap(dry_run):
+        print(f"{Style.BRIGHT}No idle tunnels.")
 
 
 @tunnels.group()
@@ -75,14 +154,7 @@ def profile():
     "parent", shell_complete=Completions.clone_browser_profile, required=False
 )
 def clone(parent):
-    config = configparser.ConfigParser()
-    config.read(os.path.join(BrowserProfile.primary_profile_path(), "profiles.ini"))
-
-    for key in config:
-        if config[key].get("Name", None) == parent:
-            primary_profile_path = os.path.join(
-                BrowserProfile.primary_profile_path(), config[key].get("Path")
-            )
+    primary_profile_path = BrowserProfile.firefox_profile_path(parent)
 
     profile_path = os.path.join(
         BaseDirectory.save_data_path("oo_bin"), "profiles", f"{namegenerator.gen()}"
@@ -96,9 +168,16 @@ def clone(parent):
     with open(Path(os.path.join(profile.normalized_path, "created_at")), "w") as f:
         f.write(f"{datetime.now()}")
 
+    ProfilePool().add(profile.path)
+
     print(
         f"Profile cloned from:    {primary_profile_path}\nCreated new profile at: {profile.normalized_path}"
     )
+    print_clone_stats(cloned.clone_stats)
+
+
+def print_clone_stats(stats):
+    print(", ".join([f"{count} {name}" for name, count in stats.items() if count]))
 
 
 @profile.command(help="Create a new browser profile")
@@ -107,9 +186,18 @@ def new():
         BaseDirectory.save_data_path("oo_bin"), "profiles", f"{namegenerator.gen()}"
     )
     profile = BrowserProfile(profile_path)
+    ProfilePool().add(profile.path)
     print(f"Profile created at: {profile.normalized_path}")
 
 
+@profile.command(help="Show the pool of ready browser profiles, and fill it")
+def pool():
+    pool = ProfilePool()
+    created = pool.replenish()
+
+    print(f"Ready profiles: {pool.ready()} of {pool.size}, created {created}")
+
+
 @profile.command(help="List browser profiles")
 def ls():
     profiles_dir = Path(
@@ -147,10 +235,61 @@ def rm(profile):
         os.path.join(BaseDirectory.save_data_path("oo_bin"), "profiles", profile)
     )
     shutil.rmtree(dir)
+    ProfilePool().remove(dir)
 
     print(f"Removed profile at {dir}")
 
 
+@profile.command(
+    help="Update cloned browser profiles from the profile they were cloned from"
+)
+@click.argument(
+    "profile", shell_complete=Completions.remove_browser_profile, required=False
+)
+def sync(profile):
+    profiles_dir = Path(
+        os.path.join(BaseDirectory.save_data_path("oo_bin"), "profiles")
+    )
+    paths = [profiles_dir / profile] if profile else sorted(profiles_dir.glob("*"))
+    paths = [x for x in paths if BrowserProfile.is_clone(x)]
+
+    if not paths:
+        print(f"{Style.BRIGHT}No cloned profiles found.")
+
+    for path in paths:
+        print(f"Syncing {os.path.basename(path)}: ", end="")
+        print_clone_stats(BrowserProfile.sync(path))
+
+
+@profile.command(
+    help="Purge caches and vacuum databases of browser profiles, and remove unused ones"
+)
+@click.option(
+    "--days",
+    type=float,
+    default=None,
+    help="Remove profiles no tunnel used for DAYS, tunnels.socks.profile_max_age or 30 by default",
+)
+@click.option(
+    "--budget",
+    type=float,
+    default=None,
+    help="Stop after BUDGET seconds, the next run picks up where it stopped",
+)
+@click.option("--dry-run", is_flag=True, help="Only print what would be reclaimed")
+def gc(days, budget, dry_run):
+    stats = ProfileCollector(days, dry_run).collect(budget)
+
+    print(
+        f"{Style.BRIGHT}{'Would reclaim' if dry_run else 'Reclaimed'} {human_size(stats['reclaimed'])}{Style.RESET_ALL}: "
+        f"{stats['removed']} removed, {stats['compacted']} compacted, {stats['vacuumed']} databases vacuumed, "
+        f"{stats['skipped']} in use"
+    )
+
+
 profile.add_command(clone)
+profile.add_command(gc)
 profile.add_command(ls)
+profile.add_command(pool)
 profile.add_command(rm)
+profile.add_command(sync)
@@ -5,7 +5,7 @@ from pathlib import Path
 from click.shell_completion import CompletionItem
 from xdg import BaseDirectory
 
-from oo_bin.config import tunnels_config
+from oo_bin.config import tunnels_config, tunnels_profiles
 from oo_bin.tunnels.browser_profile import BrowserProfile
 from oo_bin.tunnels.tunnel_manager import TunnelManager
 
@@ -13,8 +13,7 @@ from oo_bin.tunnels.tunnel_manager import TunnelManager
 class Completions:
     @staticmethod
     def rdp_profile_complete(ctx, param, incomplete):
-        config = tunnels_config()
-        tunnels_list = list(config.keys())
+        tunnels_list = tunnels_profiles()
 
         completions = [
             CompletionItem(k, help="Rdp")
@@ -37,10 +36,7 @@ class Completions:
     @staticmethod
     def rdp_host_complete(ctx, param, incomplete):
         hosts_config = (
-            tunnels_config()
-            .get(ctx.params["profile"], {})
-            .get("rdp", {})
-            .get("hosts", [])
+            tunnels_config(ctx.params["profile"]).get("rdp", {}).get("hosts", [])
         )
 
         hosts_list = [x for x in hosts_config if x.get("name", False)]
@@ -57,8 +53,7 @@ class Completions:
 
     @staticmethod
     def socks_complete(ctx, param, incomplete):
-        config = tunnels_config()
-        tunnels_list = list(config.keys())
+        tunnels_list = tunnels_profiles()
         completions = [
             CompletionItem(k, help="Socks")
             for k in tunnels_list
@@ -71,6 +66,7 @@ class Completions:
                 {"name": "stop", "help": "Stop Socks tunnels"},
                 {"name": "stopall", "help": "Stop all tunnels"},
                 {"name": "profile", "help": "Manage browser profiles"},
+                {"name": "up", "help": "Start several tunnels at once"},
             ]
             if e["name"].startswith(incomplete)
         ]
@@ -79,8 +75,7 @@ class Completions:
 
     @staticmethod
     def vnc_profile_complete(ctx, param, incomplete):
-        config = tunnels_config()
-        tunnels_list = list(config.keys())
+        tunnels_list = tunnels_profiles()
 
         completions = [
             CompletionItem(k, help="Vnc")
@@ -103,10 +98,7 @@ class Completions:
     @staticmethod
     def vnc_host_complete(ctx, param, incomplete):
         hosts_config = (
-            tunnels_config()
-            .get(ctx.params["profile"], {})
-            .get("vnc", {})
-            .get("hosts", [])
+            tunnels_config(ctx.params["profile"]).get("vnc", {}).get("hosts", [])
         )
 
         hosts_list = [x for x in hosts_config if x.get("name", False)]
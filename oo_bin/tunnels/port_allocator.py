@@ -0,0 +1,91 @@
+import time
+
+from oo_bin.config import main_config
+from oo_bin.errors import PortUnavailableError
+from oo_bin.tunnels.state_store import StateStore
+from oo_bin.utils import port_available
+
+DEFAULT_PORT_RANGE = [20000, 20999]
+
+
+class PortAllocator:
+    """Hands out local ports for tunnels, from `tunnels.port_range` in the main configuration
+
+    A (profile, kind, host) gets the port it had last time while that port is free, so bookmarks in RDP and VNC clients
+    stay valid. Ports are reserved in the state store in a single transaction, so tunnels started at the same time, by
+    different processes, never get the same port.
+    """
+
+    def __init__(self, port_range=None):
+        self.port_range = (
+            port_range
+            if port_range
+            else main_config().get("tunnels", {}).get("port_range", DEFAULT_PORT_RANGE)
+        )
+
+    def allocate(self, keys, exclude=()):
+        """Returns a different port for each (profile, kind, host) in keys, none of them in exclude"""
+        first, last = self.port_range
+        ports = []
+
+        with StateStore().transaction() as db:
+            taken = set(int(x) for x in exclude)
+            taken.update(
+                int(x[0])
+                for x in db.execute("SELECT port FROM tunnels WHERE port IS NOT NULL")
+            )
+            reservations = {
+                (x["profile"], x["kind"], x["host"]): x["port"]
+                for x in db.execute("SELECT * FROM ports")
+            }
+
+            for key in keys:
+                port = reservations.get(tuple(key), None)
+
+                if (
+                    port is None
+                    or not first <= port <= last
+                    or port in taken
+                    or not port_available(port)
+                ):
+                    port = self.__free_port(db, taken, set(reservations.values()))
+
+                # Replaces the key's previous reservation, and any other key's reservation of the port
+                db.execute(
+                    "INSERT OR REPLACE INTO ports (port, profile, kind, host, used_at) VALUES (?, ?, ?, ?, ?)",
+                    (port, *key, time.time()),
+                )
+
+                reservations = {k: v for k, v in reservations.items() if v != port}
+                reservations[tuple(key)] = port
+                taken.add(port)
+                ports.append(port)
+
+        return ports
+
+    def reserved(self):
+        """The ports reserved for a (profile, kind, host), or used by a saved tunnel"""
+        with StateStore().transaction() as db:
+            return set(
+                int(x[0])
+                for x in db.execute(
+                    "SELECT port FROM ports UNION SELECT port FROM tunnels WHERE port IS NOT NULL"
+                )
+            )
+
+    def __free_port(self, db, taken, reserved):
+        first, last = self.port_range
+
+        for port in range(first, last + 1):
+            if port not in taken and port not in reserved and port_available(port):
+                return port
+
+        # Every free port is reserved, take over the one that was used the longest time ago
+        for row in db.execute("SELECT port FROM ports ORDER BY used_at"):
+            port = row["port"]
+            if first <= port <= last and port not in taken and port_available(port):
+                return port
+
+        raise PortUnavailableError(
+            f"No free port between {first} and {last}. Stop some tunnels, or change tunnels.port_range in the configuration."
+        )
@@ -0,0 +1,121 @@
+import socket
+import time
+
+from oo_bin.utils import port_available
+
+
+def tcp_probe(host, port, timeout=0.5):
+    """The forward accepts connections, ssh only listens once it is connected to the jump host"""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def socks5_probe(host, port, timeout=0.5):
+    """The forward answers a SOCKS5 greeting offering no authentication"""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+            sock.sendall(b"\x05\x01\x00")
+            return sock.recv(2) == b"\x05\x00"
+    except OSError:
+        return False
+
+
+def wait_until_ready(probe, deadline, alive=None, tick=None):
+    """Runs probe with exponential backoff, until it passes, deadline seconds pass or alive() returns False
+
+    Returns whether the probe passed and the seconds it took.
+    """
+    start = time.monotonic()
+    delay = 0.02
+
+    while True:
+        if probe():
+            return True, time.monotonic() - start
+
+        elapsed = time.monotonic() - start
+        if elapsed >= deadline or (alive and not alive()):
+            return False, elapsed
+
+        if tick:
+            tick()
+
+        time.sleep(min(delay, deadline - elapsed))
+        delay = min(delay * 2, 0.25)
+
+
+def wait_until_closed(addresses, deadline):
+    """Waits until nothing listens on any of the (host, port) addresses, returns the ones still listening
+
+    Checks by binding the port rather than connecting to it, a connection would wake a lazy tunnel up.
+    """
+    start = time.monotonic()
+
+    while True:
+        addresses = [x for x in addresses if not port_available(int(x[1]), x[0])]
+        if not addresses or time.monotonic() - start >= deadline:
+            return addresses
+
+        time.sleep(0.02)
+
+
+def __recv_exactly(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            break
+        data += chunk
+
+    return data
+
+
+def socks5_connect_probe(host, port, target_host, target_port, timeout=2):
+    """Connects to a target through the SOCKS5 forward, which checks the whole tunnel rather than the local listener"""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+            sock.sendall(b"\x05\x01\x00")
+            if __recv_exactly(sock, 2) != b"\x05\x00":
+                return False
+
+            # CONNECT to a domain name, ssh only replies once the jump host connected to the target
+            name = target_host.encode("idna")
+            sock.sendall(
+                b"\x05\x01\x00\x03"
+                + bytes([len(name)])
+                + name
+                + int(target_port).to_bytes(2, "big")
+            )
+            return __recv_exactly(sock, 2) == b"\x05\x00"
+    except (OSError, UnicodeError):
+        return False
+
+
+# A TPKT header, then an X.224 Connection Request carrying an RDP Negotiation Request for TLS and CredSSP
+RDP_CONNECTION_REQUEST = (
+    b"\x03\x00\x00\x13"
+    + b"\x0e\xe0\x00\x00\x00\x00\x00"
+    + b"\x01\x00\x08\x00\x03\x00\x00\x00"
+)
+
+
+def rdp_probe(host, port, timeout=2):
+    """The RDP server answers an X.224 Connection Request with a Connection Confirm"""
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+            sock.sendall(RDP_CONNECTION_REQUEST)
+            reply = __recv_exactly(sock, 6)
+            return len(reply) == 6 and reply[0] == 3 and reply[5] & 0xF0 == 0xD0
+    except OSError:
+        return False
+
+
+def vnc_probe(host, port, timeout=2):
+    """The VNC server greets with its protocol version, e.g. "RFB 003.008\\n\" """
+    try:
+        with socket.create_connection((host, int(port)), timeout=timeout) as sock:
+            return __recv_exactly(sock, 12).startswith(b"RFB ")
+    except OSError:
+        return False
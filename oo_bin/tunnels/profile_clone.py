@@ -0,0 +1,208 @@
+import ctypes
+import errno
+import fcntl
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+
+from oo_bin.utils import is_mac
+
+# _IOW(0x94, 9, int), from linux/fs.h
+FICLONE = 0x40049409
+
+# The filesystem can't share blocks between these files, e.g. ext4, or a profile on another filesystem
+REFLINK_UNSUPPORTED = [
+    errno.ENOTSUP,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+]
+
+# Files that Firefox replaces rather than changes in place, so a clone can share them with its parent
+HARDLINK_PATTERNS = ["*.xpi", "gmp-*/*"]
+
+# Files larger than this are copied in chunks of this size, in parallel
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# The source of a clone and the size and mtime of each file it cloned, to sync it later
+MANIFEST = ".oo_clone.json"
+
+
+def reflink(source, destination):
+    """Creates destination sharing the blocks of source, copy on write. Raises OSError where that isn't supported"""
+    if is_mac():
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(source), os.fsencode(destination), 0) != 0:
+            raise OSError(ctypes.get_errno(), "clonefile failed", destination)
+        return
+
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            os.unlink(destination)
+            raise
+
+
+def copy_range(src_fd, dst_fd, offset, length):
+    while length > 0:
+        try:
+            # In the kernel, Linux and Python 3.8 or later
+            count = os.copy_file_range(src_fd, dst_fd, length, offset, offset)
+        except (AttributeError, OSError):
+            data = os.pread(src_fd, min(length, 1024 * 1024), offset)
+            count = os.pwrite(dst_fd, data, offset) if data else 0
+
+        if count == 0:
+            break
+        offset += count
+        length -= count
+
+
+class ProfileCloner:
+    """Clones a directory tree as cheaply as the filesystem allows, for browser profiles
+
+    Each file is a reflink where the filesystem supports it, else a hardlink when Firefox never changes it in place,
+    else a copy. Files are cloned in parallel, and large files copied in parallel chunks. A manifest of the cloned
+    files lets sync bring the clone up to date with its source later, cloning only what changed.
+    """
+
+    def __init__(self, ignore=None, workers=8):
+        """ignore is a callable like the one shutil.copytree takes, e.g. shutil.ignore_patterns("cache2")"""
+        self.__ignore = ignore
+        self.__workers = workers
+        self.__reflinks = True
+        self.__lock = threading.Lock()
+        self.stats = dict.fromkeys(
+            ["reflinked", "hardlinked", "copied", "unchanged", "removed"], 0
+        )
+
+    def clone(self, source, destination):
+        os.makedirs(destination)
+
+        files = self.__files(source)
+        self.__transfer(source, destination, files)
+        self.__save_manifest(source, destination, files)
+
+    def sync(self, destination):
+        """Clones the files of the source that changed since the last clone or sync, and removes deleted ones
+
+        Files the clone changed itself are kept, unless the source changed them too.
+        """
+        manifest = ProfileCloner.manifest(destination)
+        source = manifest["source"]
+        files = self.__files(source)
+
+        for path in set(manifest["files"]) - set(files):
+            try:
+                os.unlink(os.path.join(destination, path))
+                self.stats["removed"] += 1
+            except FileNotFoundError:
+                pass
+
+        changed = [x for x in files if manifest["files"].get(x, None) != files[x]]
+        self.stats["unchanged"] += len(files) - len(changed)
+        self.__transfer(source, destination, changed)
+        self.__save_manifest(source, destination, files)
+
+    @staticmethod
+    def manifest(destination):
+        """The source and files of a clone, None if destination isn't one"""
+        try:
+            with open(os.path.join(destination, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __files(self, source):
+        """[size, mtime] of every regular file, by path relative to source"""
+        files = {}
+        for root, dirs, names in os.walk(source):
+            ignored = self.__ignore(root, dirs + names) if self.__ignore else set()
+            dirs[:] = [x for x in dirs if x not in ignored]
+
+            for name in [x for x in names if x not in ignored and x != MANIFEST]:
+                path = os.path.join(root, name)
+                stat = os.lstat(path)
+                if os.path.isfile(path) and not os.path.islink(path):
+                    files[os.path.relpath(path, source)] = [
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    ]
+
+        return files
+
+    def __save_manifest(self, source, destination, files):
+        with open(os.path.join(destination, MANIFEST), "w") as f:
+            json.dump({"source": os.path.abspath(source), "files": files}, f)
+
+    def __transfer(self, source, destination, paths):
+        with ThreadPoolExecutor(max_workers=self.__workers) as chunks:
+            with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+                futures = [
+                    executor.submit(self.__clone_file, source, destination, x, chunks)
+                    for x in paths
+                ]
+                for future in futures:
+                    future.result()
+
+    def __count(self, stat):
+        with self.__lock:
+            self.stats[stat] += 1
+
+    def __clone_file(self, source_root, destination_root, path, chunks):
+        source = os.path.join(source_root, path)
+        destination = os.path.join(destination_root, path)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+
+        # Never write through a hardlink, it would change the source too
+        if os.path.lexists(destination):
+            os.unlink(destination)
+
+        if self.__reflinks:
+            try:
+                reflink(source, destination)
+                shutil.copystat(source, destination)
+                return self.__count("reflinked")
+            except OSError as e:
+                if e.errno not in REFLINK_UNSUPPORTED:
+                    raise
+                self.__reflinks = False
+
+        if any(fnmatch(path, x) for x in HARDLINK_PATTERNS):
+            try:
+                os.link(source, destination)
+                return self.__count("hardlinked")
+            except OSError:
+                # On another filesystem
+                pass
+
+        self.__copy(source, destination, chunks)
+        shutil.copystat(source, destination)
+        self.__count("copied")
+
+    def __copy(self, source, destination, chunks):
+        size = os.path.getsize(source)
+        if size <= CHUNK_SIZE:
+            shutil.copyfile(source, destination)
+            return
+
+        with open(source, "rb") as src, open(destination, "wb") as dst:
+            dst.truncate(size)
+
+            futures = [
+                chunks.submit(
+                    copy_range,
+                    src.fileno(),
+                    dst.fileno(),
+                    offset,
+                    min(CHUNK_SIZE, size - offset),
+                )
+                for offset in range(0, size, CHUNK_SIZE)
+            ]
+            for future in futures:
+                future.result()
@@ -0,0 +1,248 @@
+import fcntl
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+from oo_bin.config import main_config
+from oo_bin.tunnels.profile_pool import ProfilePool, profiles_dir
+from oo_bin.tunnels.state_store import StateStore
+
+# Firefox builds these again when it needs them
+CACHES = [
+    "cache2",
+    "crashes",
+    "jumpListCache",
+    "minidumps",
+    "OfflineCache",
+    "saved-telemetry-pings",
+    "sessionstore-backups",
+    "shader-cache",
+    "startupCache",
+    "thumbnails",
+]
+
+# Rewriting a database with less free space than this isn't worth it, and unshares the blocks of a cloned profile
+VACUUM_THRESHOLD = 0.1
+
+# Firefox writes some of these whenever it runs with a profile
+ACTIVITY_FILES = ["prefs.js", "sessionstore.jsonlz4", "times.json", "created_at"]
+
+
+def disk_usage(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+
+    return total
+
+
+def human_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TB"
+
+
+def firefox_running(path):
+    """Whether a Firefox process has the profile open, from the lock it holds on .parentlock"""
+    try:
+        with open(os.path.join(path, ".parentlock"), "rb+") as f:
+            fcntl.lockf(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        return True
+
+    return False
+
+
+def last_used(path):
+    return max(
+        [os.path.getmtime(path)]
+        + [
+            os.path.getmtime(os.path.join(path, x))
+            for x in ACTIVITY_FILES
+            if os.path.exists(os.path.join(path, x))
+        ]
+    )
+
+
+class ProfileCollector:
+    """Reclaims the disk space of the browser profiles of Socks tunnels, for `oo tunnels profile gc`
+
+    Profiles no tunnel used for `days` are removed. The others have their caches purged, and their sqlite databases
+    checkpointed and vacuumed. Profiles are collected least recently collected first, so runs with a budget, e.g. from
+    cron, get through all of them over time. Profiles a tunnel or Firefox is using are skipped.
+    """
+
+    def __init__(self, days=None, dry_run=False):
+        self.days = (
+            days
+            if days is not None
+            else main_config()
+            .get("tunnels", {})
+            .get("socks", {})
+            .get("profile_max_age", 30)
+        )
+        self.__dry_run = dry_run
+        self.stats = dict.fromkeys(
+            ["reclaimed", "removed", "compacted", "vacuumed", "skipped"], 0
+        )
+
+    @staticmethod
+    def trash_dir():
+        return profiles_dir().parent / "profiles.gc"
+
+    def collect(self, budget=None):
+        """Collects profiles until budget seconds are spent, at least one, or all of them. Returns the stats"""
+        # Left by an interrupted run
+        shutil.rmtree(self.trash_dir(), ignore_errors=True)
+
+        ProfilePool().index(profiles_dir())
+        deadline = time.monotonic() + budget if budget else None
+
+        for count, path in enumerate(self.__queue()):
+            if count and deadline and time.monotonic() >= deadline:
+                break
+
+            self.__collect(path)
+
+        return self.stats
+
+    def __queue(self):
+        with StateStore().transaction() as db:
+            rows = db.execute(
+                "SELECT path FROM browser_profiles ORDER BY gc_at IS NOT NULL, gc_at, created_at"
+            ).fetchall()
+
+        return [x["path"] for x in rows]
+
+    def __collect(self, path):
+        name = os.path.basename(path)
+
+        if not os.path.isdir(path):
+            ProfilePool().remove(path)
+            return
+
+        if firefox_running(path) or not self.__claim(path):
+            self.stats["skipped"] += 1
+            return
+
+        idle_days = (time.time() - last_used(path)) / 86400
+        if idle_days > self.days:
+            size = disk_usage(path)
+            self.__remove(path)
+
+            self.stats["removed"] += 1
+            self.stats["reclaimed"] += size
+            verb = "Would remove" if self.__dry_run else "Removed"
+            print(f"{verb} {name}, unused for {idle_days:.0f} days: {human_size(size)}")
+            return
+
+        size = self.__purge_caches(path) + self.__vacuum(path)
+        self.__release(path)
+
+        self.stats["compacted"] += 1
+        self.stats["reclaimed"] += size
+        verb = "Would compact" if self.__dry_run else "Compacted"
+        print(f"{verb} {name}: {human_size(size)}")
+
+    def __claim(self, path):
+        """Keeps the pool from handing out the profile while it's collected. False when a tunnel uses it"""
+        with StateStore().transaction() as db:
+            used = db.execute(
+                "SELECT 1 FROM tunnels WHERE browser_profile_path = ?", (path,)
+            ).fetchone()
+            if used:
+                return False
+
+            if self.__dry_run:
+                row = db.execute(
+                    "SELECT state FROM browser_profiles WHERE path = ?", (path,)
+                ).fetchone()
+                return row is not None and row["state"] == "ready"
+
+            return (
+                db.execute(
+                    "UPDATE browser_profiles SET state = 'gc', acquired_at = ? WHERE path = ? AND state = 'ready'",
+                    (time.time(), path),
+                ).rowcount
+                == 1
+            )
+
+    def __release(self, path):
+        if self.__dry_run:
+            return
+
+        with StateStore().transaction() as db:
+            db.execute(
+                "UPDATE browser_profiles SET state = 'ready', acquired_at = NULL, gc_at = ? WHERE path = ?",
+                (time.time(), path),
+            )
+
+    def __remove(self, path):
+        if self.__dry_run:
+            return
+
+        # Out of the profiles directory first, so an interrupted removal never leaves half a profile in the pool
+        trash = self.trash_dir() / os.path.basename(path)
+        os.makedirs(self.trash_dir(), exist_ok=True)
+        os.rename(path, trash)
+        ProfilePool().remove(path)
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def __purge_caches(self, path):
+        size = 0
+        for cache in [os.path.join(path, x) for x in CACHES]:
+            if os.path.isdir(cache):
+                size += disk_usage(cache)
+                if not self.__dry_run:
+                    shutil.rmtree(cache, ignore_errors=True)
+
+        return size
+
+    def __vacuum(self, path):
+        size = 0
+        for database in Path(path).rglob("*.sqlite"):
+            files = [Path(f"{database}{x}") for x in ["", "-wal", "-shm"]]
+            before = sum(x.stat().st_size for x in files if x.exists())
+
+            try:
+                db = sqlite3.connect(
+                    f"{database.as_uri()}?mode={'ro' if self.__dry_run else 'rw'}",
+                    uri=True,
+                    timeout=0,
+                    isolation_level=None,
+                )
+                try:
+                    page_size, pages, free = [
+                        db.execute(f"PRAGMA {x}").fetchone()[0]
+                        for x in ["page_size", "page_count", "freelist_count"]
+                    ]
+                    worth_it = free and free >= pages * VACUUM_THRESHOLD
+
+                    if self.__dry_run:
+                        size += free * page_size if worth_it else 0
+                        continue
+
+                    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                    if worth_it:
+                        db.execute("VACUUM")
+                        self.stats["vacuumed"] += 1
+                finally:
+                    db.close()
+            except sqlite3.Error:
+                # Locked, or not a database
+                continue
+
+            size += max(0, before - sum(x.stat().st_size for x in files if x.exists()))
+
+        return size
@@ -0,0 +1,177 @@
+import fcntl
+import os
+import secrets
+import sys
+import time
+from pathlib import Path
+from subprocess import DEVNULL, Popen
+
+from xdg import BaseDirectory
+
+from oo_bin.config import main_config
+from oo_bin.errors import BrowserProfileUnavailableError
+from oo_bin.runtime import runtime_path
+from oo_bin.tunnels.browser_profile import BrowserProfile
+from oo_bin.tunnels.state_store import StateStore
+
+# Seconds a taken profile stays taken without a saved tunnel using it, while the tunnel starts
+ACQUIRE_GRACE = 60
+
+# Profiles indexed from the profiles directory can belong to a tunnel started before the pool
+READY = """state = 'ready'
+    AND path NOT IN (SELECT browser_profile_path FROM tunnels WHERE browser_profile_path IS NOT NULL)"""
+
+log_file = os.path.join(BaseDirectory.save_cache_path("oo_bin"), "profile_pool.log")
+
+
+def profiles_dir():
+    return Path(os.path.join(BaseDirectory.save_data_path("oo_bin"), "profiles"))
+
+
+class ProfilePool:
+    """Browser profiles for Socks tunnels with `multiple_profiles`, kept ready ahead of time
+
+    Profiles are indexed in the state store, so taking one is a single indexed query. After a profile is taken, a
+    background process creates new ones until `tunnels.socks.pool_size` are ready again, cloned from the Firefox profile
+    named by `tunnels.socks.pool_parent`, or empty, with the proxy set up.
+    """
+
+    def __init__(self):
+        config = main_config().get("tunnels", {}).get("socks", {})
+        self.size = config.get("pool_size", 2)
+        self.parent = config.get("pool_parent", None)
+
+    def acquire(self):
+        """Takes a ready profile, creating one if there is none. Returns its (name, path)"""
+        profile = self.__take()
+        if not profile:
+            # First use, or profiles created before the pool, or by hand
+            self.index(profiles_dir())
+            profile = self.__take()
+
+        if not profile:
+            self.add(self.create())
+            profile = self.__take()
+
+        if not profile:
+            raise BrowserProfileUnavailableError(
+                """No Browser Profile is available.
+
+    You can create a new profile by running:      `oo tunnels profile new`
+    You can clone an existing profile by running: `oo tunnels profile clone <ProfileName>`"""
+            )
+
+        self.replenish_in_background()
+
+        return profile
+
+    def __take(self):
+        with StateStore().transaction() as db:
+            # Profiles of tunnels, or of `oo tunnels profile gc` runs, that died without releasing them
+            db.execute(
+                """UPDATE browser_profiles SET state = 'ready', acquired_at = NULL
+                WHERE state IN ('in_use', 'gc') AND acquired_at < ?
+                AND path NOT IN (SELECT browser_profile_path FROM tunnels WHERE browser_profile_path IS NOT NULL)""",
+                (time.time() - ACQUIRE_GRACE,),
+            )
+
+            while True:
+                row = db.execute(
+                    f"SELECT name, path FROM browser_profiles WHERE {READY} ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if not row:
+                    return None
+
+                if not os.path.isdir(row["path"]):
+                    # Removed by hand
+                    db.execute(
+                        "DELETE FROM browser_profiles WHERE path = ?", (row["path"],)
+                    )
+                    continue
+
+                db.execute(
+                    "UPDATE browser_profiles SET state = 'in_use', acquired_at = ? WHERE path = ?",
+                    (time.time(), row["path"]),
+                )
+                return (row["name"], row["path"])
+
+    def release(self, path):
+        with StateStore().transaction() as db:
+            db.execute(
+                "UPDATE browser_profiles SET state = 'ready', acquired_at = NULL WHERE path = ?",
+                (str(path),),
+            )
+
+    def add(self, path):
+        """Indexes a profile created elsewhere, e.g. by `oo tunnels profile new`, as ready"""
+        with StateStore().transaction() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO browser_profiles (path, name, state, created_at) VALUES (?, ?, 'ready', ?)",
+                (str(path), os.path.basename(path), time.time()),
+            )
+
+    def remove(self, path):
+        with StateStore().transaction() as db:
+            db.execute("DELETE FROM browser_profiles WHERE path = ?", (str(path),))
+
+    def index(self, directory):
+        for path in sorted(directory.glob("*"), key=os.path.getmtime):
+            if path.is_dir():
+                self.add(path)
+
+    def ready(self):
+        with StateStore().transaction() as db:
+            return db.execute(
+                f"SELECT COUNT(*) FROM browser_profiles WHERE {READY}"
+            ).fetchone()[0]
+
+    def create(self):
+        """A new profile, cloned from pool_parent if it's set, with the proxy set up. Returns its path"""
+        path = str(profiles_dir() / f"pool-{secrets.token_hex(4)}")
+
+        if self.parent:
+            parent_path = BrowserProfile.firefox_profile_path(self.parent)
+            if not parent_path:
+                raise BrowserProfileUnavailableError(
+                    f"tunnels.socks.pool_parent is {self.parent}, but Firefox has no profile with that name"
+                )
+
+            BrowserProfile.clone(primary_profile_path=parent_path, profile_path=path)
+
+        # The port of the tunnel is set when Firefox is launched
+        BrowserProfile(path).set_socks_proxy("127.0.0.1", 2080)
+
+        return path
+
+    def replenish(self):
+        """Creates profiles until pool_size are ready, one process at a time. Returns how many it created"""
+        with open(os.path.join(runtime_path(), "profile_pool.lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is already at it
+                return 0
+
+            created = 0
+            while self.ready() < self.size:
+                self.add(self.create())
+                created += 1
+
+            return created
+
+    def replenish_in_background(self):
+        if self.ready() >= self.size:
+            return
+
+        with open(log_file, "a") as f:
+            Popen(
+                [sys.executable, "-m", "oo_bin.tunnels.profile_pool"],
+                stdin=DEVNULL,
+                stdout=f,
+                stderr=f,
+                start_new_session=True,
+            )
+
+
+if __name__ == "__main__":
+    ProfilePool().replenish()
@@ -1,31 +1,30 @@
-import os
+import copy
 import shutil
 import sys
-from pathlib import Path
 from subprocess import DEVNULL, Popen
 
 import colorama
-from xdg import BaseDirectory
 
-from oo_bin.config import tunnels_config
+from oo_bin.config import tunnel_host
 from oo_bin.errors import (
     DependencyNotMetError,
     PortUnavailableError,
     SystemNotSupportedError,
 )
+from oo_bin.process import forwarding
+from oo_bin.tunnels.port_allocator import PortAllocator
+from oo_bin.tunnels.probes import rdp_probe, tcp_probe
 from oo_bin.tunnels.tunnel import Tunnel
-from oo_bin.utils import is_autossh_running, is_linux, is_mac, is_wsl
+from oo_bin.utils import is_linux, is_mac, is_wsl
 
 
 class Rdp(Tunnel):
     def __init__(self, name, host):
         super().__init__(name)
 
-        hosts_config = tunnels_config().get(name, {}).get("rdp", {}).get("hosts", [])
-        hosts_config = [x for x in hosts_config if x.get("name", None) == host]
+        host_config = tunnel_host(name, "rdp", host)
 
-        if len(hosts_config) > 0:
-            host_config = hosts_config[0]
+        if host_config:
             self.__host = host_config.get("host", "")
             self.__port = host_config.get("port", "3389")
         else:
@@ -37,15 +36,34 @@ class Rdp(Tunnel):
         self.__rdp_pid = None
 
         config_port = host_config.get("local_port", None)
-        self.__local_port = config_port if config_port else self.open_port()
-
-        self._pickle_file = Path(
-            os.path.join(
-                BaseDirectory.save_data_path("oo_bin"),
-                f"{self.name}_{self.local_port}_rdp.pkl",
-            )
+        self.__local_port = (
+            int(config_port)
+            if config_port
+            else PortAllocator().allocate([self._port_key])[0]
         )
 
+        self._state_key = f"{self.name}_{self.local_port}_rdp"
+
+    def _restore(self, state):
+        super()._restore(state)
+
+        self.__host = state["host"]
+        self.__port = state["remote_port"]
+        self.__local_port = state["port"]
+        self.__rdp_pid = state["client_pid"]
+        if self.rdp_pid:
+            self._start_times[self.rdp_pid] = state["client_pid_start"]
+
+    def _state(self):
+        return {
+            **super()._state(),
+            "port": self.local_port,
+            "host": self.host,
+            "remote_port": self.port,
+            "client_pid": self.rdp_pid,
+            "client_pid_start": self._start_times.get(self.rdp_pid, None),
+        }
+
     @property
     def host(self):
         return self.__host
@@ -62,6 +80,11 @@ class Rdp(Tunnel):
     def local_port(self):
         return self.__local_port
 
+    @local_port.setter
+    def local_port(self, value):
+        self.__local_port = value
+        self._state_key = f"{self.name}_{self.local_port}_rdp"
+
     @property
     def rdp_pid(self):
         return self.__rdp_pid
@@ -69,24 +92,17 @@ class Rdp(Tunnel):
     @rdp_pid.setter
     def rdp_pid(self, value):
         self.__rdp_pid = value
+        self._track(value)
+
+    def _probe(self):
+        return tcp_probe(self.local_host, self.local_port)
+
+    def _health_probe(self, timeout):
+        return rdp_probe(self.local_host, self.local_port, timeout)
 
     @property
-    def _cmd(self):
-        return [
-            self._autossh_bin,
-            "-N",
-            "-M",
-            "0",
-            "-L",
-            f"{self.local_port}:{self.host}:{self.port}",
-            "-o",
-            "ServerAliveInterval=3",
-            "-o",
-            "ServerAliveCountMax=30",
-            "-F",
-            f"{self._ssh_config}",
-            f"{self.jump_host}",
-        ]
+    def _forward(self):
+        return ["-L", f"{self.local_port}:{self.host}:{self.port}"]
 
     @property
     def __rdp_cmd(self):
@@ -118,20 +134,36 @@ class Rdp(Tunnel):
 
         SystemNotSupportedError("Your system is not supported")
 
-    def stop(self):
-        super().stop()
+    def _processes(self):
+        processes = super()._processes()
+        if not is_wsl() and self.rdp_pid:
+            processes.append(self.process(self.rdp_pid))
 
-        if not is_wsl() and self.is_running(self.rdp_pid):
-            self.__kill_rdp()
+        return processes
 
-    def start(self):
-        if is_autossh_running(self.local_port):
+    @property
+    def _port_key(self):
+        return (self.name, "rdp", f"{self.host}:{self.port}")
+
+    @property
+    def _listen_address(self):
+        return (self.local_host, self.local_port)
+
+    def _on_port(self, port):
+        tunnel = copy.copy(self)
+        tunnel.local_port = port
+
+        return tunnel
+
+    def open(self, tick=None):
+        if forwarding(self.local_port):
             raise PortUnavailableError(
                 f"Autossh is already running on port {self.local_port}. You need to stop this process before running tunnels."
             )
 
-        super().start()
+        return super().open(tick)
 
+    def launch(self):
         self.__launch_rdp()
 
     def __launch_rdp(self):
@@ -150,9 +182,3 @@ class Rdp(Tunnel):
                 file=sys.stderr,
             )
             sys.exit(1)
-
-    def __kill_rdp(self):
-        with open(self._cache_file, "a") as f:
-            Popen(["kill", str(self.rdp_pid)], stdout=DEVNULL, stderr=f)
-
-        return True
@@ -0,0 +1,116 @@
+import os
+import time
+from datetime import datetime
+
+from xdg import BaseDirectory
+
+from oo_bin.config import main_config
+from oo_bin.process import io_counters, ssh_processes
+from oo_bin.tunnels.state_store import StateStore
+
+log_file = os.path.join(BaseDirectory.save_cache_path("oo_bin"), "reaper.log")
+
+# Bytes per second ssh reads and writes on its own, keepalives included, traffic above it is a client using the tunnel
+NOISE_RATE = 256
+
+
+class Reaper:
+    """Stops tunnels that passed no traffic for longer than their idle_ttl
+
+    Each run reads the byte counters of the ssh process of every tunnel from /proc/<pid>/io, and saves them with when
+    the tunnel last passed traffic, so runs can be far apart: from the daemon, cron or `oo tunnels reap --watch`. An open
+    connection that passes nothing doesn't keep a tunnel running. Lazy tunnels are skipped, the supervisor already
+    stops their ssh process while they're idle.
+    """
+
+    def __init__(self, manager):
+        self.__manager = manager
+        self.__version = None
+
+    @staticmethod
+    def ttl(tunnel):
+        """Seconds a tunnel may stay idle, from the profile, or else the [tunnels] section. None to keep it running"""
+        ttl = tunnel._config.get(
+            "idle_ttl", main_config().get("tunnels", {}).get("idle_ttl", None)
+        )
+
+        return ttl if ttl else None
+
+    def idle(self):
+        """(tunnel, idle seconds) for every tunnel idle longer than its ttl"""
+        version = StateStore().version()
+        if version != self.__version:
+            self.__manager.reload()
+            self.__version = version
+
+        tunnels = [
+            x for x in self.__manager.tunnels() if self.ttl(x) and x._mode != "lazy"
+        ]
+        processes = ssh_processes()
+
+        now = time.time()
+        idle = []
+        for tunnel in tunnels:
+            pid = tunnel._ssh_pid(processes)
+            counters = io_counters(pid) if pid else None
+            if counters is None:
+                # Traffic can't be measured without /proc, e.g. on macOS, or while ssh reconnects
+                continue
+
+            state = StateStore().tunnel(tunnel._state_key)
+            measured = (
+                state and state["io_pid"] == pid and state["io_bytes"] is not None
+            )
+            if measured and sum(counters) - state["io_bytes"] > NOISE_RATE * (
+                now - state["io_at"]
+            ):
+                tunnel._active_at = now
+
+            StateStore().update(
+                tunnel._state_key,
+                {
+                    "io_pid": pid,
+                    "io_bytes": sum(counters),
+                    "io_at": now,
+                    "active_at": tunnel._active_at,
+                },
+            )
+
+            # The first run for an ssh process only takes the counters to compare with
+            if not measured:
+                continue
+
+            seconds = now - (tunnel._active_at or tunnel._created_at)
+            if seconds > self.ttl(tunnel):
+                idle.append((tunnel, seconds))
+
+        return idle
+
+    def reap(self, dry_run=False):
+        """Stops the idle tunnels, and logs them. Returns (tunnel, idle seconds) for each"""
+        idle = self.idle()
+        if not idle:
+            return []
+
+        verb = "Would stop" if dry_run else "Stopping"
+        lines = [
+            f"{verb} {x.name} ({type(x).__name__} on port {x._listen_address[1]}), idle for {seconds:.0f}s"
+            for x, seconds in idle
+        ]
+        for line in lines:
+            print(line)
+
+        if not dry_run:
+            with open(log_file, "a") as f:
+                for line in lines:
+                    f.write(f"{datetime.now()} {line}\n")
+
+            self.__manager.stop([x for x, _ in idle])
+
+        return idle
+
+    def watch(self, interval, dry_run=False):
+        """Reaps every interval seconds, until interrupted"""
+        while True:
+            self.reap(dry_run)
+            time.sleep(interval)
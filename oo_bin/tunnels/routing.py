@@ -0,0 +1,217 @@
+import ipaddress
+import json
+
+# The keys of a SuffixTrie node holding the value of the name itself, and of every name under it too
+EXACT = ""
+SUFFIX = "*"
+
+
+class SuffixTrie:
+    """Domain names by label, from the top level domain down, so a lookup takes one step per label of the host
+
+    app.example.com matches that host only, *.example.com and .example.com match example.com and every host under it.
+    The longest match wins.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, pattern, value):
+        pattern = pattern.lower().rstrip(".")
+        key = SUFFIX if pattern.startswith(("*.", ".")) else EXACT
+
+        node = self.root
+        for label in reversed(pattern.lstrip("*.").split(".")):
+            node = node.setdefault(label, {})
+        node[key] = value
+
+    def lookup(self, host):
+        node = self.root
+        found = None
+        for label in reversed(host.lower().rstrip(".").split(".")):
+            if label not in node:
+                return found
+
+            node = node[label]
+            found = node.get(SUFFIX, found)
+
+        return node.get(EXACT, found)
+
+
+class CidrSet:
+    """Networks by prefix length, then network number, so a lookup is one dict access per prefix length in use
+
+    The most specific network wins.
+    """
+
+    def __init__(self):
+        # By IP version, then prefix length
+        self.networks = {4: {}, 6: {}}
+
+    def add(self, network, value):
+        network = ipaddress.ip_network(network, strict=False)
+        shift = network.max_prefixlen - network.prefixlen
+
+        self.networks[network.version].setdefault(network.prefixlen, {})[
+            int(network.network_address) >> shift
+        ] = value
+
+    def lookup(self, address):
+        address = ipaddress.ip_address(address)
+        networks = self.networks[address.version]
+
+        for prefixlen in sorted(networks, reverse=True):
+            shift = address.max_prefixlen - prefixlen
+            value = networks[prefixlen].get(int(address) >> shift, None)
+            if value is not None:
+                return value
+
+        return None
+
+
+class RouteTable:
+    """Where to send connections, by destination: domain names and hosts, or IP networks and addresses"""
+
+    def __init__(self, routes=None):
+        """routes maps each domain name, host, network or address to its value, e.g. the address of a forward"""
+        self.domains = SuffixTrie()
+        self.networks = CidrSet()
+        self.size = 0
+
+        for route, value in (routes or {}).items():
+            self.add(route, value)
+
+    def add(self, route, value):
+        try:
+            self.networks.add(route, value)
+        except ValueError:
+            self.domains.add(route, value)
+
+        self.size += 1
+
+    def lookup(self, host):
+        """The value of the most specific route for host, a name or an address, None without one"""
+        try:
+            return self.networks.lookup(host.strip("[]"))
+        except ValueError:
+            return self.domains.lookup(host)
+
+
+PAC = """// Generated by oo tunnels, changes are overwritten
+var DOMAINS = {domains};
+// IPv4 networks by prefix length, then network number
+var NETWORKS = {networks};
+var PREFIXES = {prefixes};
+// IPv6 networks by prefix length, then the bits of the network, the numbers don't fit in a double
+var NETWORKS6 = {networks6};
+var PREFIXES6 = {prefixes6};
+
+function has(object, key) {{
+  return Object.prototype.hasOwnProperty.call(object, key);
+}}
+
+function ipv6Bits(host) {{
+  var halves = host.split("::");
+  var head = halves[0] ? halves[0].split(":") : [];
+  var tail = halves.length == 2 && halves[1] ? halves[1].split(":") : [];
+  var missing = 8 - head.length - tail.length;
+  if (halves.length > 2 || missing < 0 || (halves.length == 1 && missing != 0)) {{
+    return null;
+  }}
+
+  var groups = head;
+  for (var i = 0; i < missing; i++) {{
+    groups.push("0");
+  }}
+  groups = groups.concat(tail);
+
+  var bits = "";
+  for (var k = 0; k < 8; k++) {{
+    if (!/^[0-9a-f]{{1,4}}$/.test(groups[k])) {{
+      return null;
+    }}
+    bits += ("000000000000000" + parseInt(groups[k], 16).toString(2)).slice(-16);
+  }}
+  return bits;
+}}
+
+function FindProxyForURL(url, host) {{
+  host = host.toLowerCase().replace(/\\.$/, "").replace(/^\\[(.*)\\]$/, "$1");
+
+  if (/^\\d+\\.\\d+\\.\\d+\\.\\d+$/.test(host)) {{
+    var octets = host.split(".");
+    var address = ((+octets[0] * 256 + +octets[1]) * 256 + +octets[2]) * 256 + +octets[3];
+    for (var i = 0; i < PREFIXES.length; i++) {{
+      var networks = NETWORKS[PREFIXES[i]];
+      var network = Math.floor(address / Math.pow(2, 32 - PREFIXES[i]));
+      if (has(networks, network)) {{
+        return networks[network];
+      }}
+    }}
+    return "DIRECT";
+  }}
+
+  if (host.indexOf(":") >= 0) {{
+    var bits = ipv6Bits(host);
+    for (var m = 0; bits && m < PREFIXES6.length; m++) {{
+      var networks6 = NETWORKS6[PREFIXES6[m]];
+      var network6 = bits.slice(0, PREFIXES6[m]);
+      if (has(networks6, network6)) {{
+        return networks6[network6];
+      }}
+    }}
+    return "DIRECT";
+  }}
+
+  var labels = host.split(".");
+  var node = DOMAINS;
+  var found = "DIRECT";
+  for (var j = labels.length - 1; j >= 0; j--) {{
+    if (!has(node, labels[j])) {{
+      return found;
+    }}
+    node = node[labels[j]];
+    if (has(node, "{suffix}")) {{
+      found = node["{suffix}"];
+    }}
+  }}
+  return has(node, "{exact}") ? node["{exact}"] : found;
+}}
+"""
+
+# The first line of every proxy.pac oo writes, to tell them from the user's
+PAC_HEADER = PAC.splitlines()[0]
+
+
+def pac(routes):
+    """A proxy auto-config file sending the destinations of routes through their proxy, and the rest directly
+
+    routes maps domain names, hosts, networks and addresses to a proxy, e.g. "SOCKS5 127.0.0.1:2080". The lists are
+    compiled into a suffix trie and networks by prefix length, so looking a host up stays fast with large lists. Names
+    aren't resolved to match networks, it would slow every request down, networks only match IP addresses.
+    """
+    table = RouteTable(routes)
+    networks = table.networks.networks[4]
+    networks6 = table.networks.networks[6]
+
+    return PAC.format(
+        domains=json.dumps(table.domains.root, sort_keys=True),
+        networks=json.dumps(
+            {x: {str(k): v for k, v in networks[x].items()} for x in networks},
+            sort_keys=True,
+        ),
+        prefixes=json.dumps(sorted(networks, reverse=True)),
+        networks6=json.dumps(
+            {
+                x: {
+                    format(k, "b").zfill(x) if x else "": v
+                    for k, v in networks6[x].items()
+                }
+                for x in networks6
+            },
+            sort_keys=True,
+        ),
+        prefixes6=json.dumps(sorted(networks6, reverse=True)),
+        suffix=SUFFIX,
+        exact=EXACT,
+    )
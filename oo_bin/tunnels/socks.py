@@ -1,7 +1,9 @@
+import copy
+import json
 import os
 import shutil
-from pathlib import Path
 from subprocess import DEVNULL, Popen
+from urllib.parse import urlparse, urlsplit
 
 from colorama import Fore
 from xdg import BaseDirectory
@@ -9,37 +11,73 @@ from xdg import BaseDirectory
 from oo_bin.config import main_config
 from oo_bin.errors import (
     DependencyNotMetError,
+    InvalidProfileError,
     PortUnavailableError,
     SystemNotSupportedError,
 )
+from oo_bin.process import forwarding
 from oo_bin.tunnels.browser_profile import BrowserProfile
+from oo_bin.tunnels.port_allocator import PortAllocator
+from oo_bin.tunnels.probes import socks5_connect_probe, socks5_probe, wait_until_ready
+from oo_bin.tunnels.profile_pool import ProfilePool
+from oo_bin.tunnels.routing import pac
+from oo_bin.tunnels.state_store import StateStore
 from oo_bin.tunnels.tunnel import Tunnel
-from oo_bin.utils import is_autossh_running, is_linux, is_mac, is_wsl, port_available
+from oo_bin.utils import is_linux, is_mac, is_wsl, port_available
+
+# Seconds the shared browser waits for the router to route a new tunnel
+ROUTE_TIMEOUT = 5
 
 
 class Socks(Tunnel):
     def __init__(self, name):
         super().__init__(name)
 
-        self.__forward_port = self.open_port()
         self.__browser_profile_name = None
         self.__browser_profile_path = None
         self.__browser_pid = None
-
-        config_port = self._config.get("forward_port", "2080")
-        if not port_available(int(config_port), self.forward_host):
-            PortUnavailableError(
-                f"Port '{config_port}' is unavailable. Please specify a different port in the configuration file, and your Firefox profile."
-            )
-
-        self.__forward_port = config_port
-
-        self._pickle_file = Path(
-            os.path.join(
-                BaseDirectory.save_data_path("oo_bin"),
-                f"{self.name}_{self.forward_port}_socks.pkl",
-            )
-        )
+        self.__routes = self.__hosts() if self.shared_browser else None
+
+        config_port = self._config.get("forward_port", None)
+        if config_port:
+            self.__forward_port = int(config_port)
+        elif self.multiple_profiles or self.shared_browser:
+            # Each browser profile is set up with the port of its tunnel when it's launched, the router of the shared
+            # browser reads it from the state store
+            self.__forward_port = PortAllocator().allocate([self._port_key])[0]
+        else:
+            # The port of the Tunnels Firefox profile, see the README
+            self.__forward_port = 2080
+
+        self._state_key = f"{self.name}_{self.forward_port}_socks"
+
+    def _restore(self, state):
+        super()._restore(state)
+
+        self.__forward_port = state["port"]
+        self.__browser_profile_name = state["browser_profile_name"]
+        self.__browser_profile_path = state["browser_profile_path"]
+        self.__browser_pid = state["client_pid"]
+        if self.browser_pid:
+            self._start_times[self.browser_pid] = state["client_pid_start"]
+        self.__routes = json.loads(state["routes"]) if state["routes"] else None
+
+    def _state(self):
+        return {
+            **super()._state(),
+            "port": self.forward_port,
+            "browser_profile_name": self.browser_profile_name,
+            "browser_profile_path": self.browser_profile_path,
+            "client_pid": self.browser_pid,
+            "client_pid_start": self._start_times.get(self.browser_pid, None),
+            "routes": json.dumps(self.routes) if self.routes else None,
+        }
+
+    def _release(self):
+        super()._release()
+
+        if self.multiple_profiles and self.browser_profile_path:
+            ProfilePool().release(self.browser_profile_path)
 
     @property
     def multiple_profiles(self):
@@ -48,6 +86,50 @@ class Socks(Tunnel):
             .get("tunnels", {})
             .get("socks", {})
             .get("multiple_profiles", False)
+        ) and not self.shared_browser
+
+    @property
+    def shared_browser(self):
+        return (
+            main_config()
+            .get("tunnels", {})
+            .get("socks", {})
+            .get("shared_browser", False)
+        )
+
+    @property
+    def split_routing(self):
+        """Whether only the hosts of the tunnel go through it, with a proxy auto-config file, see routing.pac"""
+        return self._config.get(
+            "split_routing",
+            main_config()
+            .get("tunnels", {})
+            .get("socks", {})
+            .get("split_routing", False),
+        )
+
+    @staticmethod
+    def router_port():
+        """The port of the router the shared browser uses as its proxy, see Router"""
+        return (
+            main_config().get("tunnels", {}).get("socks", {}).get("router_port", 2090)
+        )
+
+    @staticmethod
+    def shared_profile_path():
+        return os.path.join(BaseDirectory.save_data_path("oo_bin"), "shared_profile")
+
+    @property
+    def routes(self):
+        """The hosts the shared browser reaches through this tunnel, e.g. app.example.com, or *.example.com"""
+        return self.__routes
+
+    def __hosts(self):
+        """The hosts of the urls, and the hosts, domains and networks of the hosts setting"""
+        hosts = [urlparse(x).hostname for x in self.urls or []]
+
+        return list(
+            dict.fromkeys([x for x in hosts if x] + self._config.get("hosts", []))
         )
 
     @property
@@ -58,6 +140,11 @@ class Socks(Tunnel):
     def forward_port(self):
         return self.__forward_port
 
+    @forward_port.setter
+    def forward_port(self, value):
+        self.__forward_port = value
+        self._state_key = f"{self.name}_{self.forward_port}_socks"
+
     @property
     def urls(self):
         return self._config.get("urls") or None
@@ -85,24 +172,50 @@ class Socks(Tunnel):
     @browser_pid.setter
     def browser_pid(self, value):
         self.__browser_pid = value
+        self._track(value)
+
+    def _probe(self):
+        return socks5_probe(self.forward_host, self.forward_port)
+
+    def _health_probe(self, timeout):
+        target = self.__probe_target
+        if not target:
+            return socks5_probe(self.forward_host, self.forward_port, timeout)
+
+        return socks5_connect_probe(
+            self.forward_host, self.forward_port, *target, timeout=timeout
+        )
+
+    @property
+    def __probe_target(self):
+        """The (host, port) to connect to through the tunnel: probe_target, or else the first url"""
+        target = self._config.get("probe_target") or main_config().get(
+            "tunnels", {}
+        ).get("socks", {}).get("probe_target")
+        if target:
+            # host, host:port, or [IPv6 address]:port
+            try:
+                parsed = urlsplit(f"//{target}")
+                host, port = parsed.hostname, parsed.port or 443
+            except ValueError:
+                host = None
+
+            if not host:
+                raise InvalidProfileError(
+                    f"Invalid probe_target for the {self.name} profile: {target}, expected host:port"
+                )
+
+            return (host, port)
+
+        url = urlparse(self.urls[0]) if self.urls else None
+        if not url or not url.hostname:
+            return None
+
+        return (url.hostname, url.port or (443 if url.scheme == "https" else 80))
 
     @property
-    def _cmd(self):
-        return [
-            self._autossh_bin,
-            "-N",
-            "-M",
-            "0",
-            "-D",
-            f"{self.forward_port}",
-            "-o",
-            "ServerAliveInterval=3",
-            "-o",
-            "ServerAliveCountMax=30",
-            "-F",
-            f"{self._ssh_config}",
-            f"{self.jump_host}",
-        ]
+    def _forward(self):
+        return ["-D", f"{self.forward_port}"]
 
     @property
     def __browser_bin(self):
@@ -125,21 +238,49 @@ class Socks(Tunnel):
             )
         SystemNotSupportedError("Your system is not supported")
 
-    def stop(self):
-        super().stop()
+    def _processes(self):
+        processes = super()._processes()
+        if not is_wsl() and self.browser_pid:
+            processes.append(self.process(self.browser_pid))
+
+        return processes
+
+    @property
+    def _port_key(self):
+        return (self.name, "socks", "")
+
+    @property
+    def _listen_address(self):
+        return (self.forward_host, self.forward_port)
+
+    def _on_port(self, port):
+        tunnel = copy.copy(self)
+        tunnel.forward_port = port
 
-        if not is_wsl() and self.is_running(self.browser_pid):
-            self.__kill_browser()
+        return tunnel
 
-    def start(self):
-        if is_autossh_running(self.forward_port):
+    def open(self, tick=None):
+        if forwarding(self.forward_port):
             raise PortUnavailableError(
                 f"Autossh is already running on port {self.forward_port}. You need to stop this process before running tunnels."
             )
 
-        super().start()
-        print(f"Connected to {self.jump_host}")
+        if not port_available(int(self.forward_port), self.forward_host):
+            raise PortUnavailableError(
+                f"Port '{self.forward_port}' is unavailable. Please specify a different port in the configuration file, and your Firefox profile."
+            )
+
+        elapsed = super().open(tick)
 
+        if self.shared_browser:
+            from oo_bin.tunnels.supervisor import Supervisor
+
+            # The router of the shared browser runs in the supervisor, whatever the mode of the tunnel
+            Supervisor.ensure_running()
+
+        return elapsed
+
+    def launch(self):
         if self.urls:
             self.__launch_browser(self.urls)
             print(f"Launching Firefox with tabs: {', '.join(self.urls)}")
@@ -152,12 +293,49 @@ class Socks(Tunnel):
     def __launch_browser(self, urls):
         cmd = [self.__browser_bin]
 
+        if self.shared_browser:
+            path = self.shared_profile_path()
+            BrowserProfile(path).set_socks_proxy("127.0.0.1", self.router_port())
+
+            # The router picks the tunnel up on its next check of the state store, the first pages would go direct
+            routed, _ = wait_until_ready(
+                lambda: (StateStore().tunnel(self._state_key) or {}).get("routed_at"),
+                ROUTE_TIMEOUT,
+            )
+            if not routed:
+                from oo_bin.tunnels.supervisor import log_file
+
+                print(
+                    Fore.YELLOW
+                    + f"The router of the shared browser isn't routing the {self.name} tunnel yet. You can view the logs at {log_file}"
+                )
+
+            # Opens the tabs in the running Firefox if there is one, it isn't the tunnel's to stop
+            with open(self._cache_file, "a") as f:
+                Popen(cmd + ["--profile", path] + urls, stdout=DEVNULL, stderr=f)
+            return
+
+        pac = self.__pac()
+
         if self.multiple_profiles:
             browser_profile = BrowserProfile(self.browser_profile_path)
-            browser_profile.set_socks_proxy(self.forward_host, self.forward_port)
+            if pac:
+                browser_profile.set_proxy_autoconfig(pac)
+            else:
+                browser_profile.set_socks_proxy(self.forward_host, self.forward_port)
 
             cmd += ["--profile", self.browser_profile_path] + urls
         else:
+            # The Tunnels profile is set up by the user, see the README. Its user.js is only written for split routing,
+            # and to undo it
+            path = BrowserProfile.firefox_profile_path(self.browser_profile_name)
+            if path and pac:
+                BrowserProfile(path).set_proxy_autoconfig(pac)
+            elif path and BrowserProfile.has_proxy_autoconfig(path):
+                BrowserProfile(path).set_socks_proxy(
+                    self.forward_host, self.forward_port
+                )
+
             cmd += ["-P", self.browser_profile_name] + urls
 
         with open(self._cache_file, "a") as f:
@@ -166,11 +344,37 @@ class Socks(Tunnel):
             self.browser_pid = pid
             self.save()
 
-    def __kill_browser(self):
-        with open(self._cache_file, "a") as f:
-            Popen(["kill", "-9", str(self.browser_pid)], stdout=DEVNULL, stderr=f)
+    def update_pac(self):
+        """Rewrites the proxy auto-config file of the running browser from the current configuration, see __pac
 
-        return True
+        Firefox reads it again when its proxy settings are reloaded. Turning split routing on or off takes a new
+        browser, user.js changes too.
+        """
+        pac = self.__pac()
+        if not pac or self.shared_browser:
+            return
+
+        if self.multiple_profiles:
+            path = self.browser_profile_path
+        else:
+            path = BrowserProfile.firefox_profile_path(self.browser_profile_name)
+
+        if path:
+            BrowserProfile.update_proxy_autoconfig(path, pac)
+
+    def __pac(self):
+        """The proxy auto-config file of the browser, None to send everything through the tunnel
+
+        Written when the browser is launched, and when the tunnels configuration is updated, see update_pac. The
+        router of the shared browser splits the traffic itself, its routes change while the browser runs.
+        """
+        hosts = self.__hosts()
+        if not self.split_routing or not hosts:
+            return None
+
+        return pac(
+            {x: f"SOCKS5 {self.forward_host}:{self.forward_port}" for x in hosts}
+        )
 
     def runtime_dependencies_met(self):
         super().runtime_dependencies_met()
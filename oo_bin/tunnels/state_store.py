@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from singleton_decorator import singleton
+from xdg import BaseDirectory
+
+# Each schema version adds to the previous one, so state written by an older release keeps loading after an upgrade
+MIGRATIONS = [
+    [
+        """CREATE TABLE tunnels (
+            key TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            pid INTEGER,
+            port INTEGER,
+            host TEXT,
+            remote_port INTEGER,
+            jump_host TEXT,
+            browser_profile_name TEXT,
+            browser_profile_path TEXT,
+            client_pid INTEGER,
+            created_at REAL NOT NULL
+        )""",
+        "CREATE INDEX tunnels_name ON tunnels (name)",
+    ],
+    [
+        "ALTER TABLE tunnels ADD COLUMN pid_start TEXT",
+        "ALTER TABLE tunnels ADD COLUMN client_pid_start TEXT",
+    ],
+    ["ALTER TABLE tunnels ADD COLUMN control_path TEXT"],
+    [
+        "ALTER TABLE tunnels ADD COLUMN mode TEXT",
+        "ALTER TABLE tunnels ADD COLUMN ssh_pid INTEGER",
+        "ALTER TABLE tunnels ADD COLUMN reconnects INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE tunnels ADD COLUMN downtime REAL NOT NULL DEFAULT 0",
+    ],
+    [
+        """CREATE TABLE ports (
+            port INTEGER PRIMARY KEY,
+            profile TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            host TEXT NOT NULL,
+            used_at REAL NOT NULL,
+            UNIQUE (profile, kind, host)
+        )""",
+    ],
+    ["ALTER TABLE tunnels ADD COLUMN active_at REAL"],
+    [
+        """CREATE TABLE browser_profiles (
+            path TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            state TEXT NOT NULL,
+            acquired_at REAL,
+            created_at REAL NOT NULL
+        )""",
+        "CREATE INDEX browser_profiles_state ON browser_profiles (state, created_at)",
+    ],
+    ["ALTER TABLE browser_profiles ADD COLUMN gc_at REAL"],
+    ["ALTER TABLE tunnels ADD COLUMN routes TEXT"],
+    [
+        "ALTER TABLE tunnels ADD COLUMN io_pid INTEGER",
+        "ALTER TABLE tunnels ADD COLUMN io_bytes INTEGER",
+        "ALTER TABLE tunnels ADD COLUMN io_at REAL",
+    ],
+    ["ALTER TABLE tunnels ADD COLUMN backend_port INTEGER"],
+    ["ALTER TABLE tunnels ADD COLUMN routed_at REAL"],
+]
+
+
+@singleton
+class StateStore:
+    """Running tunnels, in a single sqlite database shared by every `oo` process"""
+
+    def __init__(self, path=None):
+        self.path = (
+            path
+            if path
+            else os.path.join(BaseDirectory.save_data_path("oo_bin"), "tunnels.db")
+        )
+        self.__lock = threading.RLock()
+        self.__db = None
+        self.__pid = None
+
+        with self.transaction() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    db.execute(statement)
+            db.execute(f"PRAGMA user_version = {max(version, len(MIGRATIONS))}")
+
+    @property
+    def db(self):
+        # A connection must not be shared with a forked child, e.g. by `oo daemon`
+        if self.__pid != os.getpid():
+            self.__db = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None, check_same_thread=False
+            )
+            self.__db.row_factory = sqlite3.Row
+            self.__db.execute("PRAGMA journal_mode=WAL")
+            self.__pid = os.getpid()
+
+        return self.__db
+
+    @contextmanager
+    def transaction(self):
+        with self.__lock:
+            db = self.db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def version(self):
+        """Changes whenever another process commits a change"""
+        with self.__lock:
+            return self.db.execute("PRAGMA data_version").fetchone()[0]
+
+    def tunnels(self):
+        with self.__lock:
+            return [
+                dict(x)
+                for x in self.db.execute("SELECT * FROM tunnels ORDER BY created_at")
+            ]
+
+    def tunnel(self, key):
+        with self.__lock:
+            row = self.db.execute("SELECT * FROM tunnels WHERE key = ?", (key,))
+            row = row.fetchone()
+
+        return dict(row) if row else None
+
+    def save(self, state):
+        columns = ", ".join(state.keys())
+        placeholders = ", ".join(["?"] * len(state))
+        updates = ", ".join([f"{x} = excluded.{x}" for x in state.keys()])
+
+        with self.transaction() as db:
+            db.execute(
+                f"INSERT INTO tunnels ({columns}) VALUES ({placeholders}) ON CONFLICT (key) DO UPDATE SET {updates}",
+                list(state.values()),
+            )
+
+    def update(self, key, values):
+        """Changes some columns of a saved tunnel, e.g. the counters kept by the supervisor"""
+        updates = ", ".join([f"{x} = ?" for x in values.keys()])
+
+        with self.transaction() as db:
+            db.execute(
+                f"UPDATE tunnels SET {updates} WHERE key = ?",
+                list(values.values()) + [key],
+            )
+
+    def delete(self, key):
+        with self.transaction() as db:
+            db.execute("DELETE FROM tunnels WHERE key = ?", (key,))
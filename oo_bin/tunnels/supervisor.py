@@ -0,0 +1,511 @@
+import asyncio
+import fcntl
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from subprocess import DEVNULL, Popen
+
+from xdg import BaseDirectory
+
+from oo_bin.errors import ProcessFailedError
+from oo_bin.process import running
+from oo_bin.runtime import runtime_path
+from oo_bin.tunnels.routing import RouteTable
+from oo_bin.tunnels.socks import Socks
+from oo_bin.tunnels.state_store import StateStore
+from oo_bin.tunnels.tunnel_manager import TUNNEL_TYPES
+
+# Seconds between checks of the state store, and between probes of a connected forward
+POLL_INTERVAL = 0.5
+PROBE_INTERVAL = 5
+# Failed probes in a row before the ssh process is restarted
+PROBE_FAILURES = 2
+# Reconnect delays double from BACKOFF_BASE up to BACKOFF_MAX, and start over once a connection stayed up STABLE_AFTER
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+STABLE_AFTER = 30
+# Seconds without any tunnel before the supervisor exits
+IDLE_EXIT = 30
+# Bytes relayed at a time between a client of a lazy tunnel and its ssh forward
+RELAY_BUFFER = 65536
+
+# Replies to a SOCKS5 request by status: succeeded, general failure, connection refused, command or address type not
+# supported. The bound address isn't used by browsers
+SOCKS5_REPLY = {x: bytes([5, x, 0, 1, 0, 0, 0, 0, 0, 0]) for x in [0, 1, 5, 7, 8]}
+
+log_file = os.path.join(BaseDirectory.save_cache_path("oo_bin"), "supervisor.log")
+
+
+def lock_path():
+    return os.path.join(runtime_path(), "supervisor.lock")
+
+
+class Supervisor:
+    """Keeps the ssh process of every tunnel started with `tunnels.mode = "supervisor"` connected, in one process
+
+    Tunnels are handed over through the state store: the supervisor runs ssh for every tunnel saved with its pid, until
+    the tunnel is deleted. A tunnel is reconnected when ssh exits or its forward stops answering probes, and the number
+    of reconnects and the downtime are saved with the tunnel.
+    """
+
+    def __init__(self):
+        self.__tasks = {}
+        self.__stopping = None
+        self.__router = Router()
+        self.__router_task = None
+        # Tunnels of the shared browser the router has routes for, and hasn't told yet, see __report_routes
+        self.__unrouted = set()
+
+    @staticmethod
+    def pid():
+        """The pid of the running supervisor, or None"""
+        with open(lock_path(), "a+") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                return None
+            except BlockingIOError:
+                f.seek(0)
+                pid = f.read().strip()
+
+        return int(pid) if pid.isdigit() else None
+
+    @staticmethod
+    def ensure_running(timeout=5):
+        """Starts the supervisor in the background, unless it is already running. Returns its pid"""
+        pid = Supervisor.pid()
+        if pid:
+            return pid
+
+        with open(log_file, "a") as f:
+            Popen(
+                [sys.executable, "-m", "oo_bin.tunnels.supervisor"],
+                stdin=DEVNULL,
+                stdout=f,
+                stderr=f,
+                start_new_session=True,
+            )
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+
+            pid = Supervisor.pid()
+            if pid:
+                return pid
+
+        raise ProcessFailedError(
+            f"The tunnel supervisor didn't start. You can view the logs at {log_file}"
+        )
+
+    def serve(self):
+        with open(lock_path(), "a+") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another supervisor is running
+                return
+
+            lock.truncate(0)
+            lock.write(str(os.getpid()))
+            lock.flush()
+
+            asyncio.run(self.__run())
+
+    def stop(self):
+        self.__stopping.set()
+
+    async def __run(self):
+        self.__stopping = asyncio.Event()
+        for signum in [signal.SIGTERM, signal.SIGINT]:
+            asyncio.get_running_loop().add_signal_handler(signum, self.stop)
+
+        version = None
+        idle_since = time.monotonic()
+
+        while not self.__stopping.is_set():
+            # Only changes when another process saves or deletes a tunnel
+            current_version = StateStore().version()
+            if current_version != version:
+                version = current_version
+                self.__sync()
+
+            if self.__unrouted and self.__router.listening:
+                self.__report_routes()
+
+            if self.__tasks or self.__router.routes:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > IDLE_EXIT:
+                break
+
+            try:
+                await asyncio.wait_for(self.__stopping.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+        tasks = list(self.__tasks.values()) + [x for x in [self.__router_task] if x]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def __sync(self):
+        tunnels = StateStore().tunnels()
+        states = {
+            x["key"]: x
+            for x in tunnels
+            if x["pid"] == os.getpid() and x["type"] in TUNNEL_TYPES
+        }
+
+        # Socks tunnels of the shared browser, whatever their mode, the rows of dead ones stay until `oo` prunes them
+        routed = [x for x in tunnels if x["routes"]]
+        alive = running([(x["pid"], x["pid_start"]) for x in routed])
+        routed = [x for x in routed if x["pid"] in alive]
+        self.__router.update([Socks.restore(x) for x in routed])
+        self.__unrouted = {x["key"] for x in routed if not x["routed_at"]}
+
+        if self.__router_task and self.__router_task.done():
+            # It couldn't listen, it's tried again on the next change
+            self.__router_task = None
+
+        if self.__router.routes and not self.__router_task:
+            self.__router_task = asyncio.ensure_future(
+                self.__router.serve("127.0.0.1", Socks.router_port())
+            )
+
+        for key in set(self.__tasks) - set(states):
+            self.__tasks.pop(key).cancel()
+
+        for key in set(states) - set(self.__tasks):
+            self.__tasks[key] = asyncio.ensure_future(self.__supervise(states[key]))
+
+    def __report_routes(self):
+        """Saves when the router started routing each new tunnel, which launches the shared browser once it has"""
+        for key in self.__unrouted:
+            StateStore().update(key, {"routed_at": time.time()})
+
+        self.__unrouted = set()
+
+    async def __supervise(self, state):
+        if state["mode"] == "lazy":
+            return await OnDemand(state).serve()
+
+        tunnel = TUNNEL_TYPES[state["type"]].restore(state)
+        loop = asyncio.get_running_loop()
+
+        attempt = 0
+        down_since = None
+
+        while True:
+            with open(tunnel._cache_file, "a") as f:
+                process = await asyncio.create_subprocess_exec(
+                    *tunnel._ssh_cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=f
+                )
+            StateStore().update(tunnel._state_key, {"ssh_pid": process.pid})
+
+            up_since = None
+            failures = 0
+            try:
+                while True:
+                    try:
+                        await asyncio.wait_for(
+                            process.wait(),
+                            PROBE_INTERVAL if up_since else POLL_INTERVAL,
+                        )
+                        break
+                    except asyncio.TimeoutError:
+                        pass
+
+                    # The probes use blocking sockets
+                    if await loop.run_in_executor(None, tunnel._probe):
+                        failures = 0
+
+                        if not up_since:
+                            up_since = time.monotonic()
+
+                            if down_since:
+                                tunnel.reconnects += 1
+                                tunnel.downtime += time.time() - down_since
+                                down_since = None
+
+                                StateStore().update(
+                                    tunnel._state_key,
+                                    {
+                                        "reconnects": tunnel.reconnects,
+                                        "downtime": tunnel.downtime,
+                                    },
+                                )
+                    elif up_since:
+                        failures += 1
+                        if failures >= PROBE_FAILURES:
+                            break
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+            down_since = down_since if down_since else time.time()
+            print(
+                f"{tunnel._state_key}: ssh exited with {process.returncode}, reconnecting",
+                file=sys.stderr,
+                flush=True,
+            )
+
+            if up_since and time.monotonic() - up_since >= STABLE_AFTER:
+                attempt = 0
+
+            # Jittered, so tunnels that dropped together don't reconnect in lockstep
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+            attempt += 1
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+
+
+def free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+async def relay(reader, writer):
+    try:
+        while True:
+            data = await reader.read(RELAY_BUFFER)
+            if not data:
+                break
+
+            writer.write(data)
+            await writer.drain()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+class OnDemand:
+    """Listens on the local port of a lazy tunnel, and only runs ssh while clients use it
+
+    ssh forwards a private port, connections to the tunnel's port are relayed to it once the forward passes traffic.
+    ssh is stopped when no client was connected for the tunnel's idle_timeout.
+    """
+
+    def __init__(self, state):
+        self.__tunnel = TUNNEL_TYPES[state["type"]].restore(state)
+
+        # The same forward on a port of its own, the tunnel's port is taken by the supervisor
+        self.__backend = self.__tunnel._on_port(
+            free_port(self.__tunnel._listen_address[0])
+        )
+
+        self.__process = None
+        self.__lock = asyncio.Lock()
+        self.__clients = set()
+        self.__used_at = time.monotonic()
+
+    async def serve(self):
+        host, port = self.__tunnel._listen_address
+        server = await asyncio.start_server(
+            self.__handle, host, int(port), reuse_address=True
+        )
+
+        try:
+            while True:
+                await asyncio.sleep(POLL_INTERVAL)
+
+                idle = time.monotonic() - self.__used_at
+                if (
+                    self.__running()
+                    and not self.__clients
+                    and idle > self.__tunnel._idle_timeout
+                ):
+                    print(
+                        f"{self.__tunnel._state_key}: idle for {idle:.0f}s, disconnecting",
+                        file=sys.stderr,
+                        flush=True,
+                    )
+                    await self.__stop()
+        finally:
+            server.close()
+            for writer in list(self.__clients):
+                writer.close()
+            await self.__stop()
+
+    def __running(self):
+        return self.__process is not None and self.__process.returncode is None
+
+    async def __handle(self, reader, writer):
+        self.__clients.add(writer)
+        try:
+            if await self.__start():
+                upstream = await asyncio.open_connection(
+                    *self.__backend._listen_address
+                )
+                await asyncio.gather(
+                    relay(reader, upstream[1]), relay(upstream[0], writer)
+                )
+        except OSError:
+            pass
+        finally:
+            self.__clients.discard(writer)
+            self.__used_at = time.monotonic()
+            writer.close()
+
+    async def __start(self):
+        """Starts ssh unless it's running, returns whether its forward passes traffic"""
+        async with self.__lock:
+            if self.__running():
+                return True
+
+            backend = self.__backend
+            with open(backend._cache_file, "a") as f:
+                self.__process = await asyncio.create_subprocess_exec(
+                    *backend._ssh_cmd, stdin=DEVNULL, stdout=DEVNULL, stderr=f
+                )
+            StateStore().update(
+                self.__tunnel._state_key,
+                {
+                    "ssh_pid": self.__process.pid,
+                    "backend_port": backend._listen_address[1],
+                },
+            )
+
+            # The probes use blocking sockets
+            loop = asyncio.get_running_loop()
+            deadline = time.monotonic() + backend._ready_timeout
+            while self.__running() and time.monotonic() < deadline:
+                if await loop.run_in_executor(None, backend._probe):
+                    return True
+                await asyncio.sleep(0.05)
+
+            print(
+                f"{self.__tunnel._state_key}: the forward didn't pass traffic after {backend._ready_timeout}s",
+                file=sys.stderr,
+                flush=True,
+            )
+            await self.__stop()
+            return False
+
+    async def __stop(self):
+        if self.__running():
+            self.__process.terminate()
+            try:
+                await asyncio.wait_for(self.__process.wait(), 2)
+            except asyncio.TimeoutError:
+                self.__process.kill()
+                await self.__process.wait()
+
+        if self.__process:
+            self.__process = None
+            StateStore().update(
+                self.__tunnel._state_key, {"ssh_pid": None, "backend_port": None}
+            )
+
+
+class Router:
+    """The SOCKS5 proxy of the shared browser, which sends each connection through the tunnel for its destination
+
+    Tunnels with the shared browser save their routes, the hosts of their urls and the hosts, domains and networks of
+    their `hosts` setting. A connection to a destination that matches a route is relayed through the SOCKS5 forward of
+    its tunnel, any other one is made directly. Firefox sends host names rather than addresses, with
+    network.proxy.socks_remote_dns.
+
+    When tunnels share a route, the one opened last wins it, until it stops.
+    """
+
+    def __init__(self):
+        self.__table = RouteTable()
+        self.listening = False
+
+    def update(self, tunnels):
+        """tunnels in the order they were opened, see StateStore.tunnels"""
+        self.__table = RouteTable(
+            {route: x._listen_address for x in tunnels for route in x.routes}
+        )
+
+    @property
+    def routes(self):
+        return self.__table.size
+
+    def route(self, host):
+        """The (host, port) of the forward to reach host through, None to connect directly, see RouteTable"""
+        return self.__table.lookup(host)
+
+    async def serve(self, host, port):
+        try:
+            server = await asyncio.start_server(
+                self.__handle, host, int(port), reuse_address=True
+            )
+        except OSError as e:
+            print(
+                f"The router can't listen on port {port}: {e}",
+                file=sys.stderr,
+                flush=True,
+            )
+            return
+
+        self.listening = True
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.listening = False
+
+    async def __handle(self, reader, writer):
+        try:
+            version, count = await reader.readexactly(2)
+            methods = await reader.readexactly(count)
+            if version != 5 or 0 not in methods:
+                # Only SOCKS5 without authentication
+                writer.write(b"\x05\xff")
+                return
+            writer.write(b"\x05\x00")
+
+            request = await reader.readexactly(4)
+            if request[3] == 1:
+                address = await reader.readexactly(4)
+                host = socket.inet_ntop(socket.AF_INET, address)
+            elif request[3] == 3:
+                address = await reader.readexactly(1)
+                address += await reader.readexactly(address[0])
+                host = address[1:].decode("idna")
+            elif request[3] == 4:
+                address = await reader.readexactly(16)
+                host = socket.inet_ntop(socket.AF_INET6, address)
+            else:
+                writer.write(SOCKS5_REPLY[8])
+                return
+
+            port = await reader.readexactly(2)
+            if request[1] != 1:
+                # Only CONNECT
+                writer.write(SOCKS5_REPLY[7])
+                return
+
+            forward = self.route(host)
+            try:
+                if forward:
+                    upstream = await asyncio.open_connection(*forward)
+                    upstream[1].write(b"\x05\x01\x00")
+                    if await upstream[0].readexactly(2) != b"\x05\x00":
+                        raise ConnectionError()
+
+                    # ssh replies to the browser once the jump host connected
+                    upstream[1].write(request + address + port)
+                else:
+                    upstream = await asyncio.open_connection(
+                        host, int.from_bytes(port, "big")
+                    )
+                    writer.write(SOCKS5_REPLY[0])
+            except (OSError, asyncio.IncompleteReadError):
+                writer.write(SOCKS5_REPLY[1 if forward else 5])
+                return
+
+            await asyncio.gather(relay(reader, upstream[1]), relay(upstream[0], writer))
+        except (OSError, UnicodeError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+    Supervisor().serve()
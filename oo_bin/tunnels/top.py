@@ -0,0 +1,175 @@
+import time
+from collections import deque
+
+import click
+import tabulate as t
+from colorama import Fore, Style
+
+from oo_bin.errors import OOBinError
+from oo_bin.process import established, io_counters, ssh_processes
+from oo_bin.tunnels.state_store import StateStore
+from oo_bin.tunnels.tunnel import IDLE
+
+
+class Top:
+    """Samples the connections, traffic and latency of the running tunnels, for `oo tunnels top`
+
+    Each sample reads /proc once for every tunnel, and probes the tunnels in parallel.
+    """
+
+    def __init__(self, manager, interval=2, window=10):
+        self.__manager = manager
+        self.__interval = interval
+        self.__window = window
+        self.__version = None
+
+        # By tunnel state key
+        self.__rtts = {}
+        self.__io = {}
+        self.__ssh_pids = {}
+        self.__restarts = {}
+
+    def sample(self):
+        """One row per tunnel, as a dict"""
+        # Pick up tunnels started or stopped elsewhere, and the reconnects counted by the supervisor
+        version = StateStore().version()
+        if version != self.__version:
+            self.__manager.reload()
+            self.__version = version
+
+        tunnels = self.__manager.tunnels()
+        processes = ssh_processes()
+        connections = established([x._listen_address[1] for x in tunnels])
+        health = self.__manager.probe(tunnels, timeout=self.__interval)
+        now = time.monotonic()
+
+        rows = []
+        for tunnel in tunnels:
+            key = tunnel._state_key
+            pid = self.__ssh_pid(tunnel, processes)
+            port = int(tunnel._listen_address[1])
+
+            if tunnel._mode == "autossh" and pid:
+                # autossh started a new ssh, the supervisor counts its own reconnects
+                last = self.__ssh_pids.get(key, pid)
+                if last != pid:
+                    self.__restarts[key] = self.__restarts.get(key, 0) + 1
+                self.__ssh_pids[key] = pid
+
+            rtts = self.__rtts.setdefault(key, deque(maxlen=self.__window))
+            if isinstance(health.get(tunnel, None), float):
+                rtts.append(health[tunnel])
+
+            rows.append(
+                {
+                    "tunnel": tunnel,
+                    "port": port,
+                    "connections": connections[port] if connections else None,
+                    **self.__traffic(key, pid, now),
+                    # The ssh master of multiplexed tunnels carries all of them
+                    "shared": tunnel._mode == "multiplex",
+                    "rtt": health.get(tunnel, None),
+                    "rtt_avg": sum(rtts) / len(rtts) if rtts else None,
+                    "reconnects": tunnel.reconnects + self.__restarts.get(key, 0),
+                }
+            )
+
+        return rows
+
+    @staticmethod
+    def __ssh_pid(tunnel, processes):
+        return tunnel._ssh_pid(processes)
+
+    def __traffic(self, key, pid, now):
+        """The bytes per second the ssh process read and wrote, rather than the traffic of the forward
+
+        ssh reads what it relays from one socket and writes it to the other, so each byte counts on both sides, with
+        the overhead of the ssh protocol.
+        """
+        counters = io_counters(pid) if pid else None
+        previous = self.__io.get(key, None)
+        self.__io[key] = (pid, counters, now)
+
+        if not counters or not previous or previous[0] != pid or not previous[1]:
+            return {"read": None, "written": None}
+
+        elapsed = now - previous[2]
+        return {
+            "read": (counters[0] - previous[1][0]) / elapsed,
+            "written": (counters[1] - previous[1][1]) / elapsed,
+        }
+
+    def print_table(self, rows):
+        headers = [
+            "Profile",
+            "Type",
+            "Local Port",
+            "Connections",
+            "ssh Read",
+            "ssh Written",
+            "RTT",
+            f"RTT avg ({self.__window})",
+            "Reconnects",
+        ]
+
+        table = [
+            [
+                x["tunnel"].name,
+                type(x["tunnel"]).__name__,
+                x["port"],
+                "N/A" if x["connections"] is None else x["connections"],
+                self.__rate(x["read"], x["shared"]),
+                self.__rate(x["written"], x["shared"]),
+                self.__rtt(x["rtt"]),
+                f"{x['rtt_avg'] * 1000:.0f} ms" if x["rtt_avg"] is not None else "-",
+                x["reconnects"],
+            ]
+            for x in rows
+        ]
+
+        if table:
+            print(t.tabulate(table, headers, tablefmt="grid"))
+            if any(x["shared"] and x["read"] is not None for x in rows):
+                print(
+                    "* The ssh master of multiplexed tunnels, shared by the tunnels of its jump host"
+                )
+        else:
+            print(f"\n{Style.BRIGHT}No tunnels are running!")
+
+    @staticmethod
+    def __rtt(value):
+        if value is None:
+            return f"{Fore.RED}Down{Fore.RESET}"
+        if isinstance(value, OOBinError):
+            return f"{Fore.RED}Invalid{Fore.RESET}"
+        if value == IDLE:
+            return f"{Fore.YELLOW}Idle{Fore.RESET}"
+
+        return f"{value * 1000:.0f} ms"
+
+    @staticmethod
+    def __rate(value, shared=False):
+        if value is None:
+            return "-"
+
+        mark = "*" if shared else ""
+        for unit in ["B/s", "KB/s", "MB/s"]:
+            if value < 1024:
+                return f"{value:.0f} {unit}{mark}"
+            value /= 1024
+
+        return f"{value:.1f} GB/s{mark}"
+
+    def run(self):
+        """Refreshes the table every interval seconds, until interrupted"""
+        while True:
+            started = time.monotonic()
+            rows = self.sample()
+
+            click.clear()
+            print(
+                f"{Style.BRIGHT}oo tunnels top{Style.RESET_ALL}, every {self.__interval:g}s, Ctrl-C to quit\n"
+            )
+            self.print_table(rows)
+
+            time.sleep(max(0, self.__interval - (time.monotonic() - started)))
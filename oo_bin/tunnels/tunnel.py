@@ -1,37 +1,58 @@
+import copy
 import os
-import pickle
 import shutil
-import socket
 import time
 from abc import ABC
-from pathlib import Path
-from subprocess import DEVNULL, PIPE, Popen
+from subprocess import DEVNULL, Popen
 
-from progress.bar import IncrementalBar
+from progress.spinner import Spinner
 from xdg import BaseDirectory
 
 from oo_bin.config import main_config, ssh_config_path, tunnels_config
+from oo_bin.control_master import ControlMaster
 from oo_bin.errors import (
     DependencyNotMetError,
     ProcessFailedError,
     TunnelAlreadyStartedError,
+    TunnelTimeoutError,
 )
+from oo_bin.process import forwarding, running, start_time, terminate
+from oo_bin.tunnels.probes import wait_until_ready
+from oo_bin.tunnels.state_store import StateStore
+from oo_bin.utils import port_available
+
+# The health of a lazy tunnel whose ssh isn't running, probing it would connect it
+IDLE = "idle"
 
 
 class Tunnel(ABC):
     def __init__(self, name):
         self.__name = name
         self.__pid = None
+        self._start_times = {}
+        self._control_path = None
+        self._created_at = time.time()
+        self._active_at = None
+        self.reconnects = 0
+        self.downtime = 0
 
-        self._config = tunnels_config(profile=self.name)
+        self._setup()
 
         self.__jump_host = self._config.get("jump_host") or None
 
+        # Clear logfile... we only save errors for the current session
+        open(self._cache_file, "w").close()
+
+        # Can get overwritten by subclasses
+        self._state_key = self.name
+
+    def _setup(self):
+        """Attributes that come from the configuration, rather than from the saved state"""
+        self._config = tunnels_config(profile=self.name)
+
         self._cache_file = os.path.join(
             BaseDirectory.save_cache_path("oo_bin"), "tunnels.log"
         )
-        # Clear logfile... we only save errors for the current session
-        open(self._cache_file, "w").close()
 
         self._autossh_bin = "autossh" if shutil.which("autossh") else None
 
@@ -39,10 +60,60 @@ class Tunnel(ABC):
             main_config().get("tunnels", {}).get("ssh_config", ssh_config_path)
         )
 
-        # Can get overwritten by subclasses
-        self._pickle_file = Path(
-            os.path.join(BaseDirectory.save_data_path("oo_bin"), f"{self.name}.pkl")
+        # Seconds to wait for the forward to pass traffic
+        self._ready_timeout = main_config().get("tunnels", {}).get("ready_timeout", 10)
+
+        # "autossh" runs an autossh per tunnel, "multiplex" adds forwards to a shared ssh master per jump host,
+        # "supervisor" hands the ssh process over to oo_bin.tunnels.supervisor, "lazy" too, but the supervisor only
+        # runs ssh while clients are connected to the tunnel
+        self._mode = main_config().get("tunnels", {}).get("mode", "autossh")
+
+        # Seconds between keepalives, and unanswered keepalives before ssh gives up, in supervisor mode
+        self._keepalive_interval = (
+            main_config().get("tunnels", {}).get("keepalive_interval", 5)
         )
+        self._keepalive_count_max = (
+            main_config().get("tunnels", {}).get("keepalive_count_max", 3)
+        )
+
+        # Seconds without clients before the ssh process of a lazy tunnel is stopped
+        self._idle_timeout = main_config().get("tunnels", {}).get("idle_timeout", 300)
+
+    @classmethod
+    def restore(cls, state):
+        tunnel = cls.__new__(cls)
+        tunnel._restore(state)
+        tunnel._setup()
+
+        # A tunnel is stopped the way it was started, even if the mode was changed since
+        tunnel._mode = state["mode"] or tunnel._mode
+
+        return tunnel
+
+    def _restore(self, state):
+        self.__name = state["name"]
+        self.__pid = state["pid"]
+        self._start_times = {self.pid: state["pid_start"]} if self.pid else {}
+        self.__jump_host = state["jump_host"]
+        self._control_path = state["control_path"]
+        self.reconnects = state["reconnects"]
+        self.downtime = state["downtime"]
+        self._created_at = state["created_at"]
+        self._active_at = state["active_at"]
+        self._state_key = state["key"]
+
+    def _state(self):
+        return {
+            "key": self._state_key,
+            "name": self.name,
+            "type": type(self).__name__,
+            "pid": self.pid,
+            "pid_start": self._start_times.get(self.pid, None),
+            "jump_host": self.jump_host,
+            "control_path": self._control_path,
+            "mode": self._mode,
+            "created_at": self._created_at,
+        }
 
     @property
     def name(self):
@@ -55,7 +126,7 @@ class Tunnel(ABC):
     @pid.setter
     def pid(self, value):
         self.__pid = value
-        # self._save()
+        self._track(value)
 
     @property
     def jump_host(self):
@@ -66,10 +137,17 @@ class Tunnel(ABC):
         self.__jump_host = value
         # self._save()
 
-    def save(self, file=None):
-        pickle_file = file if file else self._pickle_file
-        with open(pickle_file, "wb") as f:
-            pickle.dump(self, f)
+    def save(self):
+        StateStore().save(self._state())
+
+    def _track(self, pid):
+        """Remembers when the process started, so it isn't mistaken for a later process reusing its pid"""
+        if pid:
+            self._start_times[pid] = start_time(pid)
+
+    def process(self, pid=None):
+        pid = pid if pid else self.pid
+        return (pid, self._start_times.get(pid, None))
 
     def is_running(self, pid=None):
         if not pid:
@@ -78,50 +156,229 @@ class Tunnel(ABC):
         if not pid:
             return False
 
-        ps_output = Popen(["ps", "-f", "-p", str(pid)], stdout=PIPE).communicate()
-
-        ps_utf8 = ps_output[0].decode("utf-8") if len(ps_output[0]) > 0 else ""
+        return pid in running([self.process(pid)])
 
-        return True if len(ps_utf8.split("\n")) > 2 else False
+    def open(self, tick=None):
+        """Starts the tunnel and waits for the forward to pass traffic, without any output
 
-    def start(self):
+        Returns the seconds it took. tick is called while waiting, e.g. to animate a spinner.
+        """
         if self.is_running():
             raise TunnelAlreadyStartedError(
                 f"Tunnel for profile {self.name} already running!"
             )
 
-        with open(self._cache_file, "a") as f:
-            process = Popen(self._cmd, stdout=DEVNULL, stderr=f)
-            self.pid = process.pid
+        started = time.monotonic()
+
+        if self._mode == "multiplex":
+            master = self._master()
+            self.pid = master.start(self._ready_timeout)
+            self._control_path = master.control_path
+            master.forward(self._forward)
             self.save()
 
-            bar = IncrementalBar(
-                f"Starting {self.name}", max=20, suffix="%(percent)d%%"
+            program = "ssh"
+            alive = self.is_running
+        elif self._mode in ["supervisor", "lazy"]:
+            from oo_bin.tunnels.supervisor import Supervisor
+
+            self.pid = Supervisor.ensure_running()
+            self.save()
+
+            program = "The tunnel supervisor"
+            alive = self.is_running
+        else:
+            with open(self._cache_file, "a") as f:
+                process = Popen(self._cmd, stdout=DEVNULL, stderr=f)
+                self.pid = process.pid
+                self.save()
+
+            program = "autossh"
+
+            def alive():
+                return process.poll() is None
+
+        # Probing a lazy tunnel would connect it, it's ready once the supervisor listens on its port
+        probe = self.__listening if self._mode == "lazy" else self._probe
+        ready, _ = wait_until_ready(probe, self._ready_timeout, alive=alive, tick=tick)
+        elapsed = time.monotonic() - started
+
+        if not ready:
+            # Checked before stopping, which would make every failure look like an exit
+            exited = not alive()
+            self.stop()
+
+            if exited:
+                raise ProcessFailedError(
+                    f"{program} failed after {elapsed:.2g}s. You can view the logs at {self._cache_file}"
+                )
+
+            raise TunnelTimeoutError(
+                f"{self.name} was not ready after {self._ready_timeout}s. You can view the logs at {self._cache_file}"
             )
-            for i in range(0, 20):
-                time.sleep(0.15)
-                bar.next()
-                if process.poll():
-                    print("")
-                    msg = f"autossh failed after {(i * 0.15):.2g}s.\
-You can view the logs at {self._cache_file}"
 
-                    raise ProcessFailedError(msg)
-            bar.finish()
+        return elapsed
+
+    def __listening(self):
+        host, port = self._listen_address
+        return not port_available(int(port), host)
+
+    def _master(self):
+        return ControlMaster(
+            self._ssh_config,
+            self.jump_host,
+            control_path=self._control_path,
+            log_file=self._cache_file,
+        )
+
+    def start(self):
+        spinner = Spinner(f"Starting {self.name} ")
+        try:
+            elapsed = self.open(tick=spinner.next)
+        finally:
+            spinner.finish()
+
+        print(f"Connected to {self.jump_host} in {elapsed:.2f}s")
+        self.launch()
+
+        return elapsed
+
+    def launch(self):
+        """Opens the client for the tunnel, e.g. Firefox for a Socks tunnel"""
+        pass
+
+    def _probe(self):
+        """Whether the forward passes traffic yet"""
+        raise NotImplementedError
+
+    def health(self, timeout=2):
+        """Checks the tunnel end to end, returns the round trip in seconds, None when it's down, or IDLE"""
+        if self._control_path and not self._master().pid:
+            return None
+
+        tunnel = self
+        if self._mode == "lazy":
+            # The supervisor saves the pid of ssh while it runs
+            state = StateStore().tunnel(self._state_key)
+            if not state or not state["ssh_pid"]:
+                return IDLE
+
+            # Through the supervisor's listener, the probe would count as a client and keep ssh running
+            tunnel = self._on_port(state["backend_port"])
+
+        started = time.perf_counter()
+        if not tunnel._health_probe(timeout):
+            return None
+
+        return time.perf_counter() - started
+
+    def _health_probe(self, timeout):
+        """Whether the service behind the forward answers, not just the local listener"""
+        raise NotImplementedError
+
+    @property
+    def _forward(self):
+        """The ssh arguments for the forward, e.g. ["-D", "2080"]"""
+        raise NotImplementedError
+
+    @property
+    def _cmd(self):
+        return [
+            self._autossh_bin,
+            "-N",
+            "-M",
+            "0",
+            *self._forward,
+            "-o",
+            "ServerAliveInterval=3",
+            "-o",
+            "ServerAliveCountMax=30",
+            "-F",
+            f"{self._ssh_config}",
+            f"{self.jump_host}",
+        ]
+
+    @property
+    def _ssh_cmd(self):
+        """ssh without autossh, for the supervisor"""
+        return [
+            "ssh",
+            "-N",
+            *self._forward,
+            "-o",
+            "BatchMode=yes",
+            "-o",
+            "ExitOnForwardFailure=yes",
+            "-o",
+            "ConnectTimeout=10",
+            "-o",
+            f"ServerAliveInterval={self._keepalive_interval}",
+            "-o",
+            f"ServerAliveCountMax={self._keepalive_count_max}",
+            "-F",
+            f"{self._ssh_config}",
+            f"{self.jump_host}",
+        ]
 
     def stop(self):
-        if self.is_running():
-            Popen(["kill", str(self.pid)], stdout=DEVNULL)
+        self._release()
+        terminate(self._processes())
+
+    def _release(self):
+        """Everything stop does, except for stopping processes, which TunnelManager.stop does for many tunnels at once"""
+        if self._control_path:
+            # The master is shared with other tunnels, see TunnelManager.stop
+            self._master().cancel(self._forward)
+
+        StateStore().delete(self._state_key)
+
+    def _processes(self):
+        """The (pid, start time) of the processes to stop with the tunnel"""
+        if self._control_path or self._mode in ["supervisor", "lazy"] or not self.pid:
+            # The supervisor stops the ssh process once the state is deleted
+            return []
+
+        return [self.process()]
 
-        self._pickle_file.unlink(missing_ok=True)
+    def _ssh_pid(self, processes=None):
+        """The ssh process relaying the tunnel's traffic, autossh only watches it. None when there's none"""
+        if self._mode in ["supervisor", "lazy"]:
+            # The supervisor's ssh forwards a port of its own, it saves the pid while it runs
+            state = StateStore().tunnel(self._state_key)
+            return state["ssh_pid"] if state else None
+
+        pids = [
+            x.pid
+            for x in forwarding(self._listen_address[1], processes)
+            if x.program == "ssh"
+        ]
+        if pids:
+            return pids[0]
+
+        # Forwards added to a control master aren't in its arguments, its traffic is shared with other tunnels
+        return self.pid if self._control_path else None
+
+    @property
+    def _listen_address(self):
+        """The local (host, port) of the forward"""
+        raise NotImplementedError
+
+    def _on_port(self, port):
+        """A copy of the tunnel forwarding another local port, e.g. the private port of a lazy tunnel's ssh"""
+        raise NotImplementedError
+
+    @property
+    def _port_key(self):
+        """The (profile, kind, host) the local port is reserved for, see PortAllocator"""
+        raise NotImplementedError
 
     def runtime_dependencies_met(self):
-        if not self._autossh_bin:
+        if self._mode in ["multiplex", "supervisor", "lazy"]:
+            if not shutil.which("ssh"):
+                raise DependencyNotMetError(
+                    "ssh is not installed, or is not in the path"
+                )
+        elif not self._autossh_bin:
             raise DependencyNotMetError(
                 "autossh is not installed, or is not in the path"
             )
-
-    def open_port(self):
-        sock = socket.socket()
-        sock.bind(("", 0))
-        return sock.getsockname()[1]
@@ -1,16 +1,39 @@
 import os
 import pickle
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from subprocess import DEVNULL, Popen
 
 import tabulate as t
 from colorama import Fore, Style
+from progress.bar import IncrementalBar
 from singleton_decorator import singleton
 from xdg import BaseDirectory
 
-from oo_bin.errors import BrowserProfileUnavailableError
+from oo_bin.config import main_config, ssh_config_path
+from oo_bin.errors import BrowserProfileUnavailableError, OOBinError
+from oo_bin.process import running, ssh_processes, terminate
+from oo_bin.tunnels.port_allocator import PortAllocator
+from oo_bin.tunnels.probes import wait_until_closed
+from oo_bin.tunnels.profile_pool import ProfilePool
+from oo_bin.tunnels.rdp import Rdp
 from oo_bin.tunnels.socks import Socks
+from oo_bin.tunnels.state_store import StateStore
+from oo_bin.tunnels.tunnel import IDLE
+from oo_bin.tunnels.tunnel_type import TunnelType
+from oo_bin.tunnels.vnc import Vnc
+
+# Probes run in parallel, so a status check takes about one probe timeout however many tunnels run
+PROBE_WORKERS = 64
+# Tunnels `oo tunnels up` connects at a time, sshd drops unauthenticated connections past MaxStartups, 10 by default
+UP_WORKERS = 8
+
+TUNNEL_TYPES = {
+    TunnelType.SOCKS.value: Socks,
+    TunnelType.RDP.value: Rdp,
+    TunnelType.VNC.value: Vnc,
+}
 
 
 @singleton
@@ -21,35 +44,99 @@ class TunnelManager:
             if state_directory
             else Path(BaseDirectory.save_data_path("oo_bin"))
         )
+        self.__state_directory = state_directory
         self.__tunnels = self.__load_tunnels(state_directory)
 
+    def reload(self):
+        self.__tunnels = self.__load_tunnels(self.__state_directory)
+
+    def prune(self):
+        self.__tunnels = self.__running(self.__tunnels)
+
     def __load_tunnels(self, state_directory):
-        tunnels = []
+        self.__import_legacy_state(state_directory)
+
+        tunnels = [
+            TUNNEL_TYPES[x["type"]].restore(x)
+            for x in StateStore().tunnels()
+            if x["type"] in TUNNEL_TYPES
+        ]
+
+        return self.__running(tunnels)
+
+    def __running(self, tunnels):
+        """Stops the tunnels that died, checking every tunnel in one pass"""
+        alive = running([x.process() for x in tunnels])
+
+        for tunnel in [x for x in tunnels if x.pid not in alive]:
+            tunnel.stop()
+
+        return [x for x in tunnels if x.pid in alive]
+
+    def __import_legacy_state(self, state_directory):
+        """Moves tunnels saved as pickle files, by releases before the state store, into the store"""
         for data_path in sorted(state_directory.glob("*.pkl"), key=os.path.getmtime):
+            tunnel = None
             try:
                 with open(data_path, "rb") as f:
                     tunnel = pickle.load(f)
 
-                    if tunnel.is_running():
-                        tunnels.append(tunnel)
-                    else:
-                        tunnel.stop()
-            except (AttributeError, EOFError, ImportError, IndexError):
+                state = self.__legacy_state(tunnel, data_path)
+                TUNNEL_TYPES[state["type"]].restore(state).save()
+            except (AttributeError, EOFError, ImportError, IndexError, KeyError):
                 print(f"{Style.BRIGHT}Inconsistent tunnel state detected.\n")
                 print(f"Deleting state file: {Style.BRIGHT}{data_path}")
-                data_path.unlink(missing_ok=True)
 
-                if tunnel.pid:
+                if tunnel and tunnel.pid:
                     print(
                         f"Stopping the offending tunnel, with PID: {Style.BRIGHT}{tunnel.pid}"
                     )
                     Popen(["kill", str(tunnel.pid)], stdout=DEVNULL, stderr=DEVNULL)
 
-        return tunnels
+            data_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def __legacy_state(tunnel, data_path):
+        """The state of a pickled tunnel, whose attributes are the ones of the release that pickled it"""
+        fields = vars(tunnel)
+        kind = type(tunnel).__name__
+
+        # Name mangled, by the class that set them
+        def field(cls, name):
+            return fields.get(f"_{cls}__{name}", None)
+
+        return {
+            "key": data_path.stem,
+            "name": field("Tunnel", "name"),
+            "type": kind,
+            "pid": field("Tunnel", "pid"),
+            "pid_start": None,
+            "jump_host": field("Tunnel", "jump_host"),
+            "control_path": None,
+            "mode": "autossh",
+            "reconnects": 0,
+            "downtime": 0,
+            "created_at": os.path.getmtime(data_path),
+            "active_at": None,
+            "port": field(kind, "forward_port") or field(kind, "local_port"),
+            "host": field(kind, "host"),
+            "remote_port": field(kind, "port"),
+            "browser_profile_name": field(kind, "browser_profile_name"),
+            "browser_profile_path": field(kind, "browser_profile_path"),
+            "client_pid": field(kind, f"{kind.lower()}_pid")
+            or field(kind, "browser_pid"),
+            "client_pid_start": None,
+            "routes": None,
+        }
 
     def add(self, tunnel):
         if isinstance(tunnel, Socks):
-            if tunnel.multiple_profiles:
+            if tunnel.shared_browser:
+                self.__check_routes(tunnel)
+                tunnel.browser_profile_name = "Shared"
+                tunnel.browser_profile_path = Socks.shared_profile_path()
+
+            elif tunnel.multiple_profiles:
                 next_profile_name, next_profile_path = self.next_browser_profile()
                 tunnel.browser_profile_name = next_profile_name
                 tunnel.browser_profile_path = next_profile_path
@@ -66,6 +153,127 @@ class TunnelManager:
         self.__tunnels.append(tunnel)
         return tunnel
 
+    def update_pacs(self):
+        """Rewrites the proxy auto-config files of the running browsers, once the tunnels configuration changed"""
+        for tunnel in self.tunnels(type=Socks):
+            tunnel.update_pac()
+
+    def __check_routes(self, tunnel):
+        """The router of the shared browser sends each host through the most recently opened tunnel that routes it"""
+        if not tunnel.routes:
+            print(
+                Fore.YELLOW
+                + f"The {tunnel.name} tunnel has no urls or hosts, the shared browser won't send anything through it"
+                + Fore.RESET
+            )
+
+        for other in self.tunnels(type=Socks):
+            shared = set(other.routes or []) & set(tunnel.routes)
+            if shared:
+                print(
+                    Fore.YELLOW
+                    + f"{', '.join(sorted(shared))} now goes through the {tunnel.name} tunnel rather than {other.name}, until {tunnel.name} stops"
+                    + Fore.RESET
+                )
+
+    def up(self, tunnels, launch=True):
+        """Starts several tunnels at once, and prints how each one went
+
+        Returns (tunnel, seconds to ready or the error) pairs, in the order of tunnels.
+        """
+        for tunnel in tunnels:
+            tunnel.runtime_dependencies_met()
+            self.add(tunnel)
+
+        self.__allocate_ports(tunnels)
+
+        results = {}
+        bar = IncrementalBar(
+            f"Starting {len(tunnels)} tunnels",
+            max=len(tunnels),
+            suffix="%(index)d/%(max)d",
+        )
+        workers = min(
+            main_config().get("tunnels", {}).get("up_workers", UP_WORKERS),
+            len(tunnels),
+        )
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(x.open): x for x in tunnels}
+            for future in as_completed(futures):
+                tunnel = futures[future]
+                try:
+                    results[tunnel] = future.result()
+                except OOBinError as e:
+                    results[tunnel] = e
+                    self.__tunnels.remove(tunnel)
+                bar.next()
+        bar.finish()
+
+        self.__exit_idle_masters(
+            [x for x in tunnels if isinstance(results[x], OOBinError)]
+        )
+
+        table = []
+        for tunnel in tunnels:
+            result = results[tunnel]
+            if isinstance(result, OOBinError):
+                status = f"{Fore.RED}{result}{Fore.RESET}"
+            else:
+                status = f"Ready in {result:.2f}s"
+                if launch:
+                    tunnel.launch()
+
+            table.append(
+                [
+                    tunnel.name,
+                    type(tunnel).__name__,
+                    "N/A" if isinstance(tunnel, Socks) else tunnel.host,
+                    self.__local_port(tunnel),
+                    status,
+                ]
+            )
+
+        print(
+            t.tabulate(
+                table,
+                ["Profile", "Type", "Host", "Local Port", "Status"],
+                tablefmt="grid",
+            )
+        )
+
+        return [(x, results[x]) for x in tunnels]
+
+    @staticmethod
+    def __local_port(tunnel):
+        return tunnel._listen_address[1]
+
+    def __allocate_ports(self, tunnels):
+        """Moves tunnels whose local port is taken, by a running tunnel or another tunnel in the batch, to a free one"""
+        taken = set(
+            int(self.__local_port(x)) for x in self.__tunnels if x not in tunnels
+        )
+        taken.update(f.port for x in ssh_processes() for f in x.forwards)
+
+        conflicts = []
+        for tunnel in tunnels:
+            port = int(self.__local_port(tunnel))
+            if port not in taken:
+                taken.add(port)
+            elif (
+                not isinstance(tunnel, Socks)
+                or tunnel.multiple_profiles
+                or tunnel.shared_browser
+            ):
+                # The Tunnels Firefox profile is set up for the configured port, a single profile Socks tunnel can't move
+                conflicts.append(tunnel)
+
+        ports = PortAllocator().allocate([x._port_key for x in conflicts], taken)
+        for tunnel, port in zip(conflicts, ports):
+            if isinstance(tunnel, Socks):
+                tunnel.forward_port = port
+            else:
+                tunnel.local_port = port
+
     def tunnel(self, profile):
         tunnels = [x for x in self.__tunnels if x.name == profile]
 
@@ -77,7 +285,8 @@ class TunnelManager:
         else:
             return [x for x in self.__tunnels]
 
-    def print_table(self, tunnels, no_data_msg="No tunnels are running!"):
+    def print_table(self, tunnels, no_data_msg="No tunnels are running!", health=None):
+        """health maps tunnels to the result of probe, to add a column with it"""
         headers = [
             "Profile",
             "Type",
@@ -85,38 +294,111 @@ class TunnelManager:
             "PID",
             "Forward Port",
             "Browser Profile",
+            "Reconnects",
         ]
+        if health is not None:
+            headers.append("Health")
 
         table = []
 
         for tunnel in tunnels:
             if tunnel.pid:
-                table.append(
-                    [
-                        tunnel.name,
-                        type(tunnel).__name__,
-                        tunnel.jump_host,
-                        tunnel.pid,
-                        (
-                            tunnel.forward_port
-                            if isinstance(tunnel, Socks)
-                            else tunnel.local_port
-                        ),
-                        (
-                            tunnel.browser_profile_name
-                            if isinstance(tunnel, Socks)
-                            else "N/A"
-                        ),
-                    ]
-                )
+                row = [
+                    tunnel.name,
+                    type(tunnel).__name__,
+                    tunnel.jump_host,
+                    tunnel.pid,
+                    (
+                        tunnel.forward_port
+                        if isinstance(tunnel, Socks)
+                        else tunnel.local_port
+                    ),
+                    (
+                        tunnel.browser_profile_name
+                        if isinstance(tunnel, Socks)
+                        else "N/A"
+                    ),
+                    (
+                        f"{tunnel.reconnects} ({tunnel.downtime:.0f}s down)"
+                        if tunnel._mode == "supervisor"
+                        else "N/A"
+                    ),
+                ]
+                if health is not None:
+                    row.append(self.__health(health.get(tunnel, None)))
+
+                table.append(row)
 
         if table:
             print(t.tabulate(table, headers, tablefmt="grid"))
         else:
             print(f"\n{Style.BRIGHT}{no_data_msg}")
 
-    def status(self, type=None):
-        self.print_table(self.tunnels(type))
+    @staticmethod
+    def __health(latency):
+        if latency is None:
+            return f"{Fore.RED}Down{Fore.RESET}"
+        if isinstance(latency, OOBinError):
+            return f"{Fore.RED}{latency}{Fore.RESET}"
+        if latency == IDLE:
+            return f"{Fore.YELLOW}Idle{Fore.RESET}"
+
+        return f"{Fore.GREEN}{latency * 1000:.0f} ms{Fore.RESET}"
+
+    def status(self, type=None, probe=False):
+        tunnels = self.tunnels(type)
+        self.print_table(tunnels, health=self.probe(tunnels) if probe else None)
+        self.print_orphans()
+
+    def probe(self, tunnels, timeout=2):
+        """Checks every tunnel end to end at once
+
+        Returns a dict of the round trip in seconds of each tunnel, None for the ones that are down, IDLE for lazy
+        tunnels that aren't connected, and the error for the ones that can't be probed, e.g. an invalid probe_target.
+        """
+        if not tunnels:
+            return {}
+
+        def health(tunnel):
+            try:
+                return tunnel.health(timeout)
+            except OOBinError as e:
+                return e
+
+        workers = min(PROBE_WORKERS, len(tunnels))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            latencies = executor.map(health, tunnels)
+
+            return dict(zip(tunnels, latencies))
+
+    def orphans(self):
+        """autossh processes oo started that no saved tunnel accounts for, e.g. left behind by a crash
+
+        Only the ones using the ssh config of oo, or forwarding a port oo allocated, the others aren't oo's to report.
+        """
+        pids = [x.pid for x in self.__tunnels]
+        ssh_config = main_config().get("tunnels", {}).get("ssh_config", ssh_config_path)
+        ports = PortAllocator().reserved()
+
+        return [
+            x
+            for x in ssh_processes()
+            if x.program == "autossh"
+            and x.pid not in pids
+            and (x.ssh_config == ssh_config or any(f.port in ports for f in x.forwards))
+        ]
+
+    def print_orphans(self):
+        table = [
+            [x.pid, x.destination, ", ".join([str(f) for f in x.forwards])]
+            for x in self.orphans()
+        ]
+
+        if table:
+            print(
+                f"\n{Fore.YELLOW}These autossh processes were started by oo, but no tunnel manages them, stop them with `kill PID`:"
+            )
+            print(t.tabulate(table, ["PID", "Jump Host", "Forwards"], tablefmt="grid"))
 
     def stop_all(self, type=None):
         if type:
@@ -125,16 +407,27 @@ class TunnelManager:
             self.stop([x for x in self.__tunnels])
 
     def stop(self, tunnels):
-        stopped = []
+        stopped = list(tunnels)
 
-        for tunnel in tunnels:
-            try:
-                tunnel.stop()
-                stopped.append(tunnel)
-                self.__tunnels.remove(tunnel)
+        for tunnel in stopped:
+            tunnel._release()
+            self.__tunnels.remove(tunnel)
+
+        self.__exit_idle_masters(stopped)
 
-            except FileNotFoundError:
-                print(f"{Fore.YELLOW}autossh is not running", file=sys.stderr)
+        # Signal every process at once, then make sure the ports are free for the next tunnel
+        still_running = terminate([p for x in stopped for p in x._processes()])
+        still_listening = wait_until_closed([x._listen_address for x in stopped], 2)
+
+        if still_running:
+            pids = ", ".join([str(x) for x in sorted(still_running)])
+            print(f"{Fore.YELLOW}These processes didn't stop: {pids}", file=sys.stderr)
+
+        if still_listening:
+            ports = ", ".join([str(port) for _, port in still_listening])
+            print(
+                f"{Fore.YELLOW}These ports are still in use: {ports}", file=sys.stderr
+            )
 
         if len(stopped) > 0:
             profile_names = ", ".join([el.name for el in stopped])
@@ -150,28 +443,21 @@ class TunnelManager:
         else:
             print(f"{Style.BRIGHT}No tunnels are running.")
 
-    def next_browser_profile(self):
-        profiles_dir = Path(
-            os.path.join(BaseDirectory.save_data_path("oo_bin"), "profiles")
-        )
-
-        all_profiles = [str(x) for x in profiles_dir.glob("*")]
-
-        running_profiles = [
-            x.browser_profile_path for x in self.__tunnels if isinstance(x, Socks)
-        ]
-
-        available_profiles = list(set(all_profiles) - set(running_profiles))
+    def masters(self):
+        """The tunnels forwarded over each ssh control master, by control path"""
+        masters = {}
+        for tunnel in [x for x in self.__tunnels if x._control_path]:
+            masters.setdefault(tunnel._control_path, []).append(tunnel)
 
-        if len(available_profiles) == 0:
-            if self.multiple_profiles:
-                error_message = """No Browser Profile is available.
+        return masters
 
-    You can create a new profile by running:      `oo tunnels profile new`
-    You can clone an existing profile by running: `oo tunnels profile clone <ProfileName>`"""
-            else:
-                error_message = "A Socks tunnel is already running. If you want to run multiple tunnels, you can enable it in the configuration."
+    def __exit_idle_masters(self, stopped):
+        masters = self.masters()
 
-            raise BrowserProfileUnavailableError(error_message)
+        idle = {x._control_path: x for x in stopped if x._control_path}
+        for control_path, tunnel in idle.items():
+            if control_path not in masters:
+                tunnel._master().exit()
 
-        return (os.path.basename(available_profiles[0]), str(available_profiles[0]))
+    def next_browser_profile(self):
+        return ProfilePool().acquire()
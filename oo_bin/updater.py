@@ -0,0 +1,236 @@
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+from colorama import Fore
+from xdg import BaseDirectory
+
+from oo_bin import __version__
+from oo_bin.config import backup_tunnels_config, config_path, main_config
+from oo_bin.errors import HttpError, OOBinError
+from oo_bin.utils import last_update_file, staged_update_path
+
+update_lock_file = os.path.join(BaseDirectory.save_data_path("oo_bin"), "update.lock")
+update_log_file = os.path.join(BaseDirectory.save_cache_path("oo_bin"), "update.log")
+config_files = ["tunnels.toml", "ssh_config"]
+
+
+def update_tunnels_config():
+    config = main_config()
+
+    update = config.get("tunnels", {}).get("update", {})
+    enabled = update.get("enabled", True)
+
+    if enabled:
+        backup_tunnels_config()
+
+        for file in config_files:
+            try:
+                __download_config_file(update, file, f"{config_path}/{file}")
+                print(
+                    Fore.GREEN
+                    + f"Your configuration has been updated from {update.get('url')}/{file}"
+                )
+            except requests.exceptions.HTTPError as e:
+                raise HttpError(
+                    f"Your configuration could not be automatically updated. See the error below for more details:\n\n{e}"
+                )
+
+        __update_pacs()
+    else:
+        print(Fore.RED + "Remote updates are disabled in your configuration")
+
+
+def __download_config_file(update, file, destination):
+    with requests.get(
+        f"{update.get('url')}/{file}",
+        auth=(update.get("username"), update.get("password")),
+        stream=True,
+    ) as r:
+        r.raise_for_status()
+        with open(destination, "wb") as f:
+            shutil.copyfileobj(r.raw, f)
+
+
+def __update_pacs():
+    """The proxy.pac of running browsers is written from the tunnels configuration"""
+    from oo_bin.tunnels import TunnelManager
+
+    TunnelManager().update_pacs()
+
+
+def __latest_release_info():
+    with requests.get(
+        "https://api.github.com/repos/outsideopen/oo-bin-py/releases/latest"
+    ) as r:
+        r.raise_for_status()
+        response = r.json()
+
+        return response
+
+
+def __release_info(tag):
+    with requests.get(
+        "https://api.github.com/repos/outsideopen/oo-bin-py/releases"
+    ) as r:
+        r.raise_for_status()
+        response = r.json()
+        for release in response:
+            if release["tag_name"] == tag:
+                return release
+
+        return False
+
+
+def __download_package(url):
+    tmp_dir = tempfile.mkdtemp(dir=tempfile.gettempdir())
+    tmp_file = Path(tmp_dir).joinpath(Path(url).name)
+
+    with requests.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(tmp_file, "wb") as f:
+            for chunk in r.iter_content():
+                f.write(chunk)
+
+    return tmp_file
+
+
+def update_package(tag=""):
+    if tag == "":
+        release_info = __latest_release_info()
+        tag = release_info.get("tag_name")
+    else:
+        release_info = __release_info(tag)
+        if release_info is False:
+            print(f"No release info for {tag}")
+            sys.exit(1)
+
+    install_release(release_info)
+
+
+def install_release(release_info):
+    tag = release_info.get("tag_name")
+
+    if __version__ == "0.0.0":
+        print("Updates are not supported on development versions of the project.")
+        sys.exit(1)
+
+    if tag != __version__:
+        confirm = input(
+            f"New version {tag} is available. Do you want to update now? [yN] "
+        )
+
+        if confirm in ["y", "Y"]:
+            download_url = release_info.get("assets", [{}])[0].get(
+                "browser_download_url", None
+            )
+
+            from oo_bin.tunnels.state_store import StateStore
+
+            if len(StateStore().tunnels()) > 0:
+                raise OOBinError(
+                    "The application cannot be updated while tunnels are running. Please stop all tunnels and try again:\n\noo tunnels stop\noo --update"
+                )
+
+            tmp_file = __download_package(download_url)
+
+            cmd = ["pipx", "install", "--force", str(tmp_file)]
+            subprocess.run(cmd)
+
+
+@contextmanager
+def __update_lock():
+    """Yields whether this process holds the update lock, without waiting for it"""
+    with open(update_lock_file, "w") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        yield True
+
+
+def stage_update():
+    """Downloads the remote configuration and the latest release info into the staging directory
+
+    This runs in a detached process started by `auto_update`. The next `oo` invocation applies what is staged, see
+    `apply_staged_update`.
+    """
+    with __update_lock() as locked:
+        if not locked:
+            return
+
+        try:
+            os.makedirs(staged_update_path, exist_ok=True)
+            update = main_config().get("tunnels", {}).get("update", {})
+
+            if update.get("enabled", True) and update.get("url"):
+                for file in config_files:
+                    tmp_file = f"{staged_update_path}.{file}.part"
+                    __download_config_file(update, file, tmp_file)
+                    os.replace(tmp_file, os.path.join(staged_update_path, file))
+
+            release_info = __latest_release_info()
+            if __version__ != "0.0.0" and release_info.get("tag_name") != __version__:
+                tmp_file = f"{staged_update_path}.release.json.part"
+                with open(tmp_file, "w") as f:
+                    json.dump(release_info, f)
+                os.replace(tmp_file, os.path.join(staged_update_path, "release.json"))
+
+        except Exception:
+            with open(update_log_file, "a") as f:
+                f.write(f"{datetime.now()}\n")
+                traceback.print_exc(file=f)
+
+            # Try again in an hour, rather than tomorrow
+            with open(last_update_file, "w") as f:
+                f.write(str(datetime.now() - timedelta(days=1, hours=-1)))
+
+
+def apply_staged_update():
+    with __update_lock() as locked:
+        if not locked:
+            return
+
+        staged_files = [
+            x
+            for x in config_files
+            if os.path.exists(os.path.join(staged_update_path, x))
+        ]
+        if staged_files:
+            backup_tunnels_config()
+            url = main_config().get("tunnels", {}).get("update", {}).get("url")
+
+            for file in staged_files:
+                os.replace(
+                    os.path.join(staged_update_path, file),
+                    os.path.join(config_path, file),
+                )
+                print(
+                    Fore.GREEN
+                    + f"Your configuration has been updated from {url}/{file}"
+                )
+
+            __update_pacs()
+
+        release_file = os.path.join(staged_update_path, "release.json")
+        if os.path.exists(release_file):
+            with open(release_file, "r") as f:
+                release_info = json.load(f)
+            os.remove(release_file)
+
+            install_release(release_info)
+
+
+if __name__ == "__main__":
+    stage_update()
@@ -1,25 +1,19 @@
 import os
-import shutil
 import socket
 import subprocess
 import sys
-import tempfile
 from datetime import datetime, timedelta
-from pathlib import Path
 from platform import uname
-from subprocess import PIPE, Popen
+from subprocess import DEVNULL, Popen
 
 import click
-import requests
-from colorama import Fore
 from xdg import BaseDirectory
 
-from oo_bin import __version__
-from oo_bin.config import backup_tunnels_config, config_path, main_config
-from oo_bin.errors import HttpError, OOBinError
+from oo_bin.config import main_config
 
 data_path = BaseDirectory.save_data_path("oo_bin")
 last_update_file = os.path.join(data_path, "last_update")
+staged_update_path = os.path.join(data_path, "staged_update")
 
 
 def is_wsl():
@@ -41,41 +35,6 @@ def is_linux():
     return "Linux" in uname().system
 
 
-def update_tunnels_config():
-    config = main_config()
-
-    update = config.get("tunnels", {}).get("update", {})
-    enabled = update.get("enabled", True)
-
-    if enabled:
-        backup_tunnels_config()
-
-        files = ["tunnels.toml", "ssh_config"]
-        username = update.get("username")
-        password = update.get("password")
-
-        for file in files:
-            try:
-                with requests.get(
-                    f"{update.get('url')}/{file}",
-                    auth=(username, password),
-                    stream=True,
-                ) as r:
-                    r.raise_for_status()
-                    with open(f"{config_path}/{file}", "wb") as f:
-                        shutil.copyfileobj(r.raw, f)
-                print(
-                    Fore.GREEN
-                    + f"Your configuration has been updated from {update.get('url')}/{file}"
-                )
-            except requests.exceptions.HTTPError as e:
-                raise HttpError(
-                    f"Your configuration could not be automatically updated. See the error below for more details:\n\n{e}"
-                )
-    else:
-        print(Fore.RED + "Remote updates are disabled in your configuration")
-
-
 def __set_last_updated_time():
     with open(last_update_file, "w") as f:
         f.write(str(datetime.now()))
@@ -90,95 +49,41 @@ def __get_last_updated_time():
         return datetime.min
 
 
-def __latest_release_info():
-    with requests.get(
-        "https://api.github.com/repos/outsideopen/oo-bin-py/releases/latest"
-    ) as r:
-        r.raise_for_status()
-        response = r.json()
-
-        return response
-
-
-def __release_info(tag):
-    with requests.get(
-        "https://api.github.com/repos/outsideopen/oo-bin-py/releases"
-    ) as r:
-        r.raise_for_status()
-        response = r.json()
-        for release in response:
-            if release["tag_name"] == tag:
-                return release
-
-        return False
-
-
-def __download_package(url):
-    tmp_dir = tempfile.mkdtemp(dir=tempfile.gettempdir())
-    tmp_file = Path(tmp_dir).joinpath(Path(url).name)
-
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(tmp_file, "wb") as f:
-            for chunk in r.iter_content():
-                f.write(chunk)
-
-    return tmp_file
-
-
-def update_package(tag=""):
-    if tag == "":
-        release_info = __latest_release_info()
-        tag = release_info.get("tag_name")
-    else:
-        release_info = __release_info(tag)
-        if release_info is False:
-            print(f"No release info for {tag}")
-            sys.exit(1)
-
-    if __version__ == "0.0.0":
-        print("Updates are not supported on development versions of the project.")
-        sys.exit(1)
-
-    if tag != __version__:
-        confirm = input(
-            f"New version {tag} is available. Do you want to update now? [yN] "
-        )
-
-        if confirm in ["y", "Y"]:
-            download_url = release_info.get("assets", [{}])[0].get(
-                "browser_download_url", None
-            )
-
-            if (
-                len(list(Path(BaseDirectory.save_data_path("oo_bin")).glob("*.pkl")))
-                > 0
-            ):
-                raise OOBinError(
-                    "The application cannot be updated while tunnels are running. Please stop all tunnels and try again:\n\noo tunnels stop\noo --update"
-                )
-
-            tmp_file = __download_package(download_url)
-
-            cmd = ["pipx", "install", "--force", str(tmp_file)]
-            subprocess.run(cmd)
-
-
 def auto_update():
     config = main_config()
     update = config.get("tunnels", {}).get("update", {})
     auto_update = update.get("auto_update", False)
 
     if auto_update:
+        # A background check staged an update, apply it before running the command.
+        # requests and the release helpers are only imported when there is something to apply.
+        if (
+            sys.stdout.isatty()
+            and os.path.isdir(staged_update_path)
+            and os.listdir(staged_update_path)
+        ):
+            from oo_bin.updater import apply_staged_update
+
+            apply_staged_update()
+
         last_updated = __get_last_updated_time()
         if last_updated < datetime.today() - timedelta(days=1):
-            update_tunnels_config()
-            update_package()
             __set_last_updated_time()
 
+            # Check for updates in a detached process, so the command doesn't wait on the network
+            Popen(
+                [sys.executable, "-m", "oo_bin.updater"],
+                stdin=DEVNULL,
+                stdout=DEVNULL,
+                stderr=DEVNULL,
+                start_new_session=True,
+            )
+
 
 def port_available(port, host="127.0.0.1"):
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Like ssh, so a recently closed connection in TIME_WAIT doesn't count as using the port
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
         s.bind((host, port))
     except socket.error:
@@ -187,15 +92,6 @@ def port_available(port, host="127.0.0.1"):
     return True
 
 
-def is_autossh_running(port):
-    process1 = Popen(["ps", "-ef"], stdout=PIPE)
-    process2 = Popen(["grep", "autossh"], stdin=process1.stdout, stdout=PIPE)
-    process3 = Popen(["grep", f"{port}"], stdin=process2.stdout, stdout=PIPE)
-    output, error = process3.communicate(timeout=5)
-
-    return output
-
-
 class SkipArg(click.Group):
     """Skips arguments
 
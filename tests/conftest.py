@@ -0,0 +1,12 @@
+import pytest
+
+from oo_bin.tunnels.state_store import StateStore
+
+
+@pytest.fixture(autouse=True)
+def state_store(mocker, tmp_path):
+    """Keeps tests out of the real tunnels.db, e.g. constructing a tunnel reserves its port there"""
+    store = StateStore.__wrapped__(str(tmp_path / "tunnels.db"))
+    mocker.patch.object(StateStore, "_instance", store)
+
+    return store
@@ -1,6 +1,8 @@
 import os
+import socket
 from pathlib import Path
 
+from oo_bin.control_master import ControlMaster
 from oo_bin.ssh import Ssh
 
 
@@ -13,6 +15,9 @@ class TestSsh:
             ),
         )
         mocker.patch("os.spawnvpe", return_value=True)
+        mocker.patch(
+            "oo_bin.ssh.main_config", return_value={"ssh": {"control_persist": "no"}}
+        )
         ssh = Ssh()
 
         ssh_config_path = "/home/runner/.config/oo_bin/ssh_config"
@@ -55,3 +60,80 @@ class TestSsh:
             "2323",
             "192.168.3.1",
         ]
+
+    def test_multiplexed_connect(self, mocker, tmp_path):
+        mocker.patch(
+            "oo_bin.config.tunnels_config_path",
+            os.path.join(
+                Path(__file__).parent.parent.parent, "test_config", "tunnels.toml"
+            ),
+        )
+        mocker.patch("os.spawnvpe", return_value=True)
+        mocker.patch("oo_bin.ssh.runtime_path", return_value=str(tmp_path))
+        ssh = Ssh()
+
+        ssh_config_path = "/home/runner/.config/oo_bin/ssh_config"
+        control_path = Ssh.control_path(ssh_config_path, "foo.example.com")
+        assert control_path.startswith(os.path.join(tmp_path, "ssh-"))
+
+        def multiplex(control_path):
+            return [
+                "-o",
+                "ControlMaster=auto",
+                "-o",
+                f"ControlPath={control_path}",
+                "-o",
+                "ControlPersist=10m",
+            ]
+
+        command = ssh.connect("foo")
+        assert command == ["ssh", "-F", ssh_config_path] + multiplex(control_path) + [
+            "foo.example.com"
+        ]
+
+        command2 = ssh.connect("foo", "second_ssh")
+        host_control_path = Ssh.control_path(
+            ssh_config_path, "foo.example.com", "192.168.2.2:2222"
+        )
+        assert command2 == ["ssh", "-F", ssh_config_path] + multiplex(
+            host_control_path
+        ) + [
+            "-o",
+            f"ProxyCommand=ssh -F {ssh_config_path} -o ControlMaster=auto -o ControlPath={control_path} -o ControlPersist=10m -W %h:%p foo.example.com",
+            "-p",
+            "2222",
+            "192.168.2.2",
+        ]
+
+    def test_control_path_depends_on_the_jump_host(self, mocker, tmp_path):
+        mocker.patch("os.spawnvpe", return_value=True)
+        mocker.patch("oo_bin.ssh.runtime_path", return_value=str(tmp_path))
+        mocker.patch(
+            "oo_bin.ssh.tunnels_config",
+            side_effect=lambda profile: {"jump_host": f"{profile}.example.com"},
+        )
+        mocker.patch("oo_bin.ssh.tunnel_host", return_value=None)
+        ssh = Ssh()
+
+        def control_path(command):
+            return [x for x in command if x.startswith("ControlPath=")][0]
+
+        customer_a = ssh.connect("customer_a", "10.0.0.5")
+        customer_b = ssh.connect("customer_b", "10.0.0.5")
+        assert control_path(customer_a) != control_path(customer_b)
+
+    def test_masters_are_named_after_their_host(self, mocker, tmp_path):
+        mocker.patch("oo_bin.ssh.runtime_path", return_value=str(tmp_path))
+        mocker.patch("oo_bin.ssh.main_config", return_value={})
+        mocker.patch.object(ControlMaster, "pid", None)
+
+        # Past the length limit of unix sockets, with %r@%h:%p
+        host = "a" * 100 + ".example.com:22"
+        control_path = Ssh.control_path("ssh_config", "foo.example.com", host)
+        assert len(os.path.basename(control_path)) == 20
+
+        Ssh._Ssh__multiplex_options("ssh_config", "foo.example.com", host)
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.bind(control_path)
+
+            assert Ssh.masters() == [(f"{host} via foo.example.com", None)]
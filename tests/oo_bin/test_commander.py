@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+
+import oo_bin
+from oo_bin.commander import Commander
+from oo_bin.manifest import COMMANDS
+
+
+class TestCommander:
+    def test_manifest_covers_command_modules(self):
+        path = os.path.dirname(oo_bin.__file__)
+        modules = set(Commander().find_in_path(path).keys())
+
+        assert set(x[0] for x in COMMANDS.values()) == modules
+
+    def test_lazy_group_imports_only_invoked_command(self):
+        code = """
+import sys
+from oo_bin.main import cli
+try:
+    cli(["hexme", "--help"])
+except SystemExit:
+    pass
+print(",".join(sorted(m for m in sys.modules if m.startswith("oo_bin."))))
+"""
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        modules = output.strip().splitlines()[-1].split(",")
+
+        assert "oo_bin.hexme.command" in modules
+        assert "oo_bin.dnsme.command" not in modules
+        assert "oo_bin.tunnels.command.tunnels" not in modules
+        assert "oo_bin.cert.command" not in modules
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from oo_bin import config
+from oo_bin.config import main_config, tunnel_host, tunnels_config, tunnels_profiles
+
+
+@pytest.fixture
+def tunnels_toml(tmp_path, mocker):
+    tunnels = tmp_path / "tunnels.toml"
+    tunnels.write_text("""[foo]
+jump_host = 'foo.example.com'
+
+[foo.rdp]
+hosts = [
+	{ name = 'first_rdp', host = '192.168.1.1' },
+]
+""")
+    local = tmp_path / "tunnels_local.toml"
+    local.write_text("""[bar]
+jump_host = 'bar.example.com'
+
+[bar.ssh]
+hosts = [
+	{ name = 'first_ssh', host = '10.0.0.1', port = '2222' },
+]
+""")
+
+    mocker.patch("oo_bin.config.tunnels_config_path", str(tunnels))
+    mocker.patch("oo_bin.config.tunnels_local_config_path", str(local))
+    mocker.patch(
+        "oo_bin.config.tunnels_snapshot_path", str(tmp_path / "tunnels.snapshot")
+    )
+
+    return tunnels
+
+
+class TestConfig:
+    def test_merges_local_config(self, tunnels_toml):
+        assert list(tunnels_config().keys()) == ["foo", "bar"]
+        assert tunnels_profiles() == ["foo", "bar"]
+        assert tunnels_config(profile="bar")["jump_host"] == "bar.example.com"
+        assert tunnels_config(profile="missing") == {}
+
+    def test_host_index(self, tunnels_toml):
+        assert tunnel_host("foo", "rdp", "first_rdp")["host"] == "192.168.1.1"
+        assert tunnel_host("bar", "ssh", "first_ssh")["port"] == "2222"
+        assert tunnel_host("foo", "vnc", "first_rdp") is None
+        assert tunnel_host("foo", "rdp", None) is None
+
+    def test_parses_once_until_changed(self, tunnels_toml, mocker):
+        tunnels_config()
+        load = mocker.spy(config.tomllib, "load")
+
+        tunnels_config()
+        tunnel_host("foo", "rdp", "first_rdp")
+        assert load.call_count == 0
+
+        tunnels_toml.write_text("[baz]\njump_host = 'baz.example.com'\n")
+        assert "baz" in tunnels_config()
+        assert load.call_count == 2
+
+    def test_writes_snapshot(self, tunnels_toml):
+        tunnels_config()
+
+        assert os.path.exists(config.tunnels_snapshot_path)
+
+    def test_returns_copies(self, tunnels_toml, tmp_path, mocker):
+        main = tmp_path / "config.toml"
+        main.write_text("[tunnels]\nmode = 'lazy'\n")
+        mocker.patch("oo_bin.config.main_config_path", str(main))
+
+        main_config()["tunnels"]["mode"] = "autossh"
+        tunnels_config(profile="foo")["jump_host"] = None
+        tunnel_host("foo", "rdp", "first_rdp")["host"] = None
+
+        assert main_config()["tunnels"]["mode"] == "lazy"
+        assert tunnels_config()["foo"]["jump_host"] == "foo.example.com"
+        assert tunnel_host("foo", "rdp", "first_rdp")["host"] == "192.168.1.1"
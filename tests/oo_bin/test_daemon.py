@@ -0,0 +1,114 @@
+import os
+import socket
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+from oo_bin import __version__, client
+from oo_bin.client import recv_message, send_message
+from oo_bin.daemon import REQUEST_TIMEOUT, Daemon
+
+CLIENT = "from oo_bin.client import main; main()"
+
+
+@pytest.fixture
+def daemon_env(tmp_path):
+    # The daemon reaps idle tunnels, from the state store under XDG_DATA_HOME
+    env = dict(
+        os.environ,
+        XDG_RUNTIME_DIR=str(tmp_path),
+        XDG_DATA_HOME=str(tmp_path / "data"),
+        XDG_CACHE_HOME=str(tmp_path / "cache"),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "oo_bin.daemon"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    socket_path = tmp_path / "oo_bin" / "daemon.sock"
+    for i in range(0, 100):
+        if socket_path.exists():
+            break
+        time.sleep(0.1)
+
+    yield env
+
+    process.terminate()
+    process.wait(timeout=5)
+
+
+class TestDaemon:
+    def test_message_framing(self):
+        left, right = socket.socketpair()
+        with left, right:
+            send_message(left, {"op": "run", "env": {"X": "y" * 100000}}, [0])
+            message, fds = recv_message(right)
+
+            assert message["env"]["X"] == "y" * 100000
+            assert len(fds) == 1
+            os.close(fds[0])
+
+    def test_forwards_to_daemon(self, daemon_env):
+        output = subprocess.run(
+            [sys.executable, "-c", CLIENT, "--version"],
+            env=daemon_env,
+            capture_output=True,
+            text=True,
+        )
+        assert output.returncode == 0
+        assert __version__ in output.stdout
+
+        status = subprocess.run(
+            [sys.executable, "-c", CLIENT, "daemon", "status"],
+            env=daemon_env,
+            capture_output=True,
+            text=True,
+        )
+        assert "Requests: 1" in status.stdout
+
+    def test_exit_code(self, daemon_env):
+        output = subprocess.run(
+            [sys.executable, "-c", CLIENT, "no-such-command"],
+            env=daemon_env,
+            capture_output=True,
+            text=True,
+        )
+        assert output.returncode == 2
+        assert "No such command" in output.stderr
+
+    def test_silent_client_doesnt_block_the_daemon(self, daemon_env, tmp_path):
+        socket_path = str(tmp_path / "oo_bin" / "daemon.sock")
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent:
+            silent.connect(socket_path)
+
+            started = time.monotonic()
+            assert Daemon.ping(socket_path)["pid"]
+            assert time.monotonic() - started < REQUEST_TIMEOUT + 1
+
+    def test_runs_in_process_without_send_fds(self, mocker):
+        mocker.patch("oo_bin.client.FORWARDING", False)
+        mocker.patch.object(sys, "argv", ["oo", "--version"])
+        connect = mocker.patch("oo_bin.client.connect")
+        run = mocker.patch("oo_bin.main.main")
+
+        client.main()
+
+        connect.assert_not_called()
+        run.assert_called_once()
+
+    def test_falls_back_without_daemon(self, tmp_path):
+        output = subprocess.run(
+            [sys.executable, "-c", CLIENT, "--version"],
+            env=dict(os.environ, XDG_RUNTIME_DIR=str(tmp_path)),
+            capture_output=True,
+            text=True,
+        )
+        assert output.returncode == 0
+        assert __version__ in output.stdout
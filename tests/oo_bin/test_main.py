@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+# Cumulative import time of `oo_bin.main`, every command pays it before it runs
+IMPORT_BUDGET_MS = 100
+
+DEFERRED_MODULES = ["requests", "sentry_sdk", "oo_bin.updater"]
+
+
+def import_times(module):
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1000
+
+    return times
+
+
+class TestStartup:
+    def test_deferred_modules_are_not_imported(self):
+        times = import_times("oo_bin.main")
+
+        for module in DEFERRED_MODULES:
+            assert module not in times, f"{module} is imported at startup"
+
+    def test_import_budget(self):
+        # best of three, to keep a noisy machine from failing the build
+        cost = min(import_times("oo_bin.main")["oo_bin.main"] for _ in range(3))
+
+        assert (
+            cost < IMPORT_BUDGET_MS
+        ), f"Importing oo_bin.main took {cost:.1f}ms, the budget is {IMPORT_BUDGET_MS}ms"
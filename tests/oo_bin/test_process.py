@@ -0,0 +1,129 @@
+import os
+import socket
+import sys
+import time
+from subprocess import DEVNULL, PIPE, Popen
+
+from oo_bin.process import (
+    Forward,
+    established,
+    forwarding,
+    io_counters,
+    running,
+    ssh_process,
+    ssh_processes,
+    start_time,
+    start_times,
+    terminate,
+)
+
+
+class TestProcess:
+    def test_start_time(self):
+        assert start_time(os.getpid()) is not None
+        assert start_time(None) is None
+
+    def test_start_times_skips_dead_processes(self):
+        process = Popen(["true"])
+        process.wait()
+
+        assert start_times([os.getpid(), process.pid]) == {
+            os.getpid(): start_time(os.getpid())
+        }
+
+    def test_running(self):
+        pid = os.getpid()
+
+        assert running([(pid, start_time(pid))]) == {pid}
+        assert running([(pid, None)]) == {pid}
+        assert running([(pid, "0")]) == set()
+        assert running([(None, None)]) == set()
+
+    def test_ssh_process(self):
+        process = ssh_process(
+            1,
+            ["/usr/bin/autossh", "-N", "-M", "0", "-D", "208", "-F", "config", "jump"],
+        )
+        assert process.program == "autossh"
+        assert process.destination == "jump"
+        assert process.forwards == [Forward("D", None, 208, None, None)]
+        assert process.ssh_config == "config"
+
+        process = ssh_process(1, ["ssh", "-NL127.0.0.1:3390:[fe80::1]:3389", "jump"])
+        assert process.forwards == [Forward("L", "127.0.0.1", 3390, "fe80::1", 3389)]
+
+        assert ssh_process(1, ["bash", "-c", "ssh -D 208 jump"]) is None
+
+    def test_forwarding_matches_exact_ports(self):
+        processes = [ssh_process(1, ["autossh", "-M", "0", "-D", "2080", "jump"])]
+
+        assert forwarding(2080, processes) == processes
+        assert forwarding("2080", processes) == processes
+        assert forwarding(208, processes) == []
+
+    def test_ssh_processes(self):
+        # sh ignores the extra arguments, which look like an autossh -D forward
+        process = Popen(
+            ["autossh", "-c", "sleep 30; true", "-D", "20899"],
+            executable="/bin/sh",
+            stdout=DEVNULL,
+        )
+
+        try:
+            # Wait for the exec to replace the forked interpreter's command line
+            for _ in range(50):
+                if forwarding(20899):
+                    break
+                time.sleep(0.02)
+
+            # sh's child has the same command line, until it execs sleep
+            assert process.pid in [x.pid for x in forwarding(20899)]
+        finally:
+            process.kill()
+            process.wait()
+
+        assert process.pid not in [x.pid for x in ssh_processes()]
+
+    def test_terminate(self):
+        stubborn = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print(flush=True); time.sleep(30)"
+        processes = [
+            Popen(["sleep", "30"]),
+            Popen([sys.executable, "-c", stubborn], stdout=PIPE),
+        ]
+        # Wait for the SIGTERM handler to be installed
+        processes[1].stdout.readline()
+
+        started = time.monotonic()
+        assert terminate([(x.pid, start_time(x.pid)) for x in processes], 0.2) == set()
+        assert time.monotonic() - started < 1
+
+        assert [x.wait() for x in processes] == [-15, -9]
+
+    def test_terminate_skips_recycled_pids(self):
+        process = Popen(["sleep", "30"])
+
+        try:
+            assert terminate([(process.pid, "0")]) == set()
+            assert process.poll() is None
+        finally:
+            process.kill()
+            process.wait()
+
+    def test_established(self):
+        with socket.socket() as server:
+            server.bind(("127.0.0.1", 0))
+            server.listen()
+            port = server.getsockname()[1]
+
+            with socket.create_connection(("127.0.0.1", port)):
+                conn, _ = server.accept()
+                with conn:
+                    assert established([port, 1]) == {port: 1, 1: 0}
+
+    def test_io_counters(self):
+        read, written = io_counters(os.getpid())
+        with open(os.devnull, "wb", buffering=0) as f:
+            f.write(b"some output")
+
+        assert io_counters(os.getpid())[1] > written
+        assert io_counters(2**22 + 1) is None
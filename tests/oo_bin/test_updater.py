@@ -0,0 +1,53 @@
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+from oo_bin import updater
+from oo_bin.utils import auto_update
+
+
+@pytest.fixture
+def staging(tmp_path, mocker):
+    staged = tmp_path / "staged_update"
+    staged.mkdir()
+    config = tmp_path / "config"
+    config.mkdir()
+
+    mocker.patch("oo_bin.updater.staged_update_path", str(staged))
+    mocker.patch("oo_bin.updater.config_path", str(config))
+    mocker.patch("oo_bin.updater.update_lock_file", str(tmp_path / "update.lock"))
+    mocker.patch("oo_bin.updater.backup_tunnels_config")
+    update_pacs = mocker.patch("oo_bin.updater.__update_pacs")
+
+    return staged, config, update_pacs
+
+
+class TestUpdater:
+    def test_apply_staged_config(self, staging):
+        staged, config, update_pacs = staging
+        (staged / "tunnels.toml").write_text("[foo]\n")
+        (staged / "ssh_config").write_text("Host foo\n")
+
+        updater.apply_staged_update()
+
+        assert (config / "tunnels.toml").read_text() == "[foo]\n"
+        assert (config / "ssh_config").read_text() == "Host foo\n"
+        assert list(staged.iterdir()) == []
+        update_pacs.assert_called_once()
+
+    def test_auto_update_does_not_block(self, tmp_path, mocker):
+        last_update = tmp_path / "last_update"
+        last_update.write_text(str(datetime.now() - timedelta(days=2)))
+
+        mocker.patch("oo_bin.utils.last_update_file", str(last_update))
+        mocker.patch(
+            "oo_bin.utils.main_config",
+            return_value={"tunnels": {"update": {"auto_update": True}}},
+        )
+        popen = mocker.patch("oo_bin.utils.Popen")
+
+        auto_update()
+
+        assert popen.call_args.args[0] == [sys.executable, "-m", "oo_bin.updater"]
+        assert popen.call_args.kwargs["start_new_session"] is True
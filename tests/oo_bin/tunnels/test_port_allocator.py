@@ -0,0 +1,64 @@
+import socket
+
+import pytest
+
+from oo_bin.errors import PortUnavailableError
+from oo_bin.tunnels.port_allocator import PortAllocator
+from oo_bin.utils import port_available
+
+
+@pytest.fixture
+def port_range():
+    # Three free ports in a row
+    for _ in range(100):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        first = sock.getsockname()[1]
+        sock.close()
+
+        if first + 2 < 65536 and all(
+            port_available(x) for x in range(first, first + 3)
+        ):
+            return [first, first + 2]
+
+
+class TestPortAllocator:
+    def test_bulk_allocation(self, port_range):
+        allocator = PortAllocator(port_range)
+        keys = [("foo", "rdp", "10.0.0.1:3389"), ("foo", "rdp", "10.0.0.2:3389")]
+
+        ports = allocator.allocate(keys)
+        assert len(set(ports)) == 2
+        assert all(port_range[0] <= x <= port_range[1] for x in ports)
+
+    def test_ports_are_stable(self, port_range):
+        allocator = PortAllocator(port_range)
+        first = allocator.allocate([("foo", "rdp", "10.0.0.1:3389")])
+        allocator.allocate([("foo", "vnc", "10.0.0.1:5900")])
+
+        assert allocator.allocate([("foo", "rdp", "10.0.0.1:3389")]) == first
+
+    def test_skips_ports_in_use(self, state_store, port_range):
+        allocator = PortAllocator(port_range)
+        key = ("foo", "rdp", "10.0.0.1:3389")
+        port = allocator.allocate([key])[0]
+
+        state_store.save(
+            {"key": "bar", "name": "bar", "type": "Rdp", "port": port, "created_at": 1}
+        )
+        assert allocator.allocate([key]) != [port]
+        assert port not in allocator.allocate([("baz", "rdp", "x:1")], exclude=[])
+
+    def test_evicts_the_least_recently_used_reservation(self, port_range):
+        allocator = PortAllocator(port_range)
+        ports = allocator.allocate(
+            [("foo", "rdp", f"10.0.0.{x}:3389") for x in range(3)]
+        )
+
+        assert allocator.allocate([("bar", "rdp", "10.0.0.1:3389")]) == ports[:1]
+
+    def test_range_exhausted(self, port_range):
+        allocator = PortAllocator(port_range)
+
+        with pytest.raises(PortUnavailableError):
+            allocator.allocate([("foo", "rdp", f"10.0.0.{x}:3389") for x in range(4)])
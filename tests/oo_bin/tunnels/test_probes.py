@@ -0,0 +1,114 @@
+import socket
+import threading
+
+import pytest
+
+from oo_bin.tunnels.probes import (
+    rdp_probe,
+    socks5_connect_probe,
+    socks5_probe,
+    tcp_probe,
+    vnc_probe,
+    wait_until_closed,
+    wait_until_ready,
+)
+
+
+@pytest.fixture
+def server():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen()
+    yield sock
+    sock.close()
+
+
+def answer(sock, reply):
+    conn, _ = sock.accept()
+    with conn:
+        conn.recv(3)
+        conn.sendall(reply)
+
+
+def socks5_server(sock, reply):
+    conn, _ = sock.accept()
+    with conn:
+        conn.recv(3)
+        conn.sendall(b"\x05\x00")
+
+        request = conn.recv(4 + 1 + len("example.com") + 2)
+        conn.sendall(reply + b"\x00\x01" + bytes(6))
+        return request
+
+
+def greet(sock, greeting):
+    conn, _ = sock.accept()
+    with conn:
+        conn.sendall(greeting)
+
+
+class TestProbes:
+    def test_tcp_probe(self, server):
+        port = server.getsockname()[1]
+        assert tcp_probe("127.0.0.1", port)
+
+        server.close()
+        assert not tcp_probe("127.0.0.1", port)
+
+    @pytest.mark.parametrize("reply,ready", [(b"\x05\x00", True), (b"\x05\xff", False)])
+    def test_socks5_probe(self, server, reply, ready):
+        threading.Thread(target=answer, args=(server, reply)).start()
+
+        assert socks5_probe(*server.getsockname()) == ready
+
+    def test_wait_until_ready(self):
+        attempts = []
+
+        def probe():
+            attempts.append(1)
+            return len(attempts) == 3
+
+        assert wait_until_ready(probe, 5)[0]
+        assert len(attempts) == 3
+
+    def test_wait_until_ready_gives_up(self):
+        assert not wait_until_ready(lambda: False, 0.1)[0]
+        assert wait_until_ready(lambda: False, 5, alive=lambda: False)[1] < 1
+
+    @pytest.mark.parametrize("reply,ready", [(b"\x05\x00", True), (b"\x05\x04", False)])
+    def test_socks5_connect_probe(self, server, reply, ready):
+        threading.Thread(target=socks5_server, args=(server, reply)).start()
+
+        assert socks5_connect_probe(*server.getsockname(), "example.com", 443) == ready
+
+    @pytest.mark.parametrize(
+        "reply,ready",
+        [(b"\x03\x00\x00\x0b\x06\xd0\x00\x00\x12\x34\x00", True), (b"HTTP/1.1", False)],
+    )
+    def test_rdp_probe(self, server, reply, ready):
+        threading.Thread(target=answer, args=(server, reply)).start()
+
+        assert rdp_probe(*server.getsockname()) == ready
+
+    @pytest.mark.parametrize(
+        "greeting,ready", [(b"RFB 003.008\n", True), (b"SSH-2.0-OpenSSH\r\n", False)]
+    )
+    def test_vnc_probe(self, server, greeting, ready):
+        threading.Thread(target=greet, args=(server, greeting)).start()
+
+        assert vnc_probe(*server.getsockname()) == ready
+
+    def test_probes_time_out(self, server):
+        # Accepted by the kernel, but nobody answers
+        assert not vnc_probe(*server.getsockname(), timeout=0.1)
+
+    def test_wait_until_closed_doesnt_connect(self, server):
+        address = server.getsockname()
+        server.settimeout(0)
+
+        assert wait_until_closed([address], 0.1) == [address]
+        with pytest.raises(BlockingIOError):
+            server.accept()
+
+        server.close()
+        assert wait_until_closed([address], 1) == []
@@ -0,0 +1,93 @@
+import errno
+import os
+from shutil import ignore_patterns
+
+import pytest
+
+from oo_bin.tunnels import profile_clone
+from oo_bin.tunnels.profile_clone import ProfileCloner
+
+
+@pytest.fixture
+def parent(tmp_path):
+    parent = tmp_path / "parent"
+    (parent / "extensions").mkdir(parents=True)
+    (parent / "cache2").mkdir()
+    (parent / "prefs.js").write_text('user_pref("a", 1);')
+    (parent / "extensions" / "addon.xpi").write_bytes(b"xpi")
+    (parent / "cache2" / "entry").write_text("cached")
+    (parent / "favicons.sqlite").write_bytes(os.urandom(1000))
+
+    return parent
+
+
+def unsupported(source, destination):
+    raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+
+
+class TestProfileCloner:
+    def test_clone(self, parent, tmp_path, mocker):
+        mocker.patch.object(profile_clone, "CHUNK_SIZE", 64)
+
+        clone = tmp_path / "clone"
+        cloner = ProfileCloner(ignore=ignore_patterns("cache2"))
+        cloner.clone(parent, clone)
+
+        assert (clone / "prefs.js").read_text() == 'user_pref("a", 1);'
+        assert (clone / "extensions" / "addon.xpi").read_bytes() == b"xpi"
+        assert (clone / "favicons.sqlite").read_bytes() == (
+            parent / "favicons.sqlite"
+        ).read_bytes()
+        assert not (clone / "cache2").exists()
+        assert sum(cloner.stats.values()) == 3
+
+    def test_falls_back_to_hardlinks_and_copies(self, parent, tmp_path, mocker):
+        mocker.patch.object(profile_clone, "reflink", side_effect=unsupported)
+
+        clone = tmp_path / "clone"
+        cloner = ProfileCloner()
+        cloner.clone(parent, clone)
+
+        assert cloner.stats["hardlinked"] == 1
+        assert cloner.stats["copied"] == 3
+        assert (clone / "extensions" / "addon.xpi").stat().st_ino == (
+            parent / "extensions" / "addon.xpi"
+        ).stat().st_ino
+        assert (clone / "prefs.js").stat().st_ino != (parent / "prefs.js").stat().st_ino
+        # Only tried once
+        assert profile_clone.reflink.call_count == 1
+
+    def test_sync(self, parent, tmp_path, mocker):
+        mocker.patch.object(profile_clone, "reflink", side_effect=unsupported)
+
+        clone = tmp_path / "clone"
+        ProfileCloner().clone(parent, clone)
+
+        (parent / "prefs.js").write_text('user_pref("a", 2);')
+        os.utime(parent / "prefs.js", ns=(0, 0))
+        (parent / "extensions" / "addon.xpi").unlink()
+        (parent / "extensions" / "other.xpi").write_bytes(b"other")
+        (clone / "cookies.sqlite").write_text("the clone's own")
+
+        cloner = ProfileCloner()
+        cloner.sync(clone)
+
+        assert (clone / "prefs.js").read_text() == 'user_pref("a", 2);'
+        assert not (clone / "extensions" / "addon.xpi").exists()
+        assert (clone / "extensions" / "other.xpi").read_bytes() == b"other"
+        assert (clone / "cookies.sqlite").read_text() == "the clone's own"
+        assert cloner.stats["removed"] == 1
+        assert cloner.stats["unchanged"] == 2
+
+    def test_sync_prefers_changes_to_the_source(self, parent, tmp_path):
+        clone = tmp_path / "clone"
+        ProfileCloner().clone(parent, clone)
+        (clone / "prefs.js").unlink()
+        (clone / "prefs.js").write_text("changed in the clone")
+        (parent / "prefs.js").write_text("changed in the parent")
+        os.utime(parent / "prefs.js", ns=(0, 0))
+
+        ProfileCloner().sync(clone)
+
+        assert (clone / "prefs.js").read_text() == "changed in the parent"
+        assert (parent / "prefs.js").read_text() == "changed in the parent"
@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from oo_bin.tunnels.profile_gc import ProfileCollector
+
+OLD = time.time() - 40 * 86400
+
+
+@pytest.fixture
+def store(mocker, tmp_path, state_store):
+    for module in ["profile_pool", "profile_gc"]:
+        mocker.patch(
+            f"oo_bin.tunnels.{module}.profiles_dir", return_value=tmp_path / "profiles"
+        )
+    mocker.patch("oo_bin.tunnels.profile_gc.main_config", return_value={})
+    mocker.patch("oo_bin.tunnels.profile_pool.main_config", return_value={})
+
+    return state_store
+
+
+def make_profile(tmp_path, name, used_at=None):
+    path = tmp_path / "profiles" / name
+    (path / "cache2" / "entries").mkdir(parents=True)
+    (path / "cache2" / "entries" / "0A1B").write_bytes(b"\0" * 4096)
+
+    db = sqlite3.connect(path / "places.sqlite")
+    db.execute("CREATE TABLE moz_places (url TEXT)")
+    db.executemany("INSERT INTO moz_places VALUES (?)", [("x" * 1000,)] * 1000)
+    db.commit()
+    db.execute("DELETE FROM moz_places")
+    db.commit()
+    db.close()
+
+    (path / "prefs.js").write_text("")
+    if used_at:
+        for file in [path / "prefs.js", path]:
+            os.utime(file, (used_at, used_at))
+
+    return str(path)
+
+
+class TestProfileCollector:
+    def test_removes_unused_profiles(self, store, tmp_path):
+        unused = make_profile(tmp_path, "unused", OLD)
+        used = make_profile(tmp_path, "used", OLD)
+        recent = make_profile(tmp_path, "recent")
+        store.save(
+            {
+                "key": "foo_2080_socks",
+                "name": "foo",
+                "type": "socks",
+                "browser_profile_path": used,
+                "created_at": time.time(),
+            }
+        )
+
+        stats = ProfileCollector(dry_run=True).collect()
+        assert stats["removed"] == 1 and stats["reclaimed"] > 0
+        assert os.path.isdir(unused)
+
+        stats = ProfileCollector().collect()
+        assert (stats["removed"], stats["compacted"], stats["skipped"]) == (1, 1, 1)
+        assert not os.path.exists(unused)
+        assert os.path.isdir(used) and os.path.isdir(recent)
+
+        with store.transaction() as db:
+            paths = [x[0] for x in db.execute("SELECT path FROM browser_profiles")]
+        assert sorted(paths) == sorted([used, recent])
+
+    def test_compacts_profiles(self, store, tmp_path):
+        path = make_profile(tmp_path, "recent")
+        size = os.path.getsize(os.path.join(path, "places.sqlite"))
+
+        stats = ProfileCollector().collect()
+        assert stats["vacuumed"] == 1
+        assert stats["reclaimed"] >= 4096 + size // 2
+        assert not os.path.exists(os.path.join(path, "cache2"))
+        assert os.path.getsize(os.path.join(path, "places.sqlite")) < size // 2
+
+    def test_budget_resumes_where_it_stopped(self, store, tmp_path, mocker):
+        paths = [make_profile(tmp_path, x) for x in ["first", "second", "third"]]
+        collect = mocker.spy(ProfileCollector, "_ProfileCollector__collect")
+
+        for _ in range(4):
+            ProfileCollector().collect(budget=1e-9)
+
+        assert [x.args[1] for x in collect.call_args_list] == [
+            paths[0],
+            paths[1],
+            paths[2],
+            paths[0],
+        ]
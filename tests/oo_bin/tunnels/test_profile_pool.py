@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+
+from oo_bin.errors import BrowserProfileUnavailableError
+from oo_bin.tunnels.browser_profile import BrowserProfile
+from oo_bin.tunnels.profile_pool import ACQUIRE_GRACE, ProfilePool
+
+
+@pytest.fixture
+def store(mocker, tmp_path, state_store):
+    mocker.patch(
+        "oo_bin.tunnels.profile_pool.profiles_dir", return_value=tmp_path / "profiles"
+    )
+    mocker.patch("oo_bin.tunnels.profile_pool.runtime_path", return_value=str(tmp_path))
+    mocker.patch(
+        "oo_bin.tunnels.profile_pool.main_config",
+        return_value={"tunnels": {"socks": {"pool_size": 2}}},
+    )
+    mocker.patch.object(ProfilePool, "replenish_in_background")
+
+    return state_store
+
+
+def make_profiles(tmp_path, *names):
+    paths = []
+    for name in names:
+        path = tmp_path / "profiles" / name
+        path.mkdir(parents=True)
+        paths.append(str(path))
+
+    return paths
+
+
+class TestProfilePool:
+    def test_acquire_indexes_existing_profiles(self, store, tmp_path):
+        used, first, second = make_profiles(tmp_path, "used", "first", "second")
+        store.save(
+            {
+                "key": "foo_2080_socks",
+                "name": "foo",
+                "type": "socks",
+                "browser_profile_path": used,
+                "created_at": time.time(),
+            }
+        )
+
+        pool = ProfilePool()
+        taken = {pool.acquire()[1], pool.acquire()[1]}
+        assert taken == {first, second}
+        assert pool.ready() == 0
+
+        pool.release(first)
+        assert pool.acquire() == ("first", first)
+        pool.replenish_in_background.assert_called()
+
+    def test_acquire_skips_removed_profiles(self, store, tmp_path):
+        removed, kept = make_profiles(tmp_path, "removed", "kept")
+        pool = ProfilePool()
+        pool.add(removed)
+        pool.add(kept)
+        os.rmdir(removed)
+
+        assert pool.acquire() == ("kept", kept)
+        assert pool.ready() == 0
+
+    def test_reclaims_profiles_of_dead_tunnels(self, store, tmp_path):
+        (path,) = make_profiles(tmp_path, "stale")
+        pool = ProfilePool()
+        pool.add(path)
+        assert pool.acquire()[1] == path
+
+        with store.transaction() as db:
+            db.execute(
+                "UPDATE browser_profiles SET acquired_at = ?",
+                (time.time() - ACQUIRE_GRACE - 1,),
+            )
+
+        assert pool.acquire()[1] == path
+
+    def test_replenish_creates_profiles_with_the_proxy(self, store, tmp_path):
+        pool = ProfilePool()
+        assert pool.replenish() == 2
+        assert pool.ready() == 2
+        assert pool.replenish() == 0
+
+        for path in (tmp_path / "profiles").glob("pool-*"):
+            with open(path / "user.js") as f:
+                assert 'user_pref("network.proxy.socks_port", 2080);' in f.read()
+
+    def test_create_checks_the_parent_profile(self, store, mocker):
+        mocker.patch.object(BrowserProfile, "firefox_profile_path", return_value=None)
+        pool = ProfilePool()
+        pool.parent = "Missing"
+
+        with pytest.raises(BrowserProfileUnavailableError, match="Missing"):
+            pool.create()
@@ -0,0 +1,87 @@
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from oo_bin.tunnels import Rdp, TunnelManager
+from oo_bin.tunnels.reaper import Reaper
+
+
+@pytest.fixture
+def manager(mocker, tmp_path):
+    test_config = os.path.join(Path(__file__).parent.parent.parent, "test_config")
+    mocker.patch(
+        "oo_bin.config.main_config_path", os.path.join(test_config, "config.toml")
+    )
+    mocker.patch(
+        "oo_bin.config.tunnels_config_path", os.path.join(test_config, "tunnels.toml")
+    )
+    mocker.patch(
+        "oo_bin.tunnels.reaper.main_config",
+        return_value={"tunnels": {"idle_ttl": 60}},
+    )
+    mocker.patch("oo_bin.tunnels.reaper.log_file", str(tmp_path / "reaper.log"))
+
+    mocker.patch("oo_bin.tunnels.tunnel_manager.running", return_value={os.getpid()})
+
+    return TunnelManager.__wrapped__(tmp_path)
+
+
+def add(manager, host, created_at, mode="autossh"):
+    tunnel = Rdp("foo", host)
+    tunnel.pid = os.getpid()
+    tunnel._created_at = created_at
+    tunnel._mode = mode
+    tunnel.save()
+    manager.add(tunnel)
+
+    return tunnel
+
+
+class TestReaper:
+    def test_reaps_idle_tunnels(self, manager, mocker, tmp_path):
+        idle = add(manager, "first_rdp", time.time() - 120)
+        used = add(manager, "second_rdp", time.time() - 120)
+        add(manager, "192.168.1.3", time.time())
+        add(manager, "192.168.1.4", time.time() - 120, mode="lazy")
+
+        # The local port stands in for the pid of each tunnel's ssh
+        counters = {int(x.local_port): (4096, 4096) for x in manager.tunnels()}
+        mocker.patch.object(
+            Rdp, "_ssh_pid", autospec=True, side_effect=lambda x, _: int(x.local_port)
+        )
+        mocker.patch("oo_bin.tunnels.reaper.ssh_processes", return_value=[])
+        mocker.patch("oo_bin.tunnels.reaper.io_counters", side_effect=counters.get)
+        mocker.patch("oo_bin.tunnels.tunnel_manager.terminate", return_value=set())
+
+        reaper = Reaper(manager)
+        assert reaper.idle() == []
+
+        # An open connection without traffic doesn't count
+        counters[int(used.local_port)] = (4096 + 2**20, 4096)
+
+        assert [x.name for x, _ in reaper.reap(dry_run=True)] == ["foo"]
+        assert len(manager.tunnels()) == 4
+
+        reaped = reaper.reap()
+        assert [x._state_key for x, _ in reaped] == [idle._state_key]
+        assert idle._state_key not in [x._state_key for x in manager.tunnels()]
+
+        manager.reload()
+        active_at = [
+            x._active_at
+            for x in manager.tunnels()
+            if int(x.local_port) == int(used.local_port)
+        ]
+        assert active_at[0] > time.time() - 5
+        assert (
+            "foo (Rdp on port 60001), idle for 120s"
+            in (tmp_path / "reaper.log").read_text()
+        )
+
+    def test_profile_ttl_overrides_global(self, manager, mocker):
+        tunnel = add(manager, "first_rdp", time.time() - 120)
+        tunnel._config = {"idle_ttl": 0}
+
+        assert Reaper.ttl(tunnel) is None
@@ -0,0 +1,67 @@
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from oo_bin.tunnels.routing import RouteTable, pac
+
+ROUTES = {
+    "app.example.com": "SOCKS5 127.0.0.1:2081",
+    "*.corp.example.com": "SOCKS5 127.0.0.1:2082",
+    "10.0.0.0/8": "SOCKS5 127.0.0.1:2083",
+    "10.1.0.0/16": "SOCKS5 127.0.0.1:2084",
+    "192.168.1.10": "SOCKS5 127.0.0.1:2085",
+}
+
+HOSTS = {
+    "app.example.com": "SOCKS5 127.0.0.1:2081",
+    "APP.example.com.": "SOCKS5 127.0.0.1:2081",
+    "www.example.com": "DIRECT",
+    "corp.example.com": "SOCKS5 127.0.0.1:2082",
+    "git.eu.corp.example.com": "SOCKS5 127.0.0.1:2082",
+    "example.com": "DIRECT",
+    "constructor": "DIRECT",
+    "10.200.0.1": "SOCKS5 127.0.0.1:2083",
+    "10.1.2.3": "SOCKS5 127.0.0.1:2084",
+    "192.168.1.10": "SOCKS5 127.0.0.1:2085",
+    "192.168.1.11": "DIRECT",
+}
+
+IPV6_ROUTES = {
+    "fd00::/8": "SOCKS5 127.0.0.1:2086",
+    "2001:db8::1": "SOCKS5 127.0.0.1:2087",
+}
+
+IPV6_HOSTS = {
+    "fd12:3456::1": "SOCKS5 127.0.0.1:2086",
+    "[FD00::]": "SOCKS5 127.0.0.1:2086",
+    "2001:db8:0:0:0:0:0:1": "SOCKS5 127.0.0.1:2087",
+    "2001:db8::2": "DIRECT",
+    "fe80::1%eth0": "DIRECT",
+    "::1": "DIRECT",
+}
+
+
+class TestRouting:
+    def test_route_table(self):
+        table = RouteTable(ROUTES)
+        table.add("fd00::/8", "SOCKS5 127.0.0.1:2086")
+
+        assert table.size == 6
+        for host, proxy in HOSTS.items():
+            assert (table.lookup(host) or "DIRECT") == proxy, host
+        assert table.lookup("[fd00::1]") == "SOCKS5 127.0.0.1:2086"
+
+    @pytest.mark.skipif(not shutil.which("node"), reason="node is not installed")
+    def test_pac(self):
+        hosts = {**HOSTS, **IPV6_HOSTS}
+        script = (
+            pac({**ROUTES, **IPV6_ROUTES})
+            + f"for (var host of {json.dumps(list(hosts))}) console.log(FindProxyForURL('', host));"
+        )
+        output = subprocess.run(
+            ["node", "-e", script], capture_output=True, text=True, check=True
+        ).stdout
+
+        assert output.splitlines() == list(hosts.values())
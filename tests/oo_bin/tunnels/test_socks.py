@@ -1,9 +1,13 @@
 import os
+import threading
+import time
 from pathlib import Path
 
 import pytest
 
+from oo_bin.errors import InvalidProfileError
 from oo_bin.tunnels import Socks
+from oo_bin.tunnels.browser_profile import BrowserProfile
 
 
 class TestSocks:
@@ -38,3 +42,113 @@ class TestSocks:
             "/my/ssh/config/path",
             "foo.example.com",
         ]
+
+    @pytest.mark.parametrize(
+        "target, expected",
+        [
+            ("intranet.example.com:8443", ("intranet.example.com", 8443)),
+            ("intranet.example.com", ("intranet.example.com", 443)),
+            ("[fd00::1]:8443", ("fd00::1", 8443)),
+            ("[fd00::1]", ("fd00::1", 443)),
+        ],
+    )
+    def test_probe_target(self, mocker, target, expected):
+        mocker.patch("oo_bin.tunnels.socks.main_config", return_value={})
+        probe = mocker.patch("oo_bin.tunnels.socks.socks5_connect_probe")
+        socks = Socks.__new__(Socks)
+        socks._config = {"probe_target": target}
+        socks._Socks__forward_port = 2080
+
+        socks._health_probe(2)
+        assert probe.call_args.args[2:] == expected
+
+    @pytest.mark.parametrize(
+        "target", ["intranet.example.com:https", "fd00::1", ":443"]
+    )
+    def test_invalid_probe_target(self, mocker, target):
+        mocker.patch("oo_bin.tunnels.socks.main_config", return_value={})
+        socks = Socks.__new__(Socks)
+        socks._config = {"probe_target": target}
+        socks._Tunnel__name = "foo"
+
+        with pytest.raises(InvalidProfileError, match="foo profile"):
+            socks._health_probe(2)
+
+    def test_shared_browser_waits_for_its_routes(self, mocker, tmp_path, state_store):
+        mocker.patch(
+            "oo_bin.tunnels.socks.main_config",
+            return_value={"tunnels": {"socks": {"shared_browser": True}}},
+        )
+        mocker.patch(
+            "oo_bin.tunnels.tunnel.tunnels_config",
+            return_value={
+                "jump_host": "foo.example.com",
+                "urls": ["https://app.example.com"],
+            },
+        )
+        mocker.patch.object(Socks, "shared_profile_path", return_value=str(tmp_path))
+        mocker.patch.object(Socks, "_Socks__browser_bin", "firefox")
+        popen = mocker.patch("oo_bin.tunnels.socks.Popen")
+
+        socks = Socks("foo")
+        socks._cache_file = str(tmp_path / "foo.log")
+        socks.save()
+
+        # Like the supervisor, once its router picked the tunnel up
+        routed_at = time.time() + 0.3
+        threading.Timer(
+            0.3, state_store.update, [socks._state_key, {"routed_at": routed_at}]
+        ).start()
+        socks.launch()
+
+        assert popen.call_count == 1
+        assert time.time() >= routed_at
+
+    def test_single_profile_proxy(self, mocker, tmp_path):
+        config = {"tunnels": {"socks": {}}}
+        mocker.patch("oo_bin.tunnels.socks.main_config", return_value=config)
+        hosts = ["*.corp.example.com"]
+        mocker.patch(
+            "oo_bin.tunnels.tunnel.tunnels_config",
+            side_effect=lambda profile: {
+                "jump_host": "foo.example.com",
+                "urls": ["https://app.example.com"],
+                "hosts": hosts,
+            },
+        )
+        mocker.patch.object(
+            BrowserProfile, "firefox_profile_path", return_value=str(tmp_path)
+        )
+        mocker.patch.object(Socks, "_Socks__browser_bin", "firefox")
+        mocker.patch("oo_bin.tunnels.socks.Popen").return_value.pid = os.getpid()
+
+        def launch():
+            socks = Socks("foo")
+            socks.browser_profile_name = "Tunnels"
+            socks._cache_file = str(tmp_path / "foo.log")
+            socks.launch()
+
+            return socks
+
+        # The user's own proxy settings
+        (tmp_path / "user.js").write_text("custom")
+        launch()
+        assert (tmp_path / "user.js").read_text() == "custom"
+
+        config["tunnels"]["socks"]["split_routing"] = True
+        socks = launch()
+        assert "autoconfig_url" in (tmp_path / "user.js").read_text()
+
+        # The tunnels configuration was updated while the browser runs
+        hosts.append("*.example.org")
+        socks.update_pac()
+        assert '"org"' in (tmp_path / "proxy.pac").read_text()
+
+        config["tunnels"]["socks"]["split_routing"] = False
+        launch()
+        assert "socks_port" in (tmp_path / "user.js").read_text()
+        assert not (tmp_path / "proxy.pac").exists()
+
+        (tmp_path / "user.js").write_text("custom")
+        launch()
+        assert (tmp_path / "user.js").read_text() == "custom"
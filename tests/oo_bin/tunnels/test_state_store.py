@@ -0,0 +1,66 @@
+import os
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from oo_bin.tunnels import Rdp, Socks
+from oo_bin.tunnels.state_store import MIGRATIONS, StateStore
+
+
+@pytest.fixture
+def config(mocker):
+    mocker.patch(
+        "oo_bin.config.main_config_path",
+        os.path.join(Path(__file__).parent.parent.parent, "test_config", "config.toml"),
+    )
+    mocker.patch(
+        "oo_bin.config.tunnels_config_path",
+        os.path.join(
+            Path(__file__).parent.parent.parent, "test_config", "tunnels.toml"
+        ),
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StateStore.__wrapped__(str(tmp_path / "tunnels.db"))
+
+
+class TestStateStore:
+    def test_schema_version(self, store):
+        db = sqlite3.connect(store.path)
+        assert db.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+
+    def test_save_and_delete(self, store):
+        store.save({"key": "foo", "name": "foo", "type": "Socks", "created_at": 1})
+        store.save(
+            {"key": "foo", "name": "foo", "type": "Socks", "pid": 42, "created_at": 1}
+        )
+
+        assert store.tunnel("foo")["pid"] == 42
+        assert [x["key"] for x in store.tunnels()] == ["foo"]
+
+        store.delete("foo")
+        assert store.tunnel("foo") is None
+
+    def test_restore_rdp(self, config, store):
+        rdp = Rdp("foo", "first_rdp")
+        rdp.pid = 1234
+        store.save(rdp._state())
+
+        restored = Rdp.restore(store.tunnel("foo_60001_rdp"))
+
+        assert restored.pid == 1234
+        assert restored.jump_host == "foo.example.com"
+        assert restored._cmd == rdp._cmd
+
+    def test_restore_socks(self, config, store):
+        socks = Socks("foo")
+        socks.browser_profile_name = "Tunnels"
+        store.save(socks._state())
+
+        restored = Socks.restore(store.tunnel("foo_2080_socks"))
+
+        assert restored.browser_profile_name == "Tunnels"
+        assert restored._cmd == socks._cmd
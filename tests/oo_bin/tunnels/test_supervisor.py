@@ -0,0 +1,321 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from oo_bin.tunnels import Rdp, TunnelManager
+from oo_bin.tunnels.probes import tcp_probe
+from oo_bin.tunnels.state_store import StateStore
+from oo_bin.tunnels.supervisor import SOCKS5_REPLY, Router, Supervisor, free_port
+from oo_bin.tunnels.tunnel import IDLE
+from oo_bin.utils import port_available
+
+# Forwards the -L port until it has been up for a second the first time it runs, like a dropped connection
+FAKE_SSH = """#!{python}
+import os, socket, sys, time
+
+port = int(sys.argv[sys.argv.index("-L") + 1].split(":")[0])
+sock = socket.socket()
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.bind(("127.0.0.1", port))
+sock.listen()
+sock.settimeout(0.1)
+
+marker = os.path.join(os.path.dirname(__file__), "dropped")
+deadline = None if os.path.exists(marker) else time.monotonic() + 1
+open(marker, "w").close()
+
+while deadline is None or time.monotonic() < deadline:
+    try:
+        sock.accept()[0].close()
+    except socket.timeout:
+        pass
+sys.exit(255)
+"""
+
+# Forwards the -L port to an echo server
+ECHO_SSH = """#!{python}
+import socket, sys
+
+port = int(sys.argv[sys.argv.index("-L") + 1].split(":")[0])
+sock = socket.socket()
+sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+sock.bind(("127.0.0.1", port))
+sock.listen()
+
+while True:
+    conn = sock.accept()[0]
+    data = conn.recv(1024)
+    if data:
+        conn.sendall(data)
+    conn.close()
+"""
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.1)
+
+    return False
+
+
+@pytest.fixture
+def env(tmp_path):
+    test_config = Path(__file__).parent.parent.parent / "test_config"
+    config = tmp_path / "config" / "oo_bin"
+    config.mkdir(parents=True)
+    shutil.copy(test_config / "tunnels.toml", config / "tunnels.toml")
+    (config / "config.toml").write_text(
+        '[tunnels]\nmode = "supervisor"\nssh_config = "/dev/null"\nidle_timeout = 1\n'
+    )
+
+    bin = tmp_path / "bin"
+    bin.mkdir()
+    (bin / "ssh").write_text(FAKE_SSH.format(python=sys.executable))
+    (bin / "ssh").chmod(0o755)
+
+    return dict(
+        os.environ,
+        PATH=f"{bin}:{os.environ['PATH']}",
+        XDG_CONFIG_HOME=str(tmp_path / "config"),
+        XDG_DATA_HOME=str(tmp_path / "data"),
+        XDG_CACHE_HOME=str(tmp_path / "cache"),
+        XDG_RUNTIME_DIR=str(tmp_path / "runtime"),
+    )
+
+
+def start_supervisor(env, tmp_path):
+    supervisor = subprocess.Popen(
+        [sys.executable, "-m", "oo_bin.tunnels.supervisor"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    lock = tmp_path / "runtime" / "oo_bin" / "supervisor.lock"
+    assert wait_for(lambda: lock.exists() and lock.read_text())
+
+    return supervisor
+
+
+def save_tunnel(store, supervisor, mode):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    key = f"foo_{port}_rdp"
+    store.save(
+        {
+            "key": key,
+            "name": "foo",
+            "type": "Rdp",
+            "pid": supervisor.pid,
+            "mode": mode,
+            "port": port,
+            "host": "192.168.1.1",
+            "remote_port": "3389",
+            "jump_host": "foo.example.com",
+            "created_at": time.time(),
+        }
+    )
+
+    return key, port
+
+
+def routed(port, *routes):
+    return SimpleNamespace(routes=list(routes), _listen_address=("127.0.0.1", port))
+
+
+async def socks_request(port, address, target_port):
+    """Connects through the SOCKS5 proxy on port, then sends hello, returns the reply"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"\x05\x01\x00")
+    assert await reader.readexactly(2) == b"\x05\x00"
+
+    writer.write(b"\x05\x01\x00" + address + target_port.to_bytes(2, "big"))
+    assert await reader.readexactly(10) == SOCKS5_REPLY[0]
+
+    writer.write(b"hello")
+    reply = await reader.read(1024)
+    writer.close()
+
+    return reply
+
+
+class TestSupervisor:
+    def test_reconnects(self, env, tmp_path):
+        supervisor = start_supervisor(env, tmp_path)
+        store = StateStore.__wrapped__(str(tmp_path / "data" / "oo_bin" / "tunnels.db"))
+        key, port = save_tunnel(store, supervisor, "supervisor")
+
+        try:
+            assert wait_for(lambda: tcp_probe("127.0.0.1", port))
+            assert wait_for(lambda: store.tunnel(key)["reconnects"] == 1)
+            assert store.tunnel(key)["downtime"] > 0
+            assert tcp_probe("127.0.0.1", port)
+
+            store.delete(key)
+            assert wait_for(lambda: not tcp_probe("127.0.0.1", port))
+        finally:
+            supervisor.terminate()
+            supervisor.wait(timeout=5)
+
+    def test_lazy_tunnel_connects_on_first_use(self, env, tmp_path, mocker):
+        (tmp_path / "bin" / "ssh").write_text(ECHO_SSH.format(python=sys.executable))
+        supervisor = start_supervisor(env, tmp_path)
+        store = StateStore.__wrapped__(str(tmp_path / "data" / "oo_bin" / "tunnels.db"))
+        key, port = save_tunnel(store, supervisor, "lazy")
+
+        try:
+            assert wait_for(lambda: not port_available(port))
+            assert store.tunnel(key)["ssh_pid"] is None
+
+            # Probing it would connect it
+            mocker.patch.object(StateStore, "_instance", store)
+            tunnel = Rdp.restore(store.tunnel(key))
+            assert tunnel.health() == IDLE
+            assert TunnelManager.__wrapped__(tmp_path).probe([tunnel]) == {tunnel: IDLE}
+            time.sleep(0.5)
+            assert store.tunnel(key)["ssh_pid"] is None
+
+            with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+                sock.sendall(b"hello")
+                assert sock.recv(1024) == b"hello"
+            assert store.tunnel(key)["ssh_pid"]
+
+            # Stopped after idle_timeout without clients, health probes go around the listener
+            def probed_idle():
+                tunnel.health(timeout=0.1)
+                return store.tunnel(key)["ssh_pid"] is None
+
+            assert wait_for(probed_idle)
+
+            store.delete(key)
+            assert wait_for(lambda: port_available(port))
+        finally:
+            supervisor.terminate()
+            supervisor.wait(timeout=5)
+
+    def test_router_routes_by_host(self):
+        router = Router()
+        router.update(
+            [
+                routed(1, "app.example.com", "*.corp.example.com"),
+                routed(2, ".example.com", "10.0.0.0/8"),
+            ]
+        )
+
+        assert router.routes == 4
+        assert router.route("10.1.2.3") == ("127.0.0.1", 2)
+        assert router.route("APP.example.com.") == ("127.0.0.1", 1)
+        assert router.route("corp.example.com") == ("127.0.0.1", 1)
+        assert router.route("git.corp.example.com") == ("127.0.0.1", 1)
+        assert router.route("www.example.com") == ("127.0.0.1", 2)
+        assert router.route("example.org") is None
+
+        # The tunnel opened last wins a shared route
+        router.update([routed(1, "app.example.com"), routed(2, "app.example.com")])
+        assert router.route("app.example.com") == ("127.0.0.1", 2)
+
+    def test_router_routes_running_tunnels_and_retries(
+        self, mocker, tmp_path, state_store
+    ):
+        test_config = Path(__file__).parent.parent.parent / "test_config"
+        mocker.patch("oo_bin.config.main_config_path", test_config / "config.toml")
+        mocker.patch("oo_bin.config.tunnels_config_path", test_config / "tunnels.toml")
+        store = state_store
+        # Returns right away, like a router that can't listen
+        serve = mocker.patch.object(Router, "serve")
+
+        dead = subprocess.Popen(["true"])
+        dead.wait()
+        for port, pid, route in [
+            (2080, os.getppid(), "a.com"),
+            (2081, dead.pid, "b.com"),
+        ]:
+            store.save(
+                {
+                    "key": f"foo_{port}_socks",
+                    "name": "foo",
+                    "type": "Socks",
+                    "pid": pid,
+                    "port": port,
+                    "routes": json.dumps([route]),
+                    "created_at": time.time(),
+                }
+            )
+
+        async def run():
+            supervisor = Supervisor()
+            router = supervisor._Supervisor__router
+            for _ in range(2):
+                supervisor._Supervisor__sync()
+                await asyncio.sleep(0.01)
+
+            return supervisor, router
+
+        supervisor, router = asyncio.run(run())
+        assert router.routes == 1
+        assert router.route("a.com") == ("127.0.0.1", 2080)
+        assert router.route("b.com") is None
+        assert serve.call_count == 2
+
+        # The shared browser launches once the router listens with the route of its tunnel
+        assert store.tunnel("foo_2080_socks")["routed_at"] is None
+        router.listening = True
+        supervisor._Supervisor__report_routes()
+        assert store.tunnel("foo_2080_socks")["routed_at"]
+        assert store.tunnel("foo_2081_socks")["routed_at"] is None
+
+    def test_router_relays_through_the_tunnel(self):
+        async def forward(reader, writer):
+            # A SOCKS5 forward of ssh
+            await reader.readexactly(3)
+            writer.write(b"\x05\x00")
+            request = await reader.readexactly(5)
+            await reader.readexactly(request[4] + 2)
+            writer.write(SOCKS5_REPLY[0])
+            writer.write(b"tunnel " + await reader.read(1024))
+            writer.close()
+
+        async def echo(reader, writer):
+            writer.write(b"direct " + await reader.read(1024))
+            writer.close()
+
+        async def run():
+            tunnel = await asyncio.start_server(forward, "127.0.0.1", 0)
+            direct = await asyncio.start_server(echo, "127.0.0.1", 0)
+            router = Router()
+            router.update([routed(tunnel.sockets[0].getsockname()[1], "*.example.com")])
+
+            port = free_port("127.0.0.1")
+            serve = asyncio.ensure_future(router.serve("127.0.0.1", port))
+            await asyncio.sleep(0.1)
+
+            try:
+                name = b"app.example.com"
+                return [
+                    await socks_request(port, b"\x03" + bytes([len(name)]) + name, 443),
+                    await socks_request(
+                        port,
+                        b"\x01" + socket.inet_aton("127.0.0.1"),
+                        direct.sockets[0].getsockname()[1],
+                    ),
+                ]
+            finally:
+                serve.cancel()
+                tunnel.close()
+                direct.close()
+
+        assert asyncio.run(run()) == [b"tunnel hello", b"direct hello"]
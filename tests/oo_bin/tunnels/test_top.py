@@ -0,0 +1,65 @@
+from oo_bin.tunnels.top import Top
+
+
+class FakeManager:
+    def __init__(self, tunnels):
+        self.tunnels_ = tunnels
+
+    def reload(self):
+        pass
+
+    def tunnels(self):
+        return self.tunnels_
+
+    def probe(self, tunnels, timeout=2):
+        return {x: 0.01 for x in tunnels}
+
+
+class TestTop:
+    def test_sample(self, mocker):
+        tunnel = mocker.Mock(
+            _state_key="foo_2080_socks",
+            _listen_address=("127.0.0.1", "2080"),
+            _control_path=None,
+            _mode="autossh",
+            reconnects=0,
+        )
+        mocker.patch("oo_bin.tunnels.top.StateStore")
+        mocker.patch("oo_bin.tunnels.top.established", return_value={2080: 3})
+        ssh_pid = mocker.patch.object(Top, "_Top__ssh_pid", return_value=100)
+        mocker.patch("oo_bin.tunnels.top.ssh_processes", return_value=[])
+        mocker.patch("oo_bin.tunnels.top.io_counters", side_effect=[(0, 0), (2048, 0)])
+
+        top = Top(FakeManager([tunnel]))
+        first = top.sample()[0]
+        ssh_pid.return_value = 101
+        second = top.sample()[0]
+
+        assert first["connections"] == 3
+        assert first["read"] is None
+        assert second["rtt_avg"] == 0.01
+        # autossh restarted ssh, so the counters started over
+        assert second["reconnects"] == 1
+        assert second["read"] is None
+
+    def test_print_table_marks_shared_traffic(self, mocker, capsys):
+        tunnel = mocker.Mock(_mode="multiplex")
+        tunnel.name = "foo"
+        row = {
+            "tunnel": tunnel,
+            "port": 2080,
+            "connections": 1,
+            "read": 2048,
+            "written": 0,
+            "shared": True,
+            "rtt": 0.01,
+            "rtt_avg": 0.01,
+            "reconnects": 0,
+        }
+
+        Top(FakeManager([tunnel])).print_table([row])
+
+        out = capsys.readouterr().out
+        assert "ssh Read" in out
+        assert "2 KB/s*" in out
+        assert "* The ssh master of multiplexed tunnels" in out
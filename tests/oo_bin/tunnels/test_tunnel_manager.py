@@ -0,0 +1,241 @@
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from oo_bin.control_master import ControlMaster
+from oo_bin.errors import (
+    InvalidProfileError,
+    ProcessFailedError,
+    TunnelTimeoutError,
+)
+from oo_bin.process import ssh_process
+from oo_bin.tunnels import Rdp, Socks, TunnelManager
+from oo_bin.tunnels.port_allocator import PortAllocator
+from oo_bin.tunnels.tunnel_manager import UP_WORKERS
+
+
+@pytest.fixture
+def manager(mocker, tmp_path):
+    test_config = os.path.join(Path(__file__).parent.parent.parent, "test_config")
+    mocker.patch(
+        "oo_bin.config.main_config_path", os.path.join(test_config, "config.toml")
+    )
+    mocker.patch(
+        "oo_bin.config.tunnels_config_path", os.path.join(test_config, "tunnels.toml")
+    )
+
+    mocker.patch("oo_bin.tunnels.tunnel_manager.ssh_processes", return_value=[])
+    mocker.patch.object(Rdp, "runtime_dependencies_met")
+
+    return TunnelManager.__wrapped__(tmp_path)
+
+
+class TestTunnelManager:
+    def test_up(self, manager, mocker):
+        def open(tunnel, tick=None):
+            if tunnel.host == "192.168.1.2":
+                raise ProcessFailedError("autossh failed")
+            return 0.5
+
+        mocker.patch.object(Rdp, "open", autospec=True, side_effect=open)
+
+        first = Rdp("foo", "first_rdp")
+        second = Rdp("foo", "second_rdp")
+        results = manager.up([first, second], launch=False)
+
+        assert results[0] == (first, 0.5)
+        assert isinstance(results[1][1], ProcessFailedError)
+        assert manager.tunnels() == [first]
+
+    def test_imports_legacy_pickles(self, manager, tmp_path):
+        def legacy(cls, **fields):
+            # Only the attributes the release before the state store pickled
+            tunnel = cls.__new__(cls)
+            tunnel.__dict__.update(
+                {
+                    "_Tunnel__name": "foo",
+                    "_Tunnel__pid": os.getpid(),
+                    "_Tunnel__jump_host": None,
+                    "_config": {},
+                    "_cache_file": str(tmp_path / "tunnels.log"),
+                    "_autossh_bin": "autossh",
+                    "_ssh_config": "ssh_config",
+                    **{f"_{cls.__name__}__{k}": v for k, v in fields.items()},
+                }
+            )
+            return tunnel
+
+        tunnels = {
+            "foo_2080_socks": legacy(
+                Socks,
+                forward_port="2080",
+                browser_profile_name="foo",
+                browser_profile_path=None,
+                browser_pid=None,
+            ),
+            "foo_60001_rdp": legacy(
+                Rdp, host="192.168.1.1", port="3389", local_port="60001", rdp_pid=None
+            ),
+        }
+        for key, tunnel in tunnels.items():
+            with open(tmp_path / f"{key}.pkl", "wb") as f:
+                pickle.dump(tunnel, f)
+
+        manager.reload()
+
+        rdp, socks = sorted(manager.tunnels(), key=lambda x: type(x).__name__)
+        assert (socks.forward_port, socks.routes, socks.reconnects) == (2080, None, 0)
+        assert (rdp.host, rdp.local_port, rdp._mode) == (
+            "192.168.1.1",
+            60001,
+            "autossh",
+        )
+        assert sorted(x._state_key for x in manager.tunnels()) == sorted(tunnels)
+        assert not list(tmp_path.glob("*.pkl"))
+
+    def test_orphans_are_the_autossh_processes_of_oo(self, manager, mocker):
+        (port,) = PortAllocator().allocate([("foo", "rdp", "first_rdp")])
+        processes = [
+            ssh_process(1, ["autossh", "-M", "0", "-F", "/my/ssh/config/path", "jump"]),
+            ssh_process(2, ["autossh", "-M", "0", "-L", f"{port}:host:3389", "jump"]),
+            ssh_process(3, ["autossh", "-M", "0", "-L", "3390:host:3389", "jump"]),
+            ssh_process(4, ["ssh", "-F", "/my/ssh/config/path", "jump"]),
+        ]
+        mocker.patch(
+            "oo_bin.tunnels.tunnel_manager.ssh_processes", return_value=processes
+        )
+
+        assert [x.pid for x in manager.orphans()] == [1, 2]
+
+    def test_up_limits_concurrent_connections(self, manager, mocker):
+        lock = threading.Lock()
+        connecting = []
+        most = []
+
+        def open(tunnel, tick=None):
+            with lock:
+                connecting.append(tunnel)
+                most.append(len(connecting))
+            time.sleep(0.05)
+            with lock:
+                connecting.remove(tunnel)
+            return 0.05
+
+        mocker.patch.object(Rdp, "open", autospec=True, side_effect=open)
+
+        tunnels = [Rdp("foo", f"10.0.0.{x}") for x in range(12)]
+        manager.up(tunnels, launch=False)
+
+        assert max(most) == UP_WORKERS
+
+    def test_up_allocates_free_ports(self, manager, mocker):
+        mocker.patch.object(Rdp, "open", return_value=0.5)
+
+        tunnels = [Rdp("foo", "first_rdp"), Rdp("foo", "first_rdp")]
+        manager.up(tunnels, launch=False)
+
+        assert tunnels[0].local_port == 60001
+        assert tunnels[1].local_port != 60001
+        assert tunnels[1]._state_key == f"foo_{tunnels[1].local_port}_rdp"
+
+    def test_multiplexed_tunnels_share_a_master(self, manager, mocker):
+        start = mocker.patch.object(ControlMaster, "start", return_value=os.getpid())
+        forward = mocker.patch.object(ControlMaster, "forward")
+        cancel = mocker.patch.object(ControlMaster, "cancel")
+        exit = mocker.patch.object(ControlMaster, "exit")
+        mocker.patch.object(Rdp, "_probe", return_value=True)
+
+        tunnels = [Rdp("foo", "first_rdp"), Rdp("foo", "second_rdp")]
+        for tunnel in tunnels:
+            tunnel._mode = "multiplex"
+        manager.up(tunnels, launch=False)
+
+        assert start.call_count == 2
+        forward.assert_any_call(["-L", "60002:192.168.1.2:3389"])
+        assert list(manager.masters().values()) == [tunnels]
+
+        manager.stop([tunnels[0]])
+        cancel.assert_called_once_with(["-L", "60001:192.168.1.1:3389"])
+        exit.assert_not_called()
+
+        manager.stop([tunnels[1]])
+        exit.assert_called_once()
+
+    def test_probe_runs_in_parallel(self, manager, mocker):
+        def health_probe(timeout):
+            time.sleep(0.2)
+            return True
+
+        tunnels = [Rdp("foo", "first_rdp") for _ in range(20)]
+        for tunnel in tunnels:
+            mocker.patch.object(tunnel, "_health_probe", side_effect=health_probe)
+        tunnels[0]._health_probe.side_effect = lambda timeout: False
+
+        started = time.monotonic()
+        health = manager.probe(tunnels)
+
+        assert time.monotonic() - started < 1
+        assert health[tunnels[0]] is None
+        assert all(0.2 <= health[x] < 1 for x in tunnels[1:])
+
+    def test_probe_reports_invalid_tunnels(self, manager, mocker):
+        tunnels = [Rdp("foo", "first_rdp"), Rdp("foo", "first_rdp")]
+        mocker.patch.object(
+            tunnels[0],
+            "_health_probe",
+            side_effect=InvalidProfileError("Invalid probe_target"),
+        )
+        mocker.patch.object(tunnels[1], "_health_probe", return_value=True)
+
+        health = manager.probe(tunnels)
+
+        assert isinstance(health[tunnels[0]], InvalidProfileError)
+        assert isinstance(health[tunnels[1]], float)
+
+    def test_open_times_out(self, manager, mocker):
+        mocker.patch.object(Rdp, "_probe", return_value=False)
+
+        tunnel = Rdp("foo", "first_rdp")
+        mocker.patch.object(Rdp, "_cmd", ["sleep", "10"])
+        tunnel._ready_timeout = 0.2
+
+        with pytest.raises(TunnelTimeoutError):
+            tunnel.open()
+        assert not tunnel.is_running()
+
+    def test_shared_browser_routes(self, manager, mocker, tmp_path, capsys):
+        mocker.patch(
+            "oo_bin.tunnels.socks.main_config",
+            return_value={"tunnels": {"socks": {"shared_browser": True}}},
+        )
+        mocker.patch(
+            "oo_bin.tunnels.tunnel.tunnels_config",
+            side_effect=lambda profile: {
+                "jump_host": f"{profile}.example.com",
+                "urls": ["https://app.example.com/login"],
+                "hosts": ["*.corp.example.com"] if profile == "foo" else [],
+            },
+        )
+
+        mocker.patch(
+            "oo_bin.tunnels.tunnel_manager.running", return_value={os.getpid()}
+        )
+
+        tunnel = manager.add(Socks("foo"))
+        tunnel.pid = os.getpid()
+        tunnel.save()
+        assert tunnel.routes == ["app.example.com", "*.corp.example.com"]
+        assert tunnel.browser_pid is None
+
+        # The tunnel opened last wins a shared route, see Router
+        manager.add(Socks("bar"))
+        assert (
+            "app.example.com now goes through the bar tunnel" in capsys.readouterr().out
+        )
+
+        restored = TunnelManager.__wrapped__(tmp_path).tunnels(type=Socks)
+        assert restored[0].routes == tunnel.routes